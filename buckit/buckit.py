@@ -18,6 +18,7 @@ from textwrap import dedent
 import compiler
 import configure_buck
 import fetch
+import fetchers
 import formatting
 import use_system
 from helpers import BuckitException
@@ -135,11 +136,12 @@ def add_fetch_args(parent_args, subparser):
     parser.add_argument(
         "--package",
         action=EnvDefault,
-        required=True,
+        required=False,
         envvar="npm_package_name",
         help=(
             "The package to configure. Otherwise, pulled from the "
-            "npm_package_name environment variable"
+            "npm_package_name environment variable. Required unless --all "
+            "is set"
         )
     )
     parser.add_argument(
@@ -148,6 +150,67 @@ def add_fetch_args(parent_args, subparser):
         default=False,
         help=("Whether to force a fetch of the source")
     )
+    parser.add_argument(
+        "--materialize",
+        action=EnvDefault,
+        required=True,
+        default="reflink,copy",
+        envvar="BUCKIT_MATERIALIZE",
+        help=(
+            "Comma separated ways to put cached sources into node_modules, "
+            "tried in order: reflink, hardlink, symlink and copy. copy is "
+            "always the last resort. hardlink and symlink share the read-only "
+            "files of the package store in ~/.cache/buckit/store, so they "
+            "break packages that write into their sources, "
+            "like autoconf ones. Can be set with the BUCKIT_MATERIALIZE "
+            "environment variable"
+        )
+    )
+    parser.add_argument(
+        "--pip-wheel-dir",
+        action=EnvDefault,
+        required=True,
+        default=fetchers.DEFAULT_PIP_WHEEL_DIR,
+        envvar="BUCKIT_PIP_WHEEL_DIR",
+        help=(
+            "With --all, the directory that pip packages are installed from. "
+            "Missing wheels are downloaded into it, so an existing directory "
+            "lets pip packages pinned with == be installed offline. Wheels "
+            "of unpinned packages are updated from the index on every run, "
+            "falling back to the ones in the directory. Can be set with the "
+            "BUCKIT_PIP_WHEEL_DIR environment variable"
+        )
+    )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        default=False,
+        help=(
+            "Fetch all packages in the project concurrently, instead of "
+            "only --package. Packages are fetched after their dependencies"
+        )
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=8,
+        help="With --all, how many packages to fetch at once",
+    )
+    parser.add_argument(
+        "--network-jobs",
+        type=int,
+        default=4,
+        help="With --all, how many packages may download at once",
+    )
+    parser.add_argument(
+        "--cpu-jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help=(
+            "With --all, how many packages may extract or copy sources "
+            "at once"
+        ),
+    )
 
 
 def add_buckconfig_args(parent_args, subparser):
@@ -279,7 +342,29 @@ def main(argv):
 
     if args.selected_action == 'buckconfig':
         should_configure_buck = True
+    elif args.selected_action == 'fetch' and args.all:
+        ret = fetch.fetch_all_packages(
+            project_root=project_root,
+            node_modules=args.node_modules,
+            use_python2=args.use_python2,
+            python2_virtualenv=args.python2_virtualenv,
+            python2_virtualenv_root=args.python2_virtualenv_root,
+            use_python3=args.use_python3,
+            python3_virtualenv=args.python3_virtualenv,
+            python3_virtualenv_root=args.python3_virtualenv_root,
+            virtualenv_use_proxy_vars=args.virtualenv_use_proxy_vars,
+            force=args.force,
+            materialize_strategies=args.materialize,
+            pip_wheel_dir=args.pip_wheel_dir,
+            jobs=args.jobs,
+            network_jobs=args.network_jobs,
+            cpu_jobs=args.cpu_jobs,
+        )
+        if ret == 0:
+            should_configure_buck = True
     elif args.selected_action == 'fetch':
+        if not args.package:
+            parser.error("fetch requires --package or --all")
         ret = fetch.fetch_package(
             project_root=project_root,
             node_modules=args.node_modules,
@@ -292,6 +377,7 @@ def main(argv):
             python3_virtualenv_root=args.python3_virtualenv_root,
             virtualenv_use_proxy_vars=args.virtualenv_use_proxy_vars,
             force=args.force,
+            materialize_strategies=args.materialize,
         )
         if ret == 0:
             should_configure_buck = True
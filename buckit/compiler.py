@@ -7,10 +7,13 @@
 # LICENSE file in the root directory of this source tree. An additional grant
 # of patent rights can be found in the PATENTS file in the same directory.
 
+import concurrent.futures
+import json
 import logging
 import os
 import subprocess
 import platform
+import tempfile
 
 from constants import BUCKCONFIG_LOCAL
 from configure_buck import update_config
@@ -52,29 +55,31 @@ def detect_py3():
     return which('python3', get_canonical=True)
 
 
-def detect_python_libs(python):
+def detect_python_paths(python):
+    """
+    Returns a tuple of the lib and include paths of the given interpreter,
+    from a single run of it
+    """
     # We want to strip version and site-packages off from the path to get lib
-    # path
-    return subprocess.check_output([
-        python,
-        '-c',
-        (
-            'from __future__ import print_function; '
-            'from distutils import sysconfig; '
-            'import os; '
-            'print(os.sep.join(sysconfig.get_python_lib().split(os.sep)[:-2]))'
-        )]).decode('utf-8').split('\n')[0]
-
-
-def detect_python_include(python):
-    return subprocess.check_output([
+    # path. distutils is gone in newer pythons, use sysconfig there
+    output = subprocess.check_output([
         python,
         '-c',
         (
-            'from __future__ import print_function; '
-            'from distutils import sysconfig; '
-            'print(sysconfig.get_python_inc())'
-        )]).decode('utf-8').split('\n')[0]
+            'from __future__ import print_function\n'
+            'import os\n'
+            'try:\n'
+            '    from distutils import sysconfig\n'
+            '    lib = sysconfig.get_python_lib()\n'
+            '    include = sysconfig.get_python_inc()\n'
+            'except ImportError:\n'
+            '    import sysconfig\n'
+            '    lib = sysconfig.get_paths()["purelib"]\n'
+            '    include = sysconfig.get_paths()["include"]\n'
+            'print(os.sep.join(lib.split(os.sep)[:-2]))\n'
+            'print(include)\n'
+        )]).decode('utf-8').split('\n')
+    return output[0], output[1]
 
 
 def get_system_lib_paths():
@@ -124,16 +129,14 @@ def detect_cxx():
     return None
 
 
-def detect_c_standard(compiler_cmd):
-    versions = [
-        '-std=gnu11',
-        '-std=c11',
-        '-std=gnu99',
-        '-std=c99',
-    ]
-    for version in versions:
-        logging.debug("Checking %s support for -std=%s", compiler_cmd, version)
-        cmd = [compiler_cmd, version, '-x', 'c', '-']
+def supports_standard(compiler_cmd, language, version):
+    logging.debug("Checking %s support for -std=%s", compiler_cmd, version)
+    # Compilers are probed concurrently, so each probe needs its own a.out
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cmd = [
+            compiler_cmd, version, '-x', language, '-', '-o',
+            os.path.join(tmp_dir, 'a.out')
+        ]
         proc = subprocess.Popen(
             cmd,
             stdin=subprocess.PIPE,
@@ -143,17 +146,36 @@ def detect_c_standard(compiler_cmd):
         stdout, stderr = proc.communicate(
             'int main() { return 0; }'.encode('utf-8')
         )
-        if proc.returncode != 0:
-            logging.debug(
-                "Got return code %s, output: %s. trying next", proc.returncode,
-                stdout
-            )
-        else:
+    if proc.returncode != 0:
+        logging.debug(
+            "Got return code %s, output: %s. trying next", proc.returncode,
+            stdout
+        )
+        return False
+    return True
+
+
+def detect_standard(compiler_cmd, language, versions):
+    """
+    Returns the first of versions that compiler_cmd supports, or None
+    """
+    for version in versions:
+        if supports_standard(compiler_cmd, language, version):
             return version
 
     return None
 
 
+def detect_c_standard(compiler_cmd):
+    versions = [
+        '-std=gnu11',
+        '-std=c11',
+        '-std=gnu99',
+        '-std=c99',
+    ]
+    return detect_standard(compiler_cmd, 'c', versions)
+
+
 def detect_cxx_standard(compiler_cmd):
     versions = [
         # '-std=gnu++1z',
@@ -165,27 +187,71 @@ def detect_cxx_standard(compiler_cmd):
         '-std=gnu++11',
         '-std=c++11',
     ]
-    for version in versions:
-        logging.debug("Checking %s support for -std=%s", compiler_cmd, version)
-        cmd = [compiler_cmd, version, '-x', 'c++', '-']
-        proc = subprocess.Popen(
-            cmd,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT
-        )
-        stdout, stderr = proc.communicate(
-            'int main() { return 0; }'.encode('utf-8')
-        )
-        if proc.returncode != 0:
-            logging.debug(
-                "Got return code %s, output: %s. trying next", proc.returncode,
-                stdout
-            )
-        else:
-            return version
+    return detect_standard(compiler_cmd, 'c++', versions)
 
-    return None
+
+def get_probe_cache_path():
+    return os.path.join(
+        os.path.expanduser('~'), '.cache', 'buckit', 'toolchain_probes.json'
+    )
+
+
+def load_probe_cache(cache_path):
+    try:
+        with open(cache_path, 'r') as fin:
+            return json.load(fin)
+    except (OSError, ValueError) as e:
+        logging.debug("Could not read probe cache at %s: %s", cache_path, e)
+        return {}
+
+
+def save_probe_cache(cache_path, cache):
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = '{}.{}'.format(cache_path, os.getpid())
+        with open(tmp_path, 'w') as fout:
+            json.dump(cache, fout, indent=2, sort_keys=True)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logging.warning(
+            "Could not write probe cache at %s: %s", cache_path, e)
+
+
+def is_script(fpath):
+    try:
+        with open(fpath, 'rb') as fin:
+            return fin.read(2) == b'#!'
+    except OSError:
+        return False
+
+
+def cached_probe(cache, name, tool, probe):
+    """
+    Returns probe(tool), or the value that it returned before if tool is found
+    at the same path, that path resolves to the same binary, and that binary
+    has the same size and mtime as back then. Updates cache with new values
+
+    Both paths are part of the key because wrappers like ccache behave
+    differently depending on the name they are run as. Scripts such as pyenv
+    shims pick the real tool when they run, so they are always probed.
+    """
+    tool_path = which(tool)
+    if not tool_path:
+        return probe(tool)
+    real_path = os.path.realpath(tool_path)
+    if is_script(real_path):
+        logging.debug("Not caching %s for script %s", name, tool_path)
+        return probe(tool_path)
+    stat = os.stat(real_path)
+    key = '{}:{}:{}'.format(name, tool_path, real_path)
+    fingerprint = [stat.st_size, stat.st_mtime_ns]
+    entry = cache.get(key)
+    if entry and entry['fingerprint'] == fingerprint:
+        logging.debug("Using cached %s for %s", name, tool_path)
+        return entry['value']
+    value = probe(tool_path)
+    cache[key] = {'fingerprint': fingerprint, 'value': value}
+    return value
 
 
 def configure_compiler(project_root):
@@ -204,25 +270,39 @@ def configure_compiler(project_root):
         logging.warn("Could not find clang or g++ in PATH")
         return 0
 
-    c_standard = detect_c_standard(cc)
+    # Toolchains rarely change, so only probe the ones we have not seen
+    # before, and probe those at the same time
+    cache_path = get_probe_cache_path()
+    cache = load_probe_cache(cache_path)
+    py2 = detect_py2()
+    py3 = detect_py3()
+    with concurrent.futures.ThreadPoolExecutor(4) as pool:
+        c_standard = pool.submit(
+            cached_probe, cache, 'c_standard', cc, detect_c_standard)
+        cxx_standard = pool.submit(
+            cached_probe, cache, 'cxx_standard', cxx, detect_cxx_standard)
+        py2_paths = pool.submit(
+            cached_probe, cache, 'python_paths', py2, detect_python_paths
+        ) if py2 else None
+        py3_paths = pool.submit(
+            cached_probe, cache, 'python_paths', py3, detect_python_paths
+        ) if py3 else None
+        c_standard = c_standard.result()
+        cxx_standard = cxx_standard.result()
+        py2_libs, py2_include = py2_paths.result() if py2 else (None, None)
+        py3_libs, py3_include = py3_paths.result() if py3 else (None, None)
+    save_probe_cache(cache_path, cache)
+
     if c_standard:
         cflags = [c_standard]
     else:
         cflags = []
 
-    cxx_standard = detect_cxx_standard(cxx)
     if cxx_standard:
         cxxflags = [cxx_standard]
     else:
         cxxflags = []
 
-    py2 = detect_py2()
-    py3 = detect_py3()
-    py2_include = detect_python_include(py2)
-    py2_libs = detect_python_libs(py2)
-    py3_include = detect_python_include(py3)
-    py3_libs = detect_python_libs(py3)
-
     to_set = {
         'cxx': {
             'cflags': cflags + ['-pthread', '-g'],
@@ -7,6 +7,7 @@
 # LICENSE file in the root directory of this source tree. An additional grant
 # of patent rights can be found in the PATENTS file in the same directory.
 
+import concurrent.futures
 import configparser
 import contextlib
 import fcntl
@@ -14,7 +15,9 @@ import io
 import json
 import logging
 import os
+import tempfile
 import threading
+import time
 from collections import defaultdict, namedtuple
 
 import compiler
@@ -26,6 +29,7 @@ PackageInfo = namedtuple(
     ['name', 'cell_name', 'cell_alias', 'absolute_path', 'includes_info']
 )
 IncludesInfo = namedtuple('IncludesInfo', ['path', 'whitelist_functions'])
+LoadedConfig = namedtuple('LoadedConfig', ['original_contents', 'config'])
 
 BUCKCONFIG_HEADER = r'''
 # This configuration file was updated by buckit. Manual changes
@@ -38,6 +42,8 @@ BUCKCONFIG_HEADER = r'''
 
 __file_lock_counts = defaultdict(int)
 __mutex = threading.RLock()
+# package.json path -> ((mtime, size), parsed json)
+__package_json_cache = {}
 
 
 @contextlib.contextmanager
@@ -113,7 +119,8 @@ def __update_config(
         new_properties,
         override=False,
         merge=None,
-        removed_properties=None):
+        removed_properties=None,
+        configs=None):
     """
     Take a dictionary of {section : {key: [values] (or a string value)}}
     and set it in a .buckconfig style file. No locking is done in this method
@@ -129,11 +136,14 @@ def __update_config(
         removed_properties - If provided, a dictionary of {section:[properties]}
                              to remove from the config. This is applied after
                              updates provided in `new_properties`
+        configs - If provided, a dictionary of paths to LoadedConfig from
+                  a transaction (see __write_configs). The update is only
+                  applied in memory, and the file is not written
     """
     merge = merge or {}
-    config = configparser.ConfigParser()
-    if os.path.exists(buckconfig):
-        config.read(buckconfig)
+    in_transaction = configs is not None
+    configs = configs if in_transaction else {}
+    config = __load_config(buckconfig, configs)
     logging.debug("Updating file at %s", buckconfig)
     for section, kvs in new_properties.items():
         if not config.has_section(section):
@@ -151,11 +161,12 @@ def __update_config(
                                 for x in config.get(section, key, fallback='')
                                 .split(merge_delimiter)
                             )
-                        )
+                        ) - {''}
 
                     else:
                         existing = set()
-                    str_value = merge_delimiter.join(existing | set(value))
+                    str_value = merge_delimiter.join(
+                        sorted(existing | set(value)))
                 else:
                     str_value = ' '.join(value)
                 logging.debug("Setting %s.%s to %s", section, key, str_value)
@@ -171,12 +182,73 @@ def __update_config(
                 for key in keys:
                     config.remove_option(section, key)
 
-    with open(buckconfig, 'w') as fout:
-        fout.write(BUCKCONFIG_HEADER)
-        config.write(fout)
+    if not in_transaction:
+        __write_configs(configs)
     logging.debug("Updated file at %s", buckconfig)
 
 
+def __load_config(buckconfig, configs):
+    """
+    Returns the ConfigParser for buckconfig from configs, parsing the file
+    and adding it to configs if it has not been loaded yet
+    """
+    loaded = configs.get(buckconfig)
+    if loaded is None:
+        original_contents = None
+        if os.path.exists(buckconfig):
+            with open(buckconfig, 'r') as fin:
+                original_contents = fin.read()
+        config = configparser.ConfigParser()
+        config.read_string(original_contents or '', buckconfig)
+        loaded = LoadedConfig(original_contents, config)
+        configs[buckconfig] = loaded
+    return loaded.config
+
+
+def __write_config_contents(buckconfig, contents, original_contents):
+    """
+    Writes contents to buckconfig through a temporary file and a rename, so
+    that buck never sees a partially written file. Nothing is written if
+    the file already has those contents, so that its mtime does not change.
+
+    Returns whether the file was written
+    """
+    if contents == original_contents:
+        logging.debug("%s did not change, not writing it", buckconfig)
+        return False
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(buckconfig)),
+        prefix='.' + os.path.basename(buckconfig) + '.')
+    try:
+        with os.fdopen(fd, 'w') as fout:
+            fout.write(contents)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, buckconfig)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return True
+
+
+def __write_configs(configs):
+    """
+    Writes every config that was loaded into configs by __load_config, if
+    its contents changed
+
+    Returns the number of files that were written
+    """
+    written = 0
+    for buckconfig, loaded in configs.items():
+        contents = io.StringIO()
+        contents.write(BUCKCONFIG_HEADER)
+        loaded.config.write(contents)
+        if __write_config_contents(
+            buckconfig, contents.getvalue(), loaded.original_contents
+        ):
+            written += 1
+    return written
+
+
 def parse_package_info(package_path):
     """
     Try to get the package info from the package.json inside of package_path
@@ -278,7 +350,9 @@ def find_project_root(start_path, node_modules=None):
     return package_path
 
 
-def __update_root_buckconfig(project_root, package_info, is_root_dep):
+def __update_root_buckconfig(
+    project_root, package_info, is_root_dep, configs=None
+):
     """
     Updates the root .buckconfig with `cell=alias` in the repositories section
     """
@@ -310,11 +384,14 @@ def __update_root_buckconfig(project_root, package_info, is_root_dep):
         to_set[buildfile]['includes'] = new_includes
 
     __update_config(
-        buckconfig, to_set, merge={'{}.{}'.format(project, whitelist_key): ','}
+        buckconfig,
+        to_set,
+        merge={'{}.{}'.format(project, whitelist_key): ','},
+        configs=configs
     )
 
 
-def __update_root_buckconfig_local(project_root, package_info):
+def __update_root_buckconfig_local(project_root, package_info, configs=None):
     """
     Updates the root .buckconfig with `alias=path_relative_to_root` in the
     repository_aliases section
@@ -328,14 +405,19 @@ def __update_root_buckconfig_local(project_root, package_info):
         'repository_aliases': {package_info.cell_alias: relative_path},
         'log': {'buckconfig_local_warning_enabled': 'false'},
     }
-    __update_config(buckconfig_local, to_set)
+    __update_config(buckconfig_local, to_set, configs=configs)
 
 
-def __update_packages_buckconfig_local(project_root):
+def __update_packages_buckconfig_local(project_root, jobs=None):
     """
     Updates all .buckconfig.local files in all directories specified in
     the root's repository_aliases section. This copies the root
     .buckconfig.local, and makes all of the paths relative to the cell
+
+    The contents of each cell's file are computed first, and the file is
+    only written if they differ from what is on disk, so that buck does not
+    have to reparse cells whose configuration did not change. Files are
+    handled in a pool of `jobs` threads (the executor's default if None)
     """
     buckconfig_root = os.path.join(project_root, BUCKCONFIG)
     root_config = configparser.ConfigParser()
@@ -364,78 +446,141 @@ def __update_packages_buckconfig_local(project_root):
 
     config_string = io.StringIO()
     config.write(config_string)
+    config_string = config_string.getvalue()
+    platform = compiler.get_current_platform_flavor()
+    # The absolute path of every cell, which each cell's file refers to
+    # relative to itself
+    cell_paths = [
+        (cell_alias, os.path.abspath(os.path.join(project_root, path)))
+        for cell_alias, path in config.items(section)
+    ]
+
+    start = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = []
+        for alias, package_path in config.items(section):
+            # For all cells, make sure they have a copy of the
+            # .buckconfig.local. Update its paths to have proper relative
+            # paths, rather than the ones copied from the root
+            package_path = os.path.join(project_root, package_path)
+            if not os.path.exists(package_path):
+                logging.debug("Package path %s does not exist", package_path)
+                continue
+            futures.append(
+                pool.submit(
+                    __update_package_buckconfig_local,
+                    buckconfig_local,
+                    config_string,
+                    cell_paths,
+                    package_path,
+                    root_repositories.get(alias),
+                    platform,
+                )
+            )
+        changed = sum(future.result() for future in futures)
 
-    for alias, package_path in config.items(section):
-        # For all cells, make sure they have a copy of the .buckconfig.local.
-        # Update its paths to have proper relative paths, rather than the ones
-        # copied from the root
-        package_path = os.path.join(project_root, package_path)
-        if not os.path.exists(package_path):
-            logging.debug("Package path %s does not exist", package_path)
-            continue
+    logging.info(
+        "{bold}Updated .buckconfig.local in %s cells in %.2fs, %s were "
+        "already up to date{clear}", changed, time.time() - start,
+        len(futures) - changed)
 
-        package_buckconfig_local = os.path.join(package_path, BUCKCONFIG_LOCAL)
-        package_config = configparser.ConfigParser()
-        config_string.seek(0)
-        package_config.read_file(config_string)
 
-        logging.debug(
-            "Updating .buckconfig.local at %s", package_buckconfig_local
-        )
-
-        for cell_alias, root_relative_path in package_config.items(section):
-            relative_path = os.path.relpath(
-                os.path.abspath(os.path.join(project_root, root_relative_path)),
-                os.path.abspath(package_path)
-            )
-            package_config.set(section, cell_alias, relative_path)
-
-        # If a section ends in #buckit-<platform> or #buckit-<cell>-<platform>
-        # copy that section into <section>#platform instead. This lets us
-        # override specific sections for third party or single cells, but
-        # does not make us change all of the other platform sections, which
-        # would be the case if we set the default_platform (e.g. setting a
-        # cxx platform would mean we would have to set python sections up
-        # as well)
-        cell = root_repositories.get(alias)
-        if cell:
-            platform = compiler.get_current_platform_flavor()
-            general_override = '#buckit-' + platform
-            package_override = '#buckit-{}-{}'.format(cell, platform)
-            for src_section in list(package_config.sections()):
-                if src_section.endswith(package_override):
-                    base = src_section[:-len(package_override)]
-                elif src_section.endswith(general_override):
-                    base = src_section[:-len(general_override)]
-                    package_section = '{}#{}'.format(base, package_override)
-                    if package_config.has_section(package_section):
-                        continue
-                else:
-                    continue
+def __update_package_buckconfig_local(
+    buckconfig_local, config_string, cell_paths, package_path, cell, platform
+):
+    """
+    Writes the .buckconfig.local of the cell in package_path, given the
+    contents of the root .buckconfig.local and the absolute paths of its
+    repository_aliases, if it changed
 
-                dest_section = '{}#{}'.format(base, platform)
+    Returns whether the file was written
+    """
+    section = 'repository_aliases'
+    package_buckconfig_local = os.path.join(package_path, BUCKCONFIG_LOCAL)
+    package_config = configparser.ConfigParser()
+    package_config.read_string(config_string, buckconfig_local)
 
-                logging.debug(
-                    'Overwriting section %s in %s with %s from %s',
-                    dest_section, package_buckconfig_local, src_section,
-                    buckconfig_local)
+    logging.debug("Updating .buckconfig.local at %s", package_buckconfig_local)
 
-                package_config.remove_section(dest_section)
-                package_config.add_section(dest_section)
+    package_path = os.path.abspath(package_path)
+    for cell_alias, cell_path in cell_paths:
+        package_config.set(
+            section, cell_alias, os.path.relpath(cell_path, package_path)
+        )
 
-                for k, v in package_config.items(src_section):
-                    package_config.set(dest_section, k, v)
-                package_config.remove_section(src_section)
+    # If a section ends in #buckit-<platform> or #buckit-<cell>-<platform>
+    # copy that section into <section>#platform instead. This lets us
+    # override specific sections for third party or single cells, but
+    # does not make us change all of the other platform sections, which
+    # would be the case if we set the default_platform (e.g. setting a
+    # cxx platform would mean we would have to set python sections up
+    # as well)
+    if cell:
+        general_override = '#buckit-' + platform
+        package_override = '#buckit-{}-{}'.format(cell, platform)
+        for src_section in list(package_config.sections()):
+            if src_section.endswith(package_override):
+                base = src_section[:-len(package_override)]
+            elif src_section.endswith(general_override):
+                base = src_section[:-len(general_override)]
+                package_section = '{}#{}'.format(base, package_override)
+                if package_config.has_section(package_section):
+                    continue
+            else:
+                continue
 
-        with open(package_buckconfig_local, 'w') as fout:
-            fout.write(BUCKCONFIG_HEADER)
-            package_config.write(fout)
-            fout.flush()
+            dest_section = '{}#{}'.format(base, platform)
 
+            logging.debug(
+                'Overwriting section %s in %s with %s from %s',
+                dest_section, package_buckconfig_local, src_section,
+                buckconfig_local)
+
+            package_config.remove_section(dest_section)
+            package_config.add_section(dest_section)
+
+            for k, v in package_config.items(src_section):
+                package_config.set(dest_section, k, v)
+            package_config.remove_section(src_section)
+
+    contents = io.StringIO()
+    contents.write(BUCKCONFIG_HEADER)
+    package_config.write(contents)
+    original_contents = None
+    if os.path.exists(package_buckconfig_local):
+        with open(package_buckconfig_local, 'r') as fin:
+            original_contents = fin.read()
+    written = __write_config_contents(
+        package_buckconfig_local, contents.getvalue(), original_contents
+    )
+    if written:
         logging.debug(
             "{bold}Updated .buckconfig.local at %s{clear}",
             package_buckconfig_local
         )
+    return written
+
+
+def __load_package_json(package_json):
+    """
+    Returns the parsed package_json, or None if it does not exist. Parsed
+    files are cached until their mtime or size changes, so callers must not
+    modify the returned object
+    """
+    try:
+        stat = os.stat(package_json)
+    except FileNotFoundError:
+        return None
+    key = (stat.st_mtime_ns, stat.st_size)
+    with __mutex:
+        cached = __package_json_cache.get(package_json)
+    if cached and cached[0] == key:
+        return cached[1]
+    with open(package_json, 'r') as fin:
+        js = json.loads(fin.read())
+    with __mutex:
+        __package_json_cache[package_json] = (key, js)
+    return js
 
 
 def find_package_paths(
@@ -448,43 +593,69 @@ def find_package_paths(
     Find all the packages in a given project root, return information about
     each of those packages.
 
+    Each package.json is parsed once, and every package is only walked the
+    first time it is found, so shared dependencies are not walked again
+
     Arguments:
         project_root - The root path of the main project
         node_modules - The name of the node_modules directory in project_root
         package_name - The name of the package underneath node_modules, or
                        empty if the root package.json should be examined
-        already_found - A list of package names that have already been
-                        investigated. Used for cycle detection
+        already_found - A list of package names that are being investigated.
+                        Used for cycle detection
 
     Returns a tuple of (
         dictionary of package names to paths,
         set of all of root's direct dependencies,
-        dictionary of package names to original parsed json
+        dictionary of package names to original parsed json. These are
+        shared between calls, and should not be modified
     )
     """
     already_found = already_found or []
+    paths = {}
     jsons = {}
+    visited = set()
+
+    def package_root(name):
+        return os.path.join(project_root, node_modules, name)
+
+    def walk(deps):
+        for dep in deps:
+            if dep in already_found:
+                raise BuckitException(
+                    'Found a cycle when finding dependencies: {}',
+                    ' -> '.join(already_found))
+            if dep in visited:
+                continue
+            visited.add(dep)
+            dep_root = package_root(dep)
+            package_json = os.path.join(dep_root, PACKAGE_JSON)
+            dep_js = __load_package_json(package_json)
+            if dep_js is None:
+                logging.debug(
+                    "Could not find a json file at %s for package %s",
+                    package_json, dep)
+                continue
+            already_found.append(dep)
+            walk(dep_js.get('dependencies', {}))
+            del already_found[-1]
+            paths[dep] = dep_root
+            jsons[dep] = dep_js
+
     if package_name:
         # Look for cells that have compiled artifacts first
-        package_root = os.path.join(project_root, node_modules, package_name)
-        package_json = os.path.join(package_root, PACKAGE_JSON)
+        package_json = os.path.join(package_root(package_name), PACKAGE_JSON)
     else:
         package_json = os.path.join(project_root, PACKAGE_JSON)
-
-    if os.path.exists(package_json):
-        with open(package_json, 'r') as fin:
-            js = json.loads(fin.read())
-    elif package_name:
-        logging.debug(
-            "Could not find a json file at %s for package %s", package_json,
-            package_name)
-        return {}, set(), jsons
-    else:
+    js = __load_package_json(package_json)
+    if js is None:
+        if package_name:
+            logging.debug(
+                "Could not find a json file at %s for package %s",
+                package_json, package_name)
+            return {}, set(), jsons
         js = {}
 
-    paths = {}
-    root_deps = set()
-
     # When a package is first added with yarn add, it will not be present
     # in package.json in the project root. It will, however, be mentioned in
     # environment variables. So, grab from there and make sure that we find
@@ -499,25 +670,13 @@ def find_package_paths(
     js_deps = js.get('dependencies', {}).copy()
     js_deps.update(env_deps)
 
-    for dep in js_deps:
-        if dep in already_found:
-            raise BuckitException(
-                'Found a cycle when finding dependencies: {}',
-                ' -> '.join(already_found))
-        already_found.append(dep)
-        dep_paths, ignore, dep_jsons = find_package_paths(
-            project_root, node_modules, dep, already_found
-        )
-        paths.update(dep_paths)
-        jsons.update(dep_jsons)
-        if not package_name:
-            root_deps.add(dep)
-        del already_found[-1]
+    walk(js_deps)
 
     if package_name:
-        paths[package_name] = package_root
+        paths[package_name] = package_root(package_name)
         jsons[package_name] = js
-    return paths, root_deps, jsons
+        return paths, set(), jsons
+    return paths, set(js_deps), jsons
 
 
 def configure_buck_for_all_packages(project_root, node_modules):
@@ -526,21 +685,32 @@ def configure_buck_for_all_packages(project_root, node_modules):
     includes all transitive dependencies as well
 
     File locking is done to avoid this method being run by multiple processes
-    at once
+    at once. The root .buckconfig and .buckconfig.local are each read once,
+    updated in memory for all packages, and written at most once
 
     Arguments:
         project_root - The root path of the main project
         node_modules - The name of the node_modules directory in project_root
     """
     with __lockfile(project_root):
+        start = time.time()
         package_paths, root_deps, jsons = find_package_paths(
             project_root, node_modules
         )
 
+        configs = {}
         for package_name, package_path in package_paths.items():
-            configure_buck_for_package(
-                project_root, package_name, package_path, root_deps, False
+            package_info = parse_package_info(package_path.rstrip('/'))
+            __update_root_buckconfig(
+                project_root, package_info, package_name in root_deps, configs
             )
+            __update_root_buckconfig_local(project_root, package_info, configs)
+        written = __write_configs(configs)
+        logging.info(
+            "{bold}Configured %s packages in %.2fs, writing %s of %s root "
+            "config files{clear}", len(package_paths), time.time() - start,
+            written, len(configs))
+
         __update_packages_buckconfig_local(project_root)
 
     return 0
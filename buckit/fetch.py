@@ -1,13 +1,20 @@
+import concurrent.futures
 import json
 import os
 import logging
 import shlex
+import threading
+import time
 
 from collections import namedtuple
 
+import configure_buck
 from constants import PACKAGE_JSON
 from helpers import BuckitException
-from fetchers import PipFetcher, HttpTarballFetcher, GitFetcher
+from fetchers import (
+    CachedFetcher, FetchSlots, GitFetcher, HttpTarballFetcher,
+    MATERIALIZE_STRATEGIES, PipFetcher,
+)
 
 PythonSettings = namedtuple(
     'PythonSettings', [
@@ -93,14 +100,34 @@ def get_fetcher_from_repository(package_name, package_root, python_settings):
             package_json)
 
 
-def fetch_package(
-    project_root, node_modules, package, use_python2, python2_virtualenv,
-    python2_virtualenv_root, use_python3, python3_virtualenv,
-    python3_virtualenv_root, virtualenv_use_proxy_vars, force
-):
-    node_modules = os.path.realpath(os.path.join(project_root, node_modules))
-    package_root = get_package_root(node_modules, package)
+def has_fetchable_repository(js):
+    """
+    Whether a parsed package.json describes source that buckit can fetch
+    """
+    repository = js.get('repository')
+    if not isinstance(repository, dict):
+        return False
+    return 'pip_info' in repository or \
+        repository.get('type') in ('git', 'tarball')
+
+
+def parse_materialize_strategies(strategies):
+    """
+    Parses a comma separated list of MATERIALIZE_STRATEGIES
+    """
+    ret = tuple(s.strip() for s in strategies.split(',') if s.strip())
+    unknown = [s for s in ret if s not in MATERIALIZE_STRATEGIES]
+    if unknown:
+        raise BuckitException(
+            "Unknown materialization strategies {}, expected some of {}",
+            ', '.join(unknown), ', '.join(MATERIALIZE_STRATEGIES))
+    return ret
+
 
+def get_python_settings(
+    project_root, use_python2, python2_virtualenv, python2_virtualenv_root,
+    use_python3, python3_virtualenv, python3_virtualenv_root
+):
     if not os.path.isabs(python2_virtualenv_root):
         python2_virtualenv_root = os.path.join(
             project_root, python2_virtualenv_root
@@ -110,7 +137,7 @@ def fetch_package(
             project_root, python3_virtualenv_root
         )
 
-    python_settings = PythonSettings(
+    return PythonSettings(
         use_python2,
         use_python3,
         shlex.split(python2_virtualenv),
@@ -118,6 +145,22 @@ def fetch_package(
         shlex.split(python3_virtualenv),
         python3_virtualenv_root,
     )
+
+
+def fetch_package(
+    project_root, node_modules, package, use_python2, python2_virtualenv,
+    python2_virtualenv_root, use_python3, python3_virtualenv,
+    python3_virtualenv_root, virtualenv_use_proxy_vars, force,
+    materialize_strategies
+):
+    node_modules = os.path.realpath(os.path.join(project_root, node_modules))
+    package_root = get_package_root(node_modules, package)
+
+    python_settings = get_python_settings(
+        project_root, use_python2, python2_virtualenv,
+        python2_virtualenv_root, use_python3, python3_virtualenv,
+        python3_virtualenv_root
+    )
     fetcher, dest_dir = get_fetcher_from_repository(
         package, package_root, python_settings
     )
@@ -126,14 +169,178 @@ def fetch_package(
         PipFetcher: virtualenv_use_proxy_vars,
     }
 
+    fetch_kwargs = {}
+    if isinstance(fetcher, CachedFetcher):
+        fetch_kwargs['materialize_strategies'] = \
+            parse_materialize_strategies(materialize_strategies)
+
     if fetcher.should_fetch(dest_dir, force):
         fetcher.fetch(
             project_root,
             dest_dir,
-            use_proxy=use_proxy.get(type(fetcher), True))
+            use_proxy=use_proxy.get(type(fetcher), True),
+            **fetch_kwargs)
     else:
         logging.info(
             "{bold}Destination directory %s already exists, not fetching. "
             "Use --force to force a fetch of the source{clear}", dest_dir
         )
     return 0
+
+
+def fetch_all_packages(
+    project_root, node_modules, use_python2, python2_virtualenv,
+    python2_virtualenv_root, use_python3, python3_virtualenv,
+    python3_virtualenv_root, virtualenv_use_proxy_vars, force,
+    materialize_strategies, pip_wheel_dir, jobs, network_jobs, cpu_jobs
+):
+    """
+    Fetches every package in the project that has a fetchable repository,
+    up to `jobs` at a time. A package is only fetched once all of its
+    dependencies have been. At most `network_jobs` packages download, and
+    at most `cpu_jobs` packages extract or copy sources at the same time.
+
+    Pip packages are first installed together, with one `pip install` per
+    virtualenv from the wheels in pip_wheel_dir (see
+    PipFetcher.batch_install).
+
+    The root .buckconfig is only updated once, after all fetches finish.
+
+    Returns 0 if every package was fetched, 1 otherwise
+    """
+    materialize_strategies = \
+        parse_materialize_strategies(materialize_strategies)
+    package_paths, _, jsons = configure_buck.find_package_paths(
+        project_root, node_modules
+    )
+    python_settings = get_python_settings(
+        project_root, use_python2, python2_virtualenv,
+        python2_virtualenv_root, use_python3, python3_virtualenv,
+        python3_virtualenv_root
+    )
+    slots = FetchSlots(
+        threading.BoundedSemaphore(network_jobs),
+        threading.BoundedSemaphore(cpu_jobs),
+    )
+    # Packages without a repository (e.g. ones that only contain macros) are
+    # still part of the graph, so that their dependents wait for their
+    # dependencies
+    remaining_deps = {
+        package:
+        set(jsons[package].get('dependencies', {})) & package_paths.keys()
+        for package in package_paths
+    }
+    to_fetch = {
+        package for package in package_paths
+        if has_fetchable_repository(jsons[package])
+    }
+    read_only_paths = []
+    failed = set()
+    fetched = []
+    results_lock = threading.Lock()
+    start = time.time()
+
+    fetchers = {
+        package: get_fetcher_from_repository(
+            package, package_paths[package], python_settings
+        )
+        for package in sorted(to_fetch)
+    }
+    pip_fetchers = [
+        fetcher for fetcher, dest_dir in fetchers.values()
+        if isinstance(fetcher, PipFetcher) and
+        fetcher.should_fetch(dest_dir, force)
+    ]
+    if pip_fetchers:
+        try:
+            PipFetcher.batch_install(
+                pip_fetchers, virtualenv_use_proxy_vars, pip_wheel_dir, slots
+            )
+        except Exception:
+            # Failures will show up again below, for the packages that
+            # caused them
+            logging.exception(
+                "{red}Could not install all pip packages at once, installing "
+                "them one by one{clear}")
+
+    def fetch_one(package):
+        if package not in to_fetch:
+            return
+        fetcher, dest_dir = fetchers[package]
+        if not fetcher.should_fetch(dest_dir, force):
+            logging.info(
+                "{bold}Destination directory %s already exists, not "
+                "fetching %s{clear}", dest_dir, package)
+            return
+        package_start = time.time()
+        if isinstance(fetcher, PipFetcher):
+            fetcher.fetch(
+                project_root, dest_dir, use_proxy=virtualenv_use_proxy_vars,
+                slots=slots, update_buckconfig=False)
+        else:
+            fetcher.fetch(
+                project_root, dest_dir, use_proxy=True, slots=slots,
+                materialize_strategies=materialize_strategies)
+        with results_lock:
+            if isinstance(fetcher, PipFetcher):
+                read_only_paths.extend(fetcher.read_only_paths(dest_dir))
+            fetched.append(package)
+            logging.info(
+                "{bold}[%s/%s] Fetched %s in %.1fs{clear}", len(fetched),
+                len(to_fetch), package, time.time() - package_start)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        running = {}
+        while remaining_deps or running:
+            ready = sorted(
+                package for package, deps in remaining_deps.items()
+                if not deps
+            )
+            for package in ready:
+                del remaining_deps[package]
+                running[pool.submit(fetch_one, package)] = package
+            if not running:
+                raise BuckitException(
+                    "Found a cycle between packages: {}",
+                    ', '.join(sorted(remaining_deps)))
+
+            finished, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                package = running.pop(future)
+                try:
+                    future.result()
+                except Exception:
+                    logging.exception(
+                        "{red}Could not fetch %s{clear}", package)
+                    failed.add(package)
+                    _skip_dependents(remaining_deps, package, failed)
+                for deps in remaining_deps.values():
+                    deps.discard(package)
+
+    if read_only_paths:
+        PipFetcher.update_read_only_paths(project_root, read_only_paths)
+    logging.info(
+        "{bold}Fetched %s of %s packages in %.1fs{clear}", len(fetched),
+        len(to_fetch), time.time() - start)
+    return 1 if failed else 0
+
+
+def _skip_dependents(remaining_deps, package, failed):
+    """
+    Removes all packages that transitively depend on a failed package from
+    remaining_deps, and marks them as failed
+    """
+    dependents = [
+        dependent for dependent, deps in remaining_deps.items()
+        if package in deps
+    ]
+    for dependent in dependents:
+        if dependent not in remaining_deps:
+            continue
+        logging.error(
+            "{red}Not fetching %s, since its dependency %s failed{clear}",
+            dependent, package)
+        failed.add(dependent)
+        del remaining_deps[dependent]
+        _skip_dependents(remaining_deps, dependent, failed)
@@ -7,17 +7,28 @@
 # LICENSE file in the root directory of this source tree. An additional grant
 # of patent rights can be found in the PATENTS file in the same directory.
 
+import contextlib
+import csv
+import fcntl
 import glob
 import hashlib
+import json
 import logging
 import os
 import platform
+import re
 import shlex
 import shutil
+import stat
 import subprocess
+import tarfile
 import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
 
-from collections import namedtuple
+from collections import defaultdict, namedtuple
 
 from configure_buck import find_project_root, update_config
 from constants import BUCKFILE, BUCKCONFIG
@@ -36,16 +47,293 @@ PipPythonSettings = namedtuple(
 )
 
 
+# While fetching many packages at once, each of these is a semaphore that
+# bounds how many network-heavy (clone, download) and how many CPU-heavy
+# (extract, copy) steps may run at the same time
+FetchSlots = namedtuple('FetchSlots', ['network', 'cpu'])
+
+# Where `fetch --all` keeps the wheels of pip packages, so that later
+# installs can be done offline
+DEFAULT_PIP_WHEEL_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'buckit', 'wheels'
+)
+
+# Packages that share a virtualenv must not pip install into it concurrently
+_virtualenv_locks = defaultdict(threading.Lock)
+_virtualenv_locks_mutex = threading.Lock()
+
+
+def _write_if_changed(path, contents):
+    """
+    Writes contents to path through a temporary file and a rename, unless
+    the file already has those contents. Returns whether it was written
+    """
+    try:
+        with open(path, 'r') as fin:
+            if fin.read() == contents:
+                return False
+    except FileNotFoundError:
+        pass
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix='.' + os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, 'w') as fout:
+            fout.write(contents)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return True
+
+
+def _slot(slots, kind):
+    """
+    Returns a context manager that holds one of the `kind` slots, or does
+    nothing if slots is None (i.e. only one package is being fetched)
+    """
+    if slots is None:
+        return contextlib.ExitStack()
+    return getattr(slots, kind)
+
+
+def _virtualenv_lock(virtualenv_root):
+    with _virtualenv_locks_mutex:
+        return _virtualenv_locks[os.path.realpath(virtualenv_root)]
+
+
+# Linux's FICLONE ioctl, which makes dst share all of src's extents
+FICLONE = 0x40049409
+
+# Ways to materialize a cached package in a project, in the order in which
+# they can be tried. reflink and copy give every project its own mutable
+# sources. hardlink and symlink share the read-only files of the package
+# store, so they break packages whose builds write into their sources, like
+# autoconf ones. Thus, they are not used by default.
+MATERIALIZE_STRATEGIES = ('reflink', 'hardlink', 'symlink', 'copy')
+DEFAULT_MATERIALIZE_STRATEGIES = ('reflink', 'copy')
+
+# The strategies that share the files of the store instead of copying them
+STORE_STRATEGIES = ('hardlink', 'symlink')
+
+# Where the read-only copies of cached packages that hardlink and symlink
+# share live. Entries are named after the sha256 of their contents
+DEFAULT_STORE_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'buckit', 'store'
+)
+
+_WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+
+
+class _StrategyFailed(Exception):
+    """
+    Raised from copytree's copy_function, which makes it stop right away
+    instead of collecting an OSError for every file
+    """
+
+
+def _rmtree(path):
+    """
+    Like shutil.rmtree, but also removes trees with read-only directories,
+    like the ones copied from the store
+    """
+    def make_writable_and_retry(function, failed_path, exc_info):
+        parent = os.path.dirname(failed_path)
+        os.chmod(parent, os.stat(parent).st_mode | stat.S_IWUSR)
+        if os.path.isdir(failed_path) and not os.path.islink(failed_path):
+            os.chmod(failed_path, os.stat(failed_path).st_mode | stat.S_IWUSR)
+        function(failed_path)
+
+    shutil.rmtree(path, onerror=make_writable_and_retry)
+
+
+def _clone(src, dst):
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        shutil.copystat(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _tree_digest(root):
+    """
+    Returns the sha256 of the paths, types, executable bits and contents of
+    everything under root
+    """
+    digest = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(dirnames + filenames):
+            path = os.path.join(dirpath, name)
+            st = os.lstat(path)
+            digest.update(
+                '{}\0{:o}\0'.format(
+                    os.path.relpath(path, root),
+                    stat.S_IFMT(st.st_mode) | (st.st_mode & 0o111)
+                ).encode('utf-8', 'surrogateescape')
+            )
+            if stat.S_ISLNK(st.st_mode):
+                digest.update(os.fsencode(os.readlink(path)))
+            elif stat.S_ISREG(st.st_mode):
+                with open(path, 'rb') as f:
+                    for data in iter(lambda: f.read(1024 * 1024), b''):
+                        digest.update(data)
+            digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def get_store_entry(cache_dir, store_dir=DEFAULT_STORE_DIR):
+    """
+    Returns the read-only copy of cache_dir in store_dir, creating it the
+    first time. Its files and directories are never written to again, so
+    hardlinks and symlinks to it can be shared by every project.
+
+    Which entry a cache directory maps to is remembered in
+    store_dir/index, so that its contents are only hashed once
+    """
+    index_file = os.path.join(store_dir, 'index', os.path.basename(cache_dir))
+    try:
+        with open(index_file) as f:
+            entry = os.path.join(store_dir, f.read().strip())
+        if os.path.isdir(entry):
+            return entry
+    except OSError:
+        pass
+
+    os.makedirs(os.path.dirname(index_file), exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=store_dir)
+    try:
+        tmp_entry = os.path.join(tmp_dir, 'entry')
+        shutil.copytree(
+            cache_dir, tmp_entry, symlinks=True, copy_function=_clone
+        )
+        digest = _tree_digest(tmp_entry)
+        for dirpath, _, filenames in os.walk(tmp_entry, topdown=False):
+            for path in [os.path.join(dirpath, f) for f in filenames] + \
+                    [dirpath]:
+                st = os.lstat(path)
+                if not stat.S_ISLNK(st.st_mode):
+                    os.chmod(path, stat.S_IMODE(st.st_mode) & ~_WRITE_BITS)
+        entry = os.path.join(store_dir, digest)
+        try:
+            os.rename(tmp_entry, entry)
+            logging.info("{bold}Added %s to the store at %s", cache_dir, entry)
+        except OSError:
+            # The same contents are already in the store
+            if not os.path.isdir(entry):
+                raise
+    finally:
+        _rmtree(tmp_dir)
+
+    tmp_index_file = '{}.{}'.format(index_file, os.getpid())
+    with open(tmp_index_file, 'w') as f:
+        f.write(digest)
+    os.replace(tmp_index_file, index_file)
+    return entry
+
+
+class _Materializer:
+    """
+    Counts the bytes that each materialization strategy writes, so that we
+    can see what not copying the cache saves
+    """
+
+    def __init__(self):
+        self.bytes_total = 0
+        self.bytes_written = 0
+
+    def reflink(self, src, dst):
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError as e:
+            raise _StrategyFailed(e)
+        shutil.copystat(src, dst)
+        self.bytes_total += os.path.getsize(src)
+
+    def hardlink(self, src, dst):
+        try:
+            os.link(src, dst)
+        except OSError as e:
+            raise _StrategyFailed(e)
+        self.bytes_total += os.path.getsize(src)
+
+    def copy(self, src, dst):
+        shutil.copy2(src, dst)
+        size = os.path.getsize(src)
+        self.bytes_total += size
+        self.bytes_written += size
+
+    def materialize(self, strategy, source, destination):
+        if strategy == 'symlink':
+            try:
+                os.symlink(source, destination)
+            except OSError as e:
+                raise _StrategyFailed(e)
+            return
+        shutil.copytree(
+            source, destination, symlinks=True,
+            copy_function=getattr(self, strategy))
+        if strategy == 'hardlink':
+            # Only the files are shared. The directories are the project's
+            # own, so let its builds add files to them
+            for dirpath, _, _ in os.walk(destination):
+                os.chmod(dirpath, os.stat(dirpath).st_mode | stat.S_IWUSR)
+
+
+def materialize(
+    cache_dir, destination, strategies, store_dir=DEFAULT_STORE_DIR
+):
+    """
+    Creates `destination` with the contents of `cache_dir`, using the first
+    of `strategies` (see MATERIALIZE_STRATEGIES) that works on this
+    filesystem. 'copy' is always tried last. hardlink and symlink use the
+    read-only copy of `cache_dir` in `store_dir`, see get_store_entry()
+
+    Returns the strategy that was used
+    """
+    strategies = [s for s in strategies if s != 'copy'] + ['copy']
+    for strategy in strategies:
+        materializer = _Materializer()
+        start = time.time()
+        try:
+            source = cache_dir
+            if strategy in STORE_STRATEGIES:
+                try:
+                    source = get_store_entry(cache_dir, store_dir)
+                except OSError as e:
+                    raise _StrategyFailed(e)
+            materializer.materialize(strategy, source, destination)
+        except _StrategyFailed as e:
+            logging.debug(
+                "Could not %s %s to %s, falling back: %s", strategy,
+                cache_dir, destination, e)
+            if os.path.islink(destination):
+                os.remove(destination)
+            elif os.path.lexists(destination):
+                _rmtree(destination)
+            continue
+        logging.info(
+            "{bold}Materialized %s with %s in %.1fs, writing %s of %s "
+            "bytes{clear}", destination, strategy, time.time() - start,
+            materializer.bytes_written, materializer.bytes_total)
+        return strategy
+
+
 class CachedFetcher:
 
     def should_fetch(self, destination, force):
         src_dest = os.path.join(destination, 'src')
         return not os.path.exists(src_dest) or force
 
-    def populate_cache(self, destination, use_proxy):
+    def populate_cache(self, destination, use_proxy, slots=None):
         raise BuckitException('Not implemented')
 
-    def fetch(self, project_root, destination, use_proxy):
+    def fetch(
+        self, project_root, destination, use_proxy, slots=None,
+        materialize_strategies=DEFAULT_MATERIALIZE_STRATEGIES
+    ):
         destination = os.path.join(destination, 'src')
         if os.path.isdir(destination):
             return
@@ -57,8 +345,7 @@ class CachedFetcher:
         yarn_cache = os.path.join(os.path.expanduser('~'), '.cache', 'yarn')
         if not os.path.exists(yarn_cache):
             yarn_cache = os.path.join(os.path.expanduser('~'), '.yarn-cache')
-        if not os.path.exists(yarn_cache):
-            os.makedirs(yarn_cache)
+        os.makedirs(yarn_cache, exist_ok=True)
 
         clean_package_name = self.package_name.replace('/',
                                                        '_').replace('\\', '_')
@@ -72,12 +359,12 @@ class CachedFetcher:
                 "{bold}Downloading %s to cache directory at %s{clear}",
                 self.package_name, cache_dir
             )
-            self.populate_cache(cache_dir, use_proxy)
+            self.populate_cache(cache_dir, use_proxy, slots)
 
         tmp_destination = tempfile.mkdtemp(dir=os.path.split(destination)[0])
         logging.debug(
-            "{bold}Cached download at %s exists, copying to %s{clear}",
-            cache_dir, tmp_destination
+            "{bold}Cached download at %s exists, materializing it in "
+            "%s{clear}", cache_dir, tmp_destination
         )
         # Dir needs to not exist for copytree, but we want mkdtemp for guaranteed
         # unique temp dir next to destination
@@ -85,11 +372,12 @@ class CachedFetcher:
             tmp_destination, os.path.split(destination)[1]
         )
         try:
-            shutil.copytree(cache_dir, tmp_subdir, symlinks=True)
+            with _slot(slots, 'cpu'):
+                materialize(cache_dir, tmp_subdir, materialize_strategies)
             shutil.move(tmp_subdir, destination)
         finally:
             if os.path.exists(tmp_destination):
-                shutil.rmtree(tmp_destination)
+                _rmtree(tmp_destination)
 
 
 class GitFetcher(CachedFetcher):
@@ -108,7 +396,141 @@ class GitFetcher(CachedFetcher):
     def version(self):
         return self.commit or self.tag
 
-    def populate_cache(self, destination, use_proxy):
+    def mirror_dir(self, cache_root):
+        """
+        The bare repository in `cache_root` that holds every commit of
+        self.url that has been fetched so far
+        """
+        url_hash = hashlib.sha1(self.url.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(cache_root, 'buckit-git-mirror-' + url_hash)
+
+    @contextlib.contextmanager
+    def _locked_mirror(self, mirror):
+        # `fetch --all` may fetch several commits of the same repo at once
+        with open(mirror + '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _has_commit(self, mirror):
+        return subprocess.call(
+            ['git', 'cat-file', '-e', self.commit + '^{commit}'],
+            cwd=mirror,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        ) == 0
+
+    def fetch_commit_into_mirror(self, mirror, env, slots=None):
+        """
+        Makes sure that self.commit is in the bare mirror of self.url. Only
+        the missing objects are downloaded. We first ask for just that
+        commit, and if the server does not allow fetching by SHA, we fall
+        back to fetching all of its branches and tags.
+        """
+        if not os.path.exists(mirror):
+            tmp_mirror = tempfile.mkdtemp(dir=os.path.split(mirror)[0])
+            try:
+                readable_check_call(
+                    ['git', 'init', '--quiet', '--bare', tmp_mirror],
+                    'creating git mirror'
+                )
+                readable_check_call(
+                    ['git', 'remote', 'add', 'origin', self.url],
+                    'creating git mirror',
+                    cwd=tmp_mirror
+                )
+                os.rename(tmp_mirror, mirror)
+            finally:
+                if os.path.exists(tmp_mirror):
+                    shutil.rmtree(tmp_mirror)
+
+        if self._has_commit(mirror):
+            logging.info(
+                "{bold}Found %s in the git mirror at %s{clear}", self.commit,
+                mirror
+            )
+        else:
+            with _slot(slots, 'network'):
+                try:
+                    readable_check_call(
+                        [
+                            'git', 'fetch', '--quiet', '--depth', '1',
+                            'origin', self.commit
+                        ],
+                        'fetching specific commit',
+                        cwd=mirror,
+                        env=env
+                    )
+                except subprocess.CalledProcessError:
+                    logging.info(
+                        "{bold}%s does not allow fetching %s by SHA, "
+                        "fetching all refs instead{clear}", self.url,
+                        self.commit
+                    )
+                    # Commits that were fetched by SHA before made the
+                    # mirror shallow, and would hide older history
+                    unshallow = ['--unshallow'] if os.path.exists(
+                        os.path.join(mirror, 'shallow')
+                    ) else []
+                    readable_check_call(
+                        ['git', 'fetch', '--quiet', '--tags'] + unshallow + [
+                            'origin', '+refs/heads/*:refs/heads/*'
+                        ],
+                        'fetching all refs',
+                        cwd=mirror,
+                        env=env
+                    )
+            if not self._has_commit(mirror):
+                raise BuckitException(
+                    "Commit {} could not be found in {}", self.commit,
+                    self.url)
+
+        # Keep a ref, so that `git gc` in the mirror never prunes the commit
+        readable_check_call(
+            [
+                'git', 'update-ref', 'refs/buckit/' + self.commit,
+                self.commit
+            ],
+            'pinning commit in git mirror',
+            cwd=mirror
+        )
+
+    def checkout_from_mirror(self, mirror, out_dir, env):
+        """
+        Checks out self.commit into out_dir. The checkout's objects stay in
+        the mirror (via git alternates), so this does not copy any history.
+        """
+        readable_check_call(
+            ['git', 'init', '--quiet', out_dir],
+            'creating checkout',
+            env=env
+        )
+        readable_check_call(
+            ['git', 'remote', 'add', 'origin', self.url],
+            'creating checkout',
+            cwd=out_dir
+        )
+        git_dir = os.path.join(out_dir, '.git')
+        with open(
+            os.path.join(git_dir, 'objects', 'info', 'alternates'), 'w'
+        ) as f:
+            f.write(os.path.join(os.path.abspath(mirror), 'objects') + '\n')
+        # A mirror that was fetched with --depth needs its shallow commits
+        # recorded in the checkout too, or git would look for their parents
+        if os.path.exists(os.path.join(mirror, 'shallow')):
+            shutil.copy(
+                os.path.join(mirror, 'shallow'),
+                os.path.join(git_dir, 'shallow')
+            )
+        readable_check_call(
+            ['git', 'checkout', '--quiet', '--detach', self.commit],
+            'checking out specific commit',
+            cwd=out_dir
+        )
+
+    def populate_cache(self, destination, use_proxy, slots=None):
         env = dict(os.environ)
         if not use_proxy:
             for var in ('https_proxy', 'http_proxy'):
@@ -119,17 +541,21 @@ class GitFetcher(CachedFetcher):
         out_dir = os.path.join(tmp_dir, 'outdir')
         try:
             if self.commit:
-                # Github and the like don't seem to let you do git fetch <sha>
-                # so we have to do a heavy weight clone
-                readable_check_call(
-                    ['git', 'clone', '--recursive', self.url, out_dir],
-                    'cloning repo'
-                )
-                readable_check_call(
-                    ['git', 'checkout', self.commit],
-                    'checking out specific commit',
-                    cwd=out_dir
-                )
+                mirror = self.mirror_dir(os.path.split(destination)[0])
+                with self._locked_mirror(mirror):
+                    self.fetch_commit_into_mirror(mirror, env, slots)
+                    with _slot(slots, 'cpu'):
+                        self.checkout_from_mirror(mirror, out_dir, env)
+                with _slot(slots, 'network'):
+                    readable_check_call(
+                        [
+                            'git', 'submodule', 'update', '--init',
+                            '--recursive'
+                        ],
+                        'updating submodules',
+                        cwd=out_dir,
+                        env=env
+                    )
             else:
                 if platform.system() == 'Darwin':
                     # For now short circuit shallow submodules on osx
@@ -138,17 +564,19 @@ class GitFetcher(CachedFetcher):
                 else:
                     shallow_submodules = ['--shallow-submodules']
 
-                readable_check_call(
-                    [
-                        'git',
-                        'clone',
-                        '--branch',
-                        self.tag,
-                        '--depth',
-                        '1',
-                        '--recursive',
-                    ] + shallow_submodules + [self.url, out_dir], 'cloning repo'
-                )
+                with _slot(slots, 'network'):
+                    readable_check_call(
+                        [
+                            'git',
+                            'clone',
+                            '--branch',
+                            self.tag,
+                            '--depth',
+                            '1',
+                            '--recursive',
+                        ] + shallow_submodules + [self.url, out_dir],
+                        'cloning repo'
+                    )
             logging.info(
                 "Checked out %s to %s, moving it to %s", self.url, out_dir,
                 destination
@@ -158,6 +586,54 @@ class GitFetcher(CachedFetcher):
             shutil.rmtree(tmp_dir)
 
 
+def _check_tar_member(member, root):
+    """
+    Raises unless extracting `member` under `root` stays inside `root`.
+    This is what `tarfile.tar_filter` does on Pythons that have it.
+    """
+    def inside_root(path):
+        return os.path.commonpath([root, path]) == root
+
+    name = member.name
+    if os.path.isabs(name) or '..' in name.replace('\\', '/').split('/'):
+        raise BuckitException(
+            'Refusing to extract {} outside of {}', name, root)
+    if member.issym():
+        target = os.path.normpath(os.path.join(
+            root, os.path.dirname(name), member.linkname))
+    elif member.islnk():
+        target = os.path.normpath(os.path.join(root, member.linkname))
+    else:
+        target = None
+    if target is not None and (
+        os.path.isabs(member.linkname) or not inside_root(target)
+    ):
+        raise BuckitException(
+            'Refusing to extract link {} -> {} pointing outside of {}',
+            name, member.linkname, root)
+    if member.isdev():
+        raise BuckitException('Refusing to extract device file {}', name)
+
+
+def extract_tarball(tarball, destination):
+    """
+    Extracts `tarball` into `destination`, refusing absolute paths, `..`
+    components and links that point outside of `destination`.
+    """
+    root = os.path.realpath(destination)
+    try:
+        with tarfile.open(tarball) as tar:
+            members = tar.getmembers()
+            for member in members:
+                _check_tar_member(member, root)
+            if hasattr(tarfile, 'tar_filter'):
+                tar.extractall(root, members=members, filter='tar')
+            else:
+                tar.extractall(root, members=members)
+    except tarfile.TarError as e:
+        raise BuckitException('Could not extract {}: {}', tarball, e)
+
+
 class HttpTarballFetcher(CachedFetcher):
     HASH_BUFFER_SIZE = 64 * 1024
 
@@ -169,44 +645,108 @@ class HttpTarballFetcher(CachedFetcher):
     def version(self):
         return self.sha256
 
-    def populate_cache(self, destination, use_proxy):
-        env = dict(os.environ)
-        if not use_proxy:
-            for var in ('https_proxy', 'http_proxy'):
-                if var in env:
-                    del env[var]
-        tmp_dir = tempfile.mkdtemp(dir=os.path.split(destination)[0])
-        tmp_file = os.path.join(tmp_dir, 'output_file')
+    def populate_cache(self, destination, use_proxy, slots=None):
+        """
+        Downloads and hashes the tarball in a single pass over the HTTP
+        response, and only extracts it once the hash matches. The archive is
+        extracted into a staging directory, which then gets moved to
+        `destination`.
+
+        The download is saved next to `destination`. If it is interrupted,
+        the next fetch resumes it with a Range request.
+        """
+        partial_file = destination + '.partial'
+        staging_dir = tempfile.mkdtemp(dir=os.path.split(destination)[0])
         try:
-            readable_check_call(
-                ['curl', self.url, '-L', '-o', tmp_file],
-                'fetching {}'.format(self.url)
-            )
-            self.check_hash(tmp_file)
-            readable_check_call(
-                ['tar', 'xf', tmp_file, '-C', tmp_dir],
-                'extracting {}'.format(tmp_file)
-            )
-            os.remove(tmp_file)
-            main_dir = glob.glob(os.path.join(tmp_dir, '*'))[0]
+            # Downloading dominates, so this only takes a network slot
+            with _slot(slots, 'network'):
+                hexdigest = self.download(partial_file, use_proxy)
+            try:
+                self.check_hash(hexdigest)
+                extract_tarball(partial_file, staging_dir)
+            finally:
+                # Resuming from bad bytes would fail again
+                os.remove(partial_file)
+            main_dir = glob.glob(os.path.join(staging_dir, '*'))[0]
             logging.info("{bold}Moving %s to %s", main_dir, destination)
             shutil.move(main_dir, destination)
         finally:
-            shutil.rmtree(tmp_dir)
+            shutil.rmtree(staging_dir)
+
+    def download(self, partial_file, use_proxy):
+        """
+        Downloads the tarball to `partial_file`, resuming from the bytes
+        already there if possible, and returns the sha256 of the whole file.
 
-    def check_hash(self, filename):
+        If the server rejects the request, `partial_file` is removed, so that
+        the next fetch starts over.
+        """
+        offset = os.path.getsize(partial_file) \
+            if os.path.exists(partial_file) else 0
+        try:
+            try:
+                return self._download(partial_file, use_proxy, offset)
+            except urllib.error.HTTPError as e:
+                # 416 means that the saved bytes reach the end of the file
+                # (or past it, if the file changed), so there is nothing to
+                # resume.
+                if e.code != 416 or not offset:
+                    raise
+                e.close()
+            hexdigest = self._hash_file(partial_file).hexdigest()
+            if hexdigest == self.sha256:
+                logging.info("{bold}%s was already fetched{clear}", self.url)
+                return hexdigest
+            logging.info(
+                "%s rejected the range of %s, starting over",
+                self.url, partial_file)
+            return self._download(partial_file, use_proxy, 0)
+        except urllib.error.HTTPError:
+            if os.path.exists(partial_file):
+                os.remove(partial_file)
+            raise
+
+    def _download(self, partial_file, use_proxy, offset):
+        handlers = [] if use_proxy else [urllib.request.ProxyHandler({})]
+        opener = urllib.request.build_opener(*handlers)
+        request = urllib.request.Request(self.url)
+        if offset:
+            request.add_header('Range', 'bytes={}-'.format(offset))
+        logging.info(
+            "{bold}Fetching %s%s{clear}", self.url,
+            ' from byte {}'.format(offset) if offset else '')
+
+        with opener.open(request) as response:
+            if offset and getattr(response, 'status', None) != 206:
+                logging.info(
+                    "%s does not support resuming downloads, starting over",
+                    self.url)
+                offset = 0
+            file_hash = self._hash_file(partial_file) if offset \
+                else hashlib.sha256()
+            size = offset
+            with open(partial_file, 'ab' if offset else 'wb') as partial:
+                for data in iter(
+                    lambda: response.read(self.HASH_BUFFER_SIZE), b''
+                ):
+                    partial.write(data)
+                    file_hash.update(data)
+                    size += len(data)
+
+        logging.info("{bold}Fetched %s bytes from %s{clear}", size, self.url)
+        return file_hash.hexdigest()
+
+    def _hash_file(self, path):
         file_hash = hashlib.sha256()
-        with open(filename, 'rb') as fin:
-            while True:
-                data = fin.read(self.HASH_BUFFER_SIZE)
-                if not data:
-                    break
+        with open(path, 'rb') as f:
+            for data in iter(lambda: f.read(self.HASH_BUFFER_SIZE), b''):
                 file_hash.update(data)
-
-        if file_hash.hexdigest() != self.sha256:
+        return file_hash
+    def check_hash(self, hexdigest):
+        if hexdigest != self.sha256:
             raise BuckitException(
                 'SHA256 of downloaded file didn\'t match! Expected {}, got {}',
-                self.sha256, file_hash.hexdigest())
+                self.sha256, hexdigest)
 
 
 class PipFetcher:
@@ -238,16 +778,72 @@ class PipFetcher:
             )
         self.python2_files = {"srcs": {}, "bins": {}}
         self.python3_files = {"srcs": {}, "bins": {}}
+        # The prefix_subdirs that batch_install already installed
+        self.installed = set()
 
         if not main_rule:
             raise BuckitException(
                 'A main_rule attribute must be set in {}', json_file)
 
+    # Next to the BUCK file, what it was generated from
+    MANIFEST = '.buckit-pip-manifest.json'
+
     def should_fetch(self, destination, force):
+        """
+        Fetches if the BUCK file is missing, or was generated from another
+        package spec, buck_deps, or installed files
+        """
         buckfile = os.path.join(destination, BUCKFILE)
-        return not os.path.exists(buckfile) or force
+        if not os.path.exists(buckfile) or force:
+            return True
+        try:
+            with open(os.path.join(destination, self.MANIFEST), 'r') as fin:
+                manifest = json.load(fin)
+        except (OSError, ValueError):
+            logging.debug("No valid pip manifest in %s", destination)
+            return True
+        if manifest != self.manifest():
+            logging.info(
+                "{bold}%s changed since its BUCK file was generated{clear}",
+                self.package_name)
+            return True
+        return False
 
-    def fetch(self, project_root, destination, use_proxy):
+    def manifest(self):
+        """
+        Returns what the BUCK file depends on: the package specs, the rule,
+        and a hash of each installed distribution's RECORD file
+        """
+        manifest = {
+            'main_rule': self.main_rule,
+            'buck_deps': self.buck_deps,
+        }
+        for python_settings in (self.python2, self.python3):
+            if not python_settings:
+                continue
+            record = self.find_record(python_settings)
+            if record:
+                with open(record, 'rb') as fin:
+                    record_hash = hashlib.sha256(fin.read()).hexdigest()
+            else:
+                record_hash = None
+            manifest[python_settings.prefix_subdir] = {
+                'package': python_settings.pip_package,
+                'version': python_settings.pip_version,
+                'record_sha256': record_hash,
+            }
+        return manifest
+
+    def fetch(
+        self, project_root, destination, use_proxy, slots=None,
+        update_buckconfig=True
+    ):
+        """
+        Installs the package, and writes its BUCK file. If update_buckconfig
+        is False, the caller must pass `read_only_paths()` to
+        `update_read_only_paths` itself, so that many fetches can share one
+        .buckconfig update.
+        """
         env = dict(os.environ)
         if not use_proxy:
             for var in ('https_proxy', 'http_proxy'):
@@ -258,39 +854,71 @@ class PipFetcher:
             os.makedirs(destination)
 
         if self.python2:
-            self.python2_files = self.install_and_get_files(
-                self.python2,
-                'pip',
-                env,
-            )
+            if self.python2.prefix_subdir not in self.installed:
+                with _slot(slots, 'network'):
+                    self.python2_files = self.install_and_get_files(
+                        self.python2,
+                        'pip',
+                        env,
+                    )
             self.setup_install_prefix(self.python2, destination)
         if self.python3:
-            self.python3_files = self.install_and_get_files(
-                self.python3, 'pip', env
-            )
+            if self.python3.prefix_subdir not in self.installed:
+                with _slot(slots, 'network'):
+                    self.python3_files = self.install_and_get_files(
+                        self.python3, 'pip', env
+                    )
             self.setup_install_prefix(self.python3, destination)
 
+        # Reinstalling the same distribution does not change its files, so
+        # the BUCK file is only written if it changed, keeping buck's parser
+        # cache valid
         buckfile = os.path.join(destination, BUCKFILE)
-        with open(buckfile, 'w') as fout:
-            fout.write('\n'.join(self.buckfile()))
+        if _write_if_changed(buckfile, '\n'.join(self.buckfile())):
+            logging.info("{bold}Wrote %s{clear}", buckfile)
+        else:
+            logging.info("{bold}%s did not change{clear}", buckfile)
+        _write_if_changed(
+            os.path.join(destination, self.MANIFEST),
+            json.dumps(self.manifest(), indent=2, sort_keys=True))
+        if update_buckconfig:
+            read_only_paths = self.read_only_paths(destination)
+            if read_only_paths:
+                self.update_read_only_paths(
+                    find_project_root(destination), read_only_paths,
+                    merge=False)
+
+    def read_only_paths(self, destination):
+        """
+        Returns the paths relative to the project root that buck should
+        treat as read only for this package
+        """
+        paths = []
         if self.python2 or self.python3:
-            read_only_props = {'project': {'read_only_paths': []}}
             project_root = find_project_root(destination)
             relative_path = os.path.relpath(destination, project_root)
             if self.python2:
-                read_only_props['project']['read_only_paths'].append(
-                    os.path.join(relative_path, 'py2')
-                )
+                paths.append(os.path.join(relative_path, 'py2'))
             if self.python3:
-                read_only_props['project']['read_only_paths'].append(
-                    os.path.join(relative_path, 'py3')
-                )
-            read_only_props['project']['read_only_paths'] = ','.join(
-                read_only_props['project']['read_only_paths']
-            )
+                paths.append(os.path.join(relative_path, 'py3'))
+        return paths
 
-            buckconfig = os.path.join(project_root, BUCKCONFIG)
-            update_config(project_root, buckconfig, read_only_props)
+    @staticmethod
+    def update_read_only_paths(project_root, read_only_paths, merge=True):
+        """
+        Sets project.read_only_paths in the root .buckconfig. If merge is
+        True, read_only_paths are added to the ones that are already set
+        """
+        buckconfig = os.path.join(project_root, BUCKCONFIG)
+        if merge:
+            update_config(
+                project_root, buckconfig,
+                {'project': {'read_only_paths': read_only_paths}},
+                override=True, merge={'project.read_only_paths': ','})
+        else:
+            update_config(
+                project_root, buckconfig,
+                {'project': {'read_only_paths': ','.join(read_only_paths)}})
 
     def buckfile(self):
         ret = []
@@ -408,6 +1036,83 @@ class PipFetcher:
             python_settings, location, found_files, found_bins
         )
 
+    @staticmethod
+    def get_site_packages(python_settings):
+        # TODO: Windows
+        site_packages = glob.glob(
+            os.path.join(
+                python_settings.virtualenv_root, 'lib', 'python*',
+                'site-packages'
+            )
+        )
+        return site_packages[0] if len(site_packages) == 1 else None
+
+    @staticmethod
+    def find_record(python_settings):
+        """
+        Returns the path to the RECORD file of the installed pip package, or
+        None if it cannot be found (e.g. it was not installed from a wheel)
+
+        `pip install -I` leaves the .dist-info of the previously installed
+        version behind, so if there are several, the newest RECORD is used
+        """
+        site_packages = PipFetcher.get_site_packages(python_settings)
+        if not site_packages:
+            return None
+        # Distribution names are compared normalized, as in PEP 503, and
+        # without extras or version specifiers
+        name = re.split(r'[\[<>=!~;@ ]', python_settings.pip_package)[0]
+        name = re.sub(r'[-_.]+', '_', name).lower()
+        records = []
+        for dist_info in glob.glob(os.path.join(site_packages, '*.dist-info')):
+            dist_name = os.path.basename(dist_info).split('-')[0]
+            if re.sub(r'[-_.]+', '_', dist_name).lower() == name:
+                record = os.path.join(dist_info, 'RECORD')
+                if os.path.exists(record):
+                    records.append((os.stat(record).st_mtime_ns, record))
+        if not records:
+            return None
+        return max(records)[1]
+
+    def parse_record(self, python_settings, record):
+        """
+        Gets the files of an installed package from its RECORD file, whose
+        paths are relative to site-packages
+        """
+        found_bins = []
+        found_files = []
+        with open(record, 'r', newline='') as fin:
+            for row in csv.reader(fin):
+                if not row:
+                    continue
+                normalized = os.path.normpath(row[0])
+                if normalized.endswith('.py'):
+                    found_files.append(normalized)
+                elif 'bin' in normalized.split(os.sep):
+                    found_bins.append(normalized)
+
+        return self.transform_pip_output(
+            python_settings, os.path.dirname(os.path.dirname(record)),
+            found_files, found_bins
+        )
+
+    def get_installed_files(self, python_settings, pip_command, env):
+        """
+        Returns the files of the installed package, from its RECORD file, or
+        from `pip show -f` if it does not have one
+        """
+        record = self.find_record(python_settings)
+        if record:
+            return self.parse_record(python_settings, record)
+
+        package = shlex.quote(python_settings.pip_package)
+        stdout = self._run_in_virtualenv(
+            python_settings,
+            "{pip} show -f {package}".format(pip=pip_command, package=package),
+            env,
+        )
+        return self.parse_pip_output(python_settings, stdout)
+
     def transform_pip_output(
         self, python_settings, location, found_files, found_bins
     ):
@@ -438,6 +1143,12 @@ class PipFetcher:
         return {"srcs": files, "bins": bins}
 
     def install_and_get_files(self, python_settings, pip_command, env):
+        with _virtualenv_lock(python_settings.virtualenv_root):
+            return self._install_and_get_files(
+                python_settings, pip_command, env)
+
+    @staticmethod
+    def _ensure_virtualenv(python_settings, env):
         # TODO: Windows
         activate_path = os.path.join(
             python_settings.virtualenv_root, 'bin', 'activate'
@@ -455,21 +1166,17 @@ class PipFetcher:
                 env=env,
             )
 
-        package = shlex.quote(
-            python_settings.pip_package + (python_settings.pip_version or '')
-        )
-        command = (
-            "source bin/activate && {pip} install -I {package} && "
-            "{pip} show -f {package}"
-        ).format(
-            pip=pip_command, package=package
-        )
+    @staticmethod
+    def _run_in_virtualenv(python_settings, command, env, check=True):
+        """
+        Runs a shell command with the virtualenv activated. Returns its
+        stdout, or None if it failed and check is False
+        """
         logging.info(
-            "Installing %s via pip with %s in %s", package, command,
-            python_settings.virtualenv_root
+            "Running %s in %s", command, python_settings.virtualenv_root
         )
         proc = subprocess.Popen(
-            args=command,
+            args=". bin/activate && " + command,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             stdin=subprocess.PIPE,
@@ -479,6 +1186,12 @@ class PipFetcher:
         )
         stdout, stderr = proc.communicate()
         if proc.returncode != 0:
+            if not check:
+                logging.debug(
+                    "%s failed in %s:\nstdout: %sstderr: %s", command,
+                    python_settings.virtualenv_root, stdout, stderr
+                )
+                return None
             logging.error(
                 "{red}Error installing into virtualenv:{clear}\n"
                 "stdout: %sstderr: %s\nReturn code %s\n", stdout, stderr,
@@ -488,9 +1201,118 @@ class PipFetcher:
                 "Could not install virtualenv at {}",
                 python_settings.virtualenv_root)
 
-        stdout = stdout.decode('utf-8')
+        return stdout.decode('utf-8')
 
-        return self.parse_pip_output(python_settings, stdout)
+    def _install_and_get_files(self, python_settings, pip_command, env):
+        self._ensure_virtualenv(python_settings, env)
+
+        package = shlex.quote(
+            python_settings.pip_package + (python_settings.pip_version or '')
+        )
+        logging.info(
+            "Installing %s via pip in %s", package,
+            python_settings.virtualenv_root
+        )
+        self._run_in_virtualenv(
+            python_settings,
+            "{pip} install -I {package}".format(
+                pip=pip_command, package=package
+            ),
+            env,
+        )
+        return self.get_installed_files(python_settings, pip_command, env)
+
+    @staticmethod
+    def batch_install(fetchers, use_proxy, wheel_dir, slots=None):
+        """
+        Installs the packages of all fetchers with one `pip install` per
+        virtualenv, and marks them as installed, so that their fetch() only
+        has to write BUCK files.
+
+        Packages are installed from the wheels in wheel_dir, without
+        looking at the package index. Only if some are missing, `pip wheel`
+        downloads or builds them into wheel_dir first. So, once wheel_dir is
+        populated, packages pinned with == are installed offline.
+
+        Packages without a pinned version would otherwise stay at whichever
+        version was downloaded first, so their wheels are refreshed from the
+        index on every run. If that fails, e.g. when offline, the newest
+        wheels already in wheel_dir are installed.
+        """
+        env = dict(os.environ)
+        if not use_proxy:
+            for var in ('https_proxy', 'http_proxy'):
+                if var in env:
+                    del env[var]
+
+        by_virtualenv = defaultdict(list)
+        for fetcher in fetchers:
+            for python_settings in (fetcher.python2, fetcher.python3):
+                if python_settings:
+                    by_virtualenv[python_settings.virtualenv_root].append(
+                        (fetcher, python_settings))
+
+        os.makedirs(wheel_dir, exist_ok=True)
+        for virtualenv_root, to_install in sorted(by_virtualenv.items()):
+            any_settings = to_install[0][1]
+            versions = {
+                (settings.pip_package, settings.pip_version or '')
+                for _, settings in to_install
+            }
+            packages = ' '.join(
+                sorted(shlex.quote(p + v) for p, v in versions)
+            )
+            unpinned = ' '.join(
+                sorted(
+                    shlex.quote(p + v) for p, v in versions
+                    if not v.startswith('==')
+                )
+            )
+            find_links = "--find-links {}".format(shlex.quote(wheel_dir))
+
+            def wheel(packages):
+                return "pip wheel {} --wheel-dir {} {}".format(
+                    find_links, shlex.quote(wheel_dir), packages
+                )
+
+            install = "pip install -I --no-index {} {}".format(
+                find_links, packages
+            )
+            with _virtualenv_lock(virtualenv_root):
+                PipFetcher._ensure_virtualenv(any_settings, env)
+                if unpinned:
+                    with _slot(slots, 'network'):
+                        if PipFetcher._run_in_virtualenv(
+                            any_settings, wheel(unpinned), env,
+                            check=False
+                        ) is None:
+                            logging.warning(
+                                "Could not update the wheels of unpinned pip "
+                                "packages %s, installing the ones in %s",
+                                unpinned, wheel_dir
+                            )
+                logging.info(
+                    "{bold}Installing %s pip packages in %s{clear}",
+                    len(to_install), virtualenv_root
+                )
+                if PipFetcher._run_in_virtualenv(
+                    any_settings, install, env, check=False
+                ) is None:
+                    with _slot(slots, 'network'):
+                        PipFetcher._run_in_virtualenv(
+                            any_settings, wheel(packages), env
+                        )
+                    PipFetcher._run_in_virtualenv(any_settings, install, env)
+
+                for fetcher, python_settings in to_install:
+                    files = fetcher.get_installed_files(
+                        python_settings, 'pip', env
+                    )
+                    if python_settings is fetcher.python2:
+                        fetcher.python2_files = files
+                    else:
+                        fetcher.python3_files = files
+                    fetcher.installed.add(python_settings.prefix_subdir)
 
     def setup_install_prefix(self, python_settings, destination):
         platform_install_prefix = os.path.join(
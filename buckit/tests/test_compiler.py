@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+# Copyright 2016-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree. An additional grant
+# of patent rights can be found in the PATENTS file in the same directory.
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compiler
+
+
+class CachedProbeTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.bin = self._tmp.name
+        self.probed = []
+        self.cache = {}
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _write_exe(self, name, contents):
+        path = os.path.join(self.bin, name)
+        with open(path, 'wb') as f:
+            f.write(contents)
+        os.chmod(path, 0o755)
+        return path
+
+    def _probe(self, tool):
+        self.probed.append(tool)
+        return 'value for {}'.format(tool)
+
+    def _cached_probe(self, tool):
+        with mock.patch.dict(os.environ, {'PATH': self.bin}):
+            return compiler.cached_probe(
+                self.cache, 'standard', tool, self._probe)
+
+    def test_wrapper_symlinks_are_cached_separately(self):
+        ccache = self._write_exe('ccache', b'\x7fELF')
+        os.symlink(ccache, os.path.join(self.bin, 'gcc'))
+        os.symlink(ccache, os.path.join(self.bin, 'g++'))
+
+        gcc = self._cached_probe('gcc')
+        gxx = self._cached_probe('g++')
+        self.assertEqual(gcc, self._cached_probe('gcc'))
+        self.assertEqual(gxx, self._cached_probe('g++'))
+
+        self.assertNotEqual(gcc, gxx)
+        self.assertEqual(
+            [os.path.join(self.bin, 'gcc'), os.path.join(self.bin, 'g++')],
+            self.probed)
+
+    def test_scripts_are_not_cached(self):
+        shim = self._write_exe('python3', b'#!/bin/sh\nexec python3.6 "$@"\n')
+
+        self._cached_probe('python3')
+        self._cached_probe('python3')
+
+        self.assertEqual([shim, shim], self.probed)
+        self.assertEqual({}, self.cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
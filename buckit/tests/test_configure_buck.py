@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+
+# Copyright 2016-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree. An additional grant
+# of patent rights can be found in the PATENTS file in the same directory.
+
+import configparser
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compiler  # noqa: F401 (imported first to avoid an import cycle)
+import configure_buck
+from constants import BUCKCONFIG, BUCKCONFIG_LOCAL, PACKAGE_JSON
+from helpers import BuckitException
+
+# The module's private helpers. Their double underscores would be mangled
+# if they were used as attributes inside of the test classes
+_update_config = getattr(configure_buck, '__update_config')
+_write_configs = getattr(configure_buck, '__write_configs')
+_update_root_buckconfig = getattr(configure_buck, '__update_root_buckconfig')
+_update_root_buckconfig_local = getattr(
+    configure_buck, '__update_root_buckconfig_local')
+_load_package_json = getattr(configure_buck, '__load_package_json')
+_update_packages_buckconfig_local = getattr(
+    configure_buck, '__update_packages_buckconfig_local')
+
+
+def _write_json(path, js):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(js, f)
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read()
+
+
+class FindPackagePathsTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = self._tmp.name
+        self.npm_package_name = os.environ.pop('npm_package_name', None)
+
+    def tearDown(self):
+        if self.npm_package_name is not None:
+            os.environ['npm_package_name'] = self.npm_package_name
+        self._tmp.cleanup()
+
+    def _make_project(self, graph, root_deps):
+        """
+        Creates node_modules packages with the dependencies in graph, a dict
+        of package names to lists of package names
+        """
+        _write_json(os.path.join(self.tmp, PACKAGE_JSON), {
+            'name': 'root',
+            'dependencies': {dep: '*' for dep in root_deps},
+        })
+        for name, deps in graph.items():
+            _write_json(self._package_json(name), {
+                'name': name,
+                'dependencies': {dep: '*' for dep in deps},
+            })
+
+    def _package_json(self, name):
+        return os.path.join(self.tmp, 'node_modules', name, PACKAGE_JSON)
+
+    def _find_package_paths(self):
+        loaded = []
+
+        def load(package_json):
+            loaded.append(package_json)
+            return _load_package_json(package_json)
+
+        with mock.patch.object(configure_buck, '__load_package_json', load):
+            paths, root_deps, jsons = configure_buck.find_package_paths(
+                self.tmp, 'node_modules')
+        return paths, root_deps, jsons, loaded
+
+    def test_diamond_dependency_is_visited_once(self):
+        self._make_project({
+            'left': ['bottom'],
+            'right': ['bottom'],
+            'bottom': ['leaf'],
+            'leaf': [],
+        }, ['left', 'right'])
+
+        paths, root_deps, jsons, loaded = self._find_package_paths()
+        self.assertEqual({'left', 'right'}, root_deps)
+        self.assertEqual(
+            {'left', 'right', 'bottom', 'leaf'}, set(paths))
+        self.assertEqual(set(paths), set(jsons))
+        self.assertEqual(
+            os.path.join(self.tmp, 'node_modules', 'bottom'), paths['bottom'])
+        self.assertEqual(1, loaded.count(self._package_json('bottom')))
+        self.assertEqual(1, loaded.count(self._package_json('leaf')))
+
+    def test_cycle_is_detected(self):
+        self._make_project({
+            'a': ['b'],
+            'b': ['c'],
+            'c': ['a'],
+        }, ['a'])
+        with self.assertRaisesRegex(BuckitException, 'cycle.*a -> b -> c'):
+            self._find_package_paths()
+
+    def test_package_json_cache_is_invalidated(self):
+        self._make_project({'a': []}, ['a'])
+        package_json = self._package_json('a')
+        js = _load_package_json(package_json)
+        self.assertIs(js, _load_package_json(package_json))
+
+        # Another size
+        _write_json(package_json, {'name': 'a', 'version': '1.0'})
+        js = _load_package_json(package_json)
+        self.assertEqual('1.0', js['version'])
+        self.assertIs(js, _load_package_json(package_json))
+
+        # The same size, another mtime
+        stat = os.stat(package_json)
+        _write_json(package_json, {'name': 'a', 'version': '2.0'})
+        os.utime(package_json, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.assertEqual('2.0', _load_package_json(package_json)['version'])
+
+        os.remove(package_json)
+        self.assertIsNone(_load_package_json(package_json))
+
+    def test_deep_diamond_benchmark(self):
+        # Every package depends on both packages of the next level, so
+        # there are 2 ** LEVELS paths to the bottom of the graph
+        levels = 16
+        graph = {'bottom': []}
+        for level in range(levels):
+            deps = ['l{}_{}'.format(level + 1, i) for i in range(2)] \
+                if level + 1 < levels else ['bottom']
+            for i in range(2):
+                graph['l{}_{}'.format(level, i)] = deps
+        self._make_project(graph, ['l0_0', 'l0_1'])
+
+        start = time.time()
+        paths, _, _, loaded = self._find_package_paths()
+        cold = time.time() - start
+        start = time.time()
+        self._find_package_paths()
+        warm = time.time() - start
+
+        print(
+            '\nfind_package_paths over a diamond {} levels deep: {:.4f}s, '
+            '{:.4f}s with cached package.json files'.format(
+                levels, cold, warm),
+            file=sys.stderr)
+        self.assertEqual(set(graph), set(paths))
+        # Every package.json, and the root one, is loaded once
+        self.assertEqual(len(graph) + 1, len(loaded))
+        self.assertEqual(len(set(loaded)), len(loaded))
+
+
+class UpdateConfigTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = self._tmp.name
+        self.buckconfig = os.path.join(self.tmp, BUCKCONFIG)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _config(self):
+        config = configparser.ConfigParser()
+        config.read(self.buckconfig)
+        return config
+
+    def test_transaction_merges_and_removes_in_memory(self):
+        with open(self.buckconfig, 'w') as f:
+            f.write(
+                '[project]\nread_only_paths = c,a\nignore = foo\n'
+                '[cxx]\ncxx = g++\n')
+        original = _read(self.buckconfig)
+        merge = {'project.read_only_paths': ','}
+
+        configs = {}
+        _update_config(
+            self.buckconfig, {'project': {'read_only_paths': ['b', 'a']}},
+            override=True, merge=merge, configs=configs)
+        _update_config(
+            self.buckconfig, {'project': {'read_only_paths': ['d']}},
+            override=True, merge=merge, configs=configs)
+        _update_config(
+            self.buckconfig, {'cxx': {'cc': 'gcc'}},
+            removed_properties={'project': ['ignore']}, configs=configs)
+        # Later updates see the earlier ones, which are only in memory
+        self.assertEqual([self.buckconfig], list(configs))
+        self.assertEqual(original, _read(self.buckconfig))
+
+        self.assertEqual(1, _write_configs(configs))
+        config = self._config()
+        self.assertEqual('a,b,c,d', config.get('project', 'read_only_paths'))
+        self.assertFalse(config.has_option('project', 'ignore'))
+        self.assertEqual('gcc', config.get('cxx', 'cc'))
+        self.assertEqual('g++', config.get('cxx', 'cxx'))
+
+    def test_merged_values_are_sorted_without_empty_entries(self):
+        # An empty or padded existing value must not leave empty entries,
+        # and the result must not depend on set iteration order, or the
+        # same values would rewrite the file
+        with open(self.buckconfig, 'w') as f:
+            f.write('[project]\nread_only_paths =\nignore = c, ,a,\n')
+        merge = {
+            'project.read_only_paths': ',',
+            'project.ignore': ',',
+        }
+        configure_buck.update_config(
+            self.tmp, self.buckconfig, {
+                'project': {
+                    'read_only_paths': ['b', 'a'],
+                    'ignore': ['b', 'a'],
+                },
+            }, override=True, merge=merge)
+        config = self._config()
+        self.assertEqual('a,b', config.get('project', 'read_only_paths'))
+        self.assertEqual('a,b,c', config.get('project', 'ignore'))
+
+    def test_unchanged_contents_are_not_written(self):
+        properties = {'project': {'read_only_paths': ['a', 'b']}}
+        merge = {'project.read_only_paths': ','}
+        configure_buck.update_config(
+            self.tmp, self.buckconfig, properties, merge=merge)
+        os.utime(self.buckconfig, ns=(0, 0))
+
+        configure_buck.update_config(
+            self.tmp, self.buckconfig, properties, override=True, merge=merge)
+        self.assertEqual(0, os.stat(self.buckconfig).st_mtime_ns)
+
+        configs = {}
+        _update_config(
+            self.buckconfig, properties, override=True, merge=merge,
+            configs=configs)
+        self.assertEqual(0, _write_configs(configs))
+        self.assertEqual(0, os.stat(self.buckconfig).st_mtime_ns)
+
+        configure_buck.update_config(
+            self.tmp, self.buckconfig,
+            {'project': {'read_only_paths': ['c']}}, override=True,
+            merge=merge)
+        self.assertNotEqual(0, os.stat(self.buckconfig).st_mtime_ns)
+        self.assertEqual(
+            'a,b,c', self._config().get('project', 'read_only_paths'))
+
+
+class UpdatePackagesBuckconfigLocalTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = self._tmp.name
+        self.cells = ['a', 'b']
+        for cell in self.cells:
+            os.makedirs(os.path.join(self.tmp, 'node_modules', cell))
+        self._write_root('')
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _write_root(self, extra):
+        with open(os.path.join(self.tmp, BUCKCONFIG_LOCAL), 'w') as f:
+            f.write('[repository_aliases]\n')
+            for cell in self.cells:
+                f.write('{0} = node_modules/{0}\n'.format(cell))
+            f.write(extra)
+
+    def _cell_buckconfig_local(self, cell):
+        return os.path.join(self.tmp, 'node_modules', cell, BUCKCONFIG_LOCAL)
+
+    def _reset_mtimes(self):
+        for cell in self.cells:
+            os.utime(self._cell_buckconfig_local(cell), ns=(0, 0))
+
+    def _rewritten(self):
+        return [
+            cell for cell in self.cells
+            if os.stat(self._cell_buckconfig_local(cell)).st_mtime_ns != 0
+        ]
+
+    def test_only_changed_cells_are_rewritten(self):
+        _update_packages_buckconfig_local(self.tmp)
+        config = configparser.ConfigParser()
+        config.read(self._cell_buckconfig_local('a'))
+        self.assertEqual('.', config.get('repository_aliases', 'a'))
+        self.assertEqual('../b', config.get('repository_aliases', 'b'))
+        contents = _read(self._cell_buckconfig_local('a'))
+
+        self._reset_mtimes()
+        _update_packages_buckconfig_local(self.tmp)
+        self.assertEqual([], self._rewritten())
+
+        # A cell whose file went stale is rewritten, the others are not
+        with open(self._cell_buckconfig_local('a'), 'w') as f:
+            f.write('[repository_aliases]\na = stale\n')
+        self._reset_mtimes()
+        _update_packages_buckconfig_local(self.tmp)
+        self.assertEqual(['a'], self._rewritten())
+        self.assertEqual(contents, _read(self._cell_buckconfig_local('a')))
+
+        # A change to the root file is copied into every cell
+        self._write_root('[cxx]\ncc = clang\n')
+        self._reset_mtimes()
+        _update_packages_buckconfig_local(self.tmp)
+        self.assertEqual(self.cells, self._rewritten())
+        config = configparser.ConfigParser()
+        config.read(self._cell_buckconfig_local('b'))
+        self.assertEqual('clang', config.get('cxx', 'cc'))
+
+
+class ConfigureAllPackagesTest(unittest.TestCase):
+
+    PACKAGES = 200
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = self._tmp.name
+        self.npm_package_name = os.environ.pop('npm_package_name', None)
+
+    def tearDown(self):
+        if self.npm_package_name is not None:
+            os.environ['npm_package_name'] = self.npm_package_name
+        self._tmp.cleanup()
+
+    def _make_project(self, name):
+        """
+        Creates a project that depends on PACKAGES packages, each with its
+        own cell and build file includes
+        """
+        project_root = os.path.join(self.tmp, name)
+        names = ['pkg{}'.format(i) for i in range(self.PACKAGES)]
+        _write_json(os.path.join(project_root, PACKAGE_JSON), {
+            'name': 'root',
+            'dependencies': {name: '*' for name in names},
+        })
+        for i, name in enumerate(names):
+            _write_json(
+                os.path.join(
+                    project_root, 'node_modules', name, PACKAGE_JSON), {
+                    'name': name,
+                    'buckit': {
+                        'includes': {
+                            'path': 'defs.py',
+                            'whitelist_functions': ['fn{}'.format(i % 10)],
+                        },
+                    },
+                })
+        return project_root, names
+
+    def _configure_per_package(self, project_root, names):
+        # What configure_buck_for_all_packages did before it used a
+        # transaction: read and write the root files for every package
+        for name in names:
+            configure_buck.configure_buck_for_package(
+                project_root, name,
+                os.path.join(project_root, 'node_modules', name), set(names),
+                update_all_package_buckconfigs=False)
+
+    def _configure_in_transaction(self, project_root, names):
+        configs = {}
+        for name in names:
+            package_info = configure_buck.parse_package_info(
+                os.path.join(project_root, 'node_modules', name))
+            _update_root_buckconfig(project_root, package_info, True, configs)
+            _update_root_buckconfig_local(project_root, package_info, configs)
+        return _write_configs(configs)
+
+    def test_root_configs_are_written_once(self):
+        project_root, names = self._make_project('project')
+        self.assertEqual(0, configure_buck.configure_buck_for_all_packages(
+            project_root, 'node_modules'))
+
+        config = configparser.ConfigParser()
+        config.read(os.path.join(project_root, BUCKCONFIG))
+        self.assertEqual(self.PACKAGES, len(config.items('repositories')))
+        config = configparser.ConfigParser()
+        config.read(os.path.join(project_root, BUCKCONFIG_LOCAL))
+        self.assertEqual(
+            self.PACKAGES, len(config.items('repository_aliases')))
+
+        for path in (BUCKCONFIG, BUCKCONFIG_LOCAL):
+            os.utime(os.path.join(project_root, path), ns=(0, 0))
+        self.assertEqual(0, self._configure_in_transaction(project_root, names))
+        for path in (BUCKCONFIG, BUCKCONFIG_LOCAL):
+            self.assertEqual(
+                0, os.stat(os.path.join(project_root, path)).st_mtime_ns)
+
+    def test_configure_benchmark(self):
+        per_package_root, names = self._make_project('per_package')
+        transaction_root, _ = self._make_project('transaction')
+
+        start = time.time()
+        self._configure_per_package(per_package_root, names)
+        per_package = time.time() - start
+        start = time.time()
+        written = self._configure_in_transaction(transaction_root, names)
+        transaction = time.time() - start
+        start = time.time()
+        rewritten = self._configure_in_transaction(transaction_root, names)
+        unchanged = time.time() - start
+
+        print(
+            '\nroot configs for {} packages: {:.3f}s per package, {:.3f}s in '
+            'a transaction writing {} files, {:.3f}s again writing {} '
+            'files'.format(
+                self.PACKAGES, per_package, transaction, written, unchanged,
+                rewritten),
+            file=sys.stderr)
+        for path in (BUCKCONFIG, BUCKCONFIG_LOCAL):
+            self.assertEqual(
+                _read(os.path.join(per_package_root, path)),
+                _read(os.path.join(transaction_root, path)))
+        self.assertEqual(2, written)
+        self.assertEqual(0, rewritten)
+        self.assertLess(transaction, per_package)
+
+
+if __name__ == '__main__':
+    unittest.main()
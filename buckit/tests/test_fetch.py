@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+# Copyright 2016-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree. An additional grant
+# of patent rights can be found in the PATENTS file in the same directory.
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compiler  # noqa: F401 (imported first to avoid an import cycle)
+import fetch
+from constants import PACKAGE_JSON
+from helpers import BuckitException
+
+
+class _FakeFetcher:
+    """
+    Records when each package is fetched, and how many fetches hold a
+    network or cpu slot at the same time
+    """
+
+    def __init__(self, package, recorder):
+        self.package = package
+        self.recorder = recorder
+
+    def should_fetch(self, destination, force):
+        return True
+
+    def fetch(
+        self, project_root, destination, use_proxy, slots=None,
+        materialize_strategies=None
+    ):
+        self.recorder.started(self.package)
+        for kind in ('network', 'cpu'):
+            with getattr(slots, kind):
+                self.recorder.hold(kind)
+        if self.package in self.recorder.failing:
+            raise BuckitException("Could not fetch {}", self.package)
+        self.recorder.finished(self.package)
+
+
+class _Recorder:
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.lock = threading.Lock()
+        self.events = []
+        self.holding = {'network': 0, 'cpu': 0}
+        self.max_holding = {'network': 0, 'cpu': 0}
+
+    def started(self, package):
+        with self.lock:
+            self.events.append(('start', package))
+
+    def finished(self, package):
+        with self.lock:
+            self.events.append(('finish', package))
+
+    def hold(self, kind):
+        with self.lock:
+            self.holding[kind] += 1
+            self.max_holding[kind] = max(
+                self.max_holding[kind], self.holding[kind])
+        time.sleep(0.05)
+        with self.lock:
+            self.holding[kind] -= 1
+
+    def fetched(self):
+        return {
+            package for event, package in self.events if event == 'finish'}
+
+    def started_packages(self):
+        return {
+            package for event, package in self.events if event == 'start'}
+
+
+class FetchAllPackagesTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = self._tmp.name
+        self.npm_package_name = os.environ.pop('npm_package_name', None)
+
+    def tearDown(self):
+        if self.npm_package_name is not None:
+            os.environ['npm_package_name'] = self.npm_package_name
+        self._tmp.cleanup()
+
+    def _make_project(self, graph, root_deps, unfetchable=()):
+        """
+        Creates node_modules packages with the dependencies in graph, a dict
+        of package names to lists of package names. Packages in unfetchable
+        have no repository
+        """
+        def write(path, js):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump(js, f)
+
+        write(os.path.join(self.tmp, PACKAGE_JSON), {
+            'name': 'root',
+            'dependencies': {dep: '*' for dep in root_deps},
+        })
+        for name, deps in graph.items():
+            js = {
+                'name': name,
+                'dependencies': {dep: '*' for dep in deps},
+            }
+            if name not in unfetchable:
+                js['repository'] = {
+                    'type': 'git',
+                    'url': 'https://example.com/{}.git'.format(name),
+                }
+            write(
+                os.path.join(self.tmp, 'node_modules', name, PACKAGE_JSON), js)
+
+    def _fetch_all(self, recorder, jobs=4, network_jobs=4, cpu_jobs=4):
+        def get_fetcher(package, package_root, python_settings):
+            return (
+                _FakeFetcher(package, recorder),
+                os.path.join(package_root, package))
+
+        with mock.patch.object(
+            fetch, 'get_fetcher_from_repository', get_fetcher
+        ):
+            return fetch.fetch_all_packages(
+                self.tmp, 'node_modules', False, 'virtualenv', 'venv2',
+                False, 'virtualenv', 'venv3', False, False,
+                'copy', None, jobs, network_jobs, cpu_jobs)
+
+    def test_dependencies_are_fetched_first(self):
+        graph = {
+            'app': ['left', 'right'],
+            'left': ['bottom'],
+            'right': ['macros'],
+            'macros': ['bottom'],
+            'bottom': [],
+        }
+        self._make_project(graph, ['app'], unfetchable=['macros'])
+        recorder = _Recorder()
+
+        self.assertEqual(0, self._fetch_all(recorder))
+        self.assertEqual(set(graph) - {'macros'}, recorder.fetched())
+        # Packages without a repository are not fetched, but their
+        # dependents still wait for their dependencies
+        for package, deps in graph.items():
+            if package == 'macros':
+                continue
+            start = recorder.events.index(('start', package))
+            for dep in deps:
+                if dep == 'macros':
+                    dep = 'bottom'
+                self.assertLess(
+                    recorder.events.index(('finish', dep)), start,
+                    '{} started before {} was fetched'.format(package, dep))
+
+    def test_dependents_of_failed_packages_are_skipped(self):
+        self._make_project({
+            'app': ['middle'],
+            'middle': ['broken'],
+            'broken': [],
+            'other': [],
+        }, ['app', 'other'])
+        recorder = _Recorder(failing=['broken'])
+
+        self.assertEqual(1, self._fetch_all(recorder))
+        self.assertEqual({'broken', 'other'}, recorder.started_packages())
+        self.assertEqual({'other'}, recorder.fetched())
+
+    def test_cycles_are_reported(self):
+        # find_package_paths rejects cycles first, so hand over a graph
+        # with one directly
+        with mock.patch.object(
+            fetch.configure_buck, 'find_package_paths',
+            return_value=(
+                {name: os.path.join(self.tmp, 'node_modules', name)
+                 for name in ('a', 'b')},
+                {'a'},
+                {'a': {'dependencies': {'b': '*'}},
+                 'b': {'dependencies': {'a': '*'}}})
+        ):
+            with self.assertRaisesRegex(BuckitException, 'cycle.*a, b'):
+                self._fetch_all(_Recorder())
+
+    def test_network_and_cpu_slots_are_limited(self):
+        graph = {'pkg{}'.format(i): [] for i in range(8)}
+        self._make_project(graph, list(graph))
+        recorder = _Recorder()
+
+        self.assertEqual(
+            0, self._fetch_all(recorder, jobs=8, network_jobs=2, cpu_jobs=3))
+        self.assertEqual(set(graph), recorder.fetched())
+        self.assertEqual(2, recorder.max_holding['network'])
+        self.assertEqual(3, recorder.max_holding['cpu'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,646 @@
+#!/usr/bin/env python3
+
+# Copyright 2016-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree. An additional grant
+# of patent rights can be found in the PATENTS file in the same directory.
+
+import base64
+import csv
+import hashlib
+import http.server
+import io
+import os
+import pathlib
+import stat
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import zipfile
+
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compiler  # noqa: F401 (imported first to avoid an import cycle)
+import fetchers
+from constants import BUCKFILE
+from fetch import PythonSettings
+from fetchers import (
+    GitFetcher, HttpTarballFetcher, PipFetcher, get_store_entry, materialize
+)
+from helpers import BuckitException
+
+
+class _RangeHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves `server.body`, honouring `Range: bytes=N-` if
+    `server.supports_ranges`, and records the Range header of each request.
+    """
+
+    def do_GET(self):
+        body = self.server.body
+        range_header = self.headers.get('Range')
+        self.server.ranges.append(range_header)
+        start = 0
+        if self.server.status != 200:
+            self.send_response(self.server.status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if range_header and self.server.supports_ranges:
+            start = int(range_header[len('bytes='):-len('-')])
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header(
+                    'Content-Range', 'bytes */{}'.format(len(body)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, len(body) - 1, len(body)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body) - start))
+        self.end_headers()
+        self.wfile.write(body[start:])
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpTarballFetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = self._tmp.name
+        self.cache = os.path.join(self.tmp, 'cache')
+        os.mkdir(self.cache)
+        self.destination = os.path.join(self.cache, 'src')
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _write_tarball(self, members):
+        path = os.path.join(self.tmp, 'package.tar.gz')
+        with tarfile.open(path, 'w:gz') as tar:
+            for name, kind, value in members:
+                info = tarfile.TarInfo(name)
+                if kind == 'file':
+                    info.size = len(value)
+                    tar.addfile(info, io.BytesIO(value))
+                elif kind == 'dir':
+                    info.type = tarfile.DIRTYPE
+                    tar.addfile(info)
+                else:
+                    info.type = kind
+                    info.linkname = value
+                    tar.addfile(info)
+        with open(path, 'rb') as f:
+            sha256 = hashlib.sha256(f.read()).hexdigest()
+        return pathlib.Path(path).as_uri(), sha256
+
+    def _serve(self, path, supports_ranges=True, status=200):
+        server = http.server.HTTPServer(('127.0.0.1', 0), _RangeHandler)
+        with open(path, 'rb') as f:
+            server.body = f.read()
+        server.supports_ranges = supports_ranges
+        server.status = status
+        server.ranges = []
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return 'http://127.0.0.1:{}/package.tar.gz'.format(
+            server.server_port), server
+
+    def _serve_tarball(self, partial, **kwargs):
+        # Serves a tarball, with `partial(tarball)` already downloaded
+        _, sha256 = self._write_tarball([
+            ('package-1.0', 'dir', None),
+            ('package-1.0/README', 'file', os.urandom(64 * 1024)),
+        ])
+        path = os.path.join(self.tmp, 'package.tar.gz')
+        with open(path, 'rb') as f:
+            tarball = f.read()
+        with open(self.destination + '.partial', 'wb') as f:
+            f.write(partial(tarball))
+        url, server = self._serve(path, **kwargs)
+        return url, sha256, server, len(tarball)
+
+    def _assert_fetched(self):
+        self.assertTrue(
+            os.path.exists(os.path.join(self.destination, 'README')))
+        self.assertEqual(['src'], os.listdir(self.cache))
+
+    def _fetch(self, url, sha256):
+        fetcher = HttpTarballFetcher('package', None, url, sha256)
+        fetcher.populate_cache(self.destination, use_proxy=False)
+
+    def _assert_cache_untouched(self):
+        self.assertEqual([], os.listdir(self.cache))
+
+    def test_extracts_archive(self):
+        url, sha256 = self._write_tarball([
+            ('package-1.0', 'dir', None),
+            ('package-1.0/README', 'file', b'hello'),
+            ('package-1.0/LINK', tarfile.SYMTYPE, 'README'),
+        ])
+        self._fetch(url, sha256)
+        with open(os.path.join(self.destination, 'LINK'), 'rb') as f:
+            self.assertEqual(b'hello', f.read())
+        self.assertEqual(['src'], os.listdir(self.cache))
+
+    def test_hash_mismatch_extracts_nothing(self):
+        url, _ = self._write_tarball([
+            ('package-1.0', 'dir', None),
+            ('package-1.0/README', 'file', b'hello'),
+        ])
+        with self.assertRaisesRegex(BuckitException, 'SHA256'):
+            self._fetch(url, '0' * 64)
+        self._assert_cache_untouched()
+
+    def test_rejects_hostile_members(self):
+        outside = os.path.join(self.tmp, 'outside')
+        for members in (
+            [('package-1.0/../../outside', 'file', b'pwned')],
+            [(outside, 'file', b'pwned')],
+            [('package-1.0/link', tarfile.SYMTYPE, '../../outside')],
+            [('package-1.0/link', tarfile.SYMTYPE, outside)],
+            [('package-1.0/link', tarfile.LNKTYPE, '../outside')],
+            [('package-1.0/dev', tarfile.CHRTYPE, '')],
+            [
+                ('package-1.0/link', tarfile.SYMTYPE, '..'),
+                ('package-1.0/link/../outside', 'file', b'pwned'),
+            ],
+        ):
+            with self.subTest(members=members):
+                url, sha256 = self._write_tarball(
+                    [('package-1.0', 'dir', None)] + members)
+                with self.assertRaises(BuckitException):
+                    self._fetch(url, sha256)
+                self.assertFalse(os.path.lexists(outside))
+                self._assert_cache_untouched()
+
+    def test_resumes_partial_download(self):
+        url, sha256, server, size = self._serve_tarball(
+            lambda tarball: tarball[:len(tarball) // 2])
+        self._fetch(url, sha256)
+        self.assertEqual(['bytes={}-'.format(size // 2)], server.ranges)
+        self._assert_fetched()
+
+    def test_starts_over_without_range_support(self):
+        url, sha256, server, size = self._serve_tarball(
+            lambda tarball: b'stale', supports_ranges=False)
+        self._fetch(url, sha256)
+        self.assertEqual(['bytes=5-'], server.ranges)
+        self._assert_fetched()
+
+    def test_complete_partial_download_is_not_fetched_again(self):
+        url, sha256, server, size = self._serve_tarball(
+            lambda tarball: tarball)
+        self._fetch(url, sha256)
+        # The server answers 416, and the saved bytes are the whole file
+        self.assertEqual(['bytes={}-'.format(size)], server.ranges)
+        self._assert_fetched()
+
+    def test_starts_over_on_unsatisfiable_range(self):
+        url, sha256, server, size = self._serve_tarball(
+            lambda tarball: tarball + b'stale')
+        self._fetch(url, sha256)
+        self.assertEqual(['bytes={}-'.format(size + 5), None], server.ranges)
+        self._assert_fetched()
+
+    def test_http_error_removes_partial_download(self):
+        url, sha256, server, size = self._serve_tarball(
+            lambda tarball: tarball[:10], status=404)
+        with self.assertRaises(urllib.error.HTTPError):
+            self._fetch(url, sha256)
+        self.assertEqual(['bytes=10-'], server.ranges)
+        self._assert_cache_untouched()
+
+
+class GitFetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = self._tmp.name
+        # Protocol v0 only serves the advertised branch tips by SHA, like
+        # servers that do not allow fetching arbitrary commits
+        self.env = dict(
+            os.environ, GIT_CONFIG_COUNT='1',
+            GIT_CONFIG_KEY_0='protocol.version', GIT_CONFIG_VALUE_0='0')
+        work = os.path.join(self.tmp, 'work')
+        self._git('init', '--quiet', work)
+        self.commits = []
+        for i in range(3):
+            with open(os.path.join(work, 'version'), 'w') as f:
+                f.write(str(i))
+            self._git('add', 'version', cwd=work)
+            self._git(
+                '-c', 'user.name=buckit', '-c', 'user.email=buckit@localhost',
+                'commit', '--quiet', '-m', str(i), cwd=work)
+            self.commits.append(self._git('rev-parse', 'HEAD', cwd=work))
+        self.upstream = os.path.join(self.tmp, 'upstream.git')
+        self._git('clone', '--quiet', '--bare', work, self.upstream)
+        self.url = pathlib.Path(self.upstream).as_uri()
+        self.mirror = GitFetcher(
+            'package', None, self.url, self.commits[0], None
+        ).mirror_dir(self.tmp)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _git(self, *args, cwd=None):
+        return subprocess.check_output(
+            ('git',) + args, cwd=cwd, env=self.env,
+            stderr=subprocess.DEVNULL).decode('utf-8').strip()
+
+    def _fetch(self, commit):
+        fetcher = GitFetcher('package', None, self.url, commit, None)
+        fetcher.fetch_commit_into_mirror(self.mirror, self.env)
+        return fetcher
+
+    def _mirror_has(self, commit):
+        return subprocess.call(
+            ['git', 'cat-file', '-e', commit + '^{commit}'],
+            cwd=self.mirror, stderr=subprocess.DEVNULL) == 0
+
+    def _is_shallow(self):
+        return os.path.exists(os.path.join(self.mirror, 'shallow'))
+
+    def test_fetches_commit_by_sha(self):
+        self._fetch(self.commits[-1])
+        self.assertTrue(self._mirror_has(self.commits[-1]))
+        # Only that commit was fetched
+        self.assertTrue(self._is_shallow())
+        self.assertFalse(self._mirror_has(self.commits[0]))
+        self.assertEqual(self.commits[-1], self._git(
+            'rev-parse', 'refs/buckit/' + self.commits[-1], cwd=self.mirror))
+
+    def test_falls_back_to_all_refs(self):
+        self._fetch(self.commits[-1])
+        # The server does not serve commits that are not branch tips by
+        # SHA, so this fetches every branch, and unshallows the mirror
+        with self.assertLogs(level='INFO') as logs:
+            self._fetch(self.commits[0])
+        self.assertTrue(
+            any('fetching all refs' in line for line in logs.output))
+        self.assertFalse(self._is_shallow())
+        for commit in self.commits:
+            self.assertTrue(self._mirror_has(commit))
+        self.assertEqual(self.commits[0], self._git(
+            'rev-parse', 'refs/buckit/' + self.commits[0], cwd=self.mirror))
+
+    def test_unknown_commit(self):
+        with self.assertRaisesRegex(BuckitException, 'could not be found'):
+            self._fetch('0' * 40)
+
+    def test_reuses_mirror(self):
+        first = self._fetch(self.commits[-1])
+        second = self._fetch(self.commits[0])
+        self.assertEqual(
+            first.mirror_dir(self.tmp), second.mirror_dir(self.tmp))
+        # Both commits are now in the mirror, so neither needs the server
+        os.rename(self.upstream, self.upstream + '.gone')
+        for commit in self.commits:
+            self._fetch(commit)
+
+    def test_checkout_uses_mirror_objects(self):
+        fetcher = self._fetch(self.commits[-1])
+        self.assertTrue(self._is_shallow())
+        out_dir = os.path.join(self.tmp, 'out')
+        fetcher.checkout_from_mirror(self.mirror, out_dir, self.env)
+
+        with open(os.path.join(out_dir, 'version')) as f:
+            self.assertEqual('2', f.read())
+        with open(os.path.join(
+            out_dir, '.git', 'objects', 'info', 'alternates'
+        )) as f:
+            self.assertEqual(
+                os.path.join(self.mirror, 'objects') + '\n', f.read())
+        # No objects were copied into the checkout
+        objects = os.path.join(out_dir, '.git', 'objects')
+        self.assertEqual(
+            [], [os.path.join(dirpath, name)
+                 for dirpath, _, names in os.walk(objects)
+                 for name in names
+                 if os.path.relpath(dirpath, objects) != 'info'])
+        # Its history ends at the shallow commit
+        self.assertEqual(
+            [self.commits[-1]],
+            self._git('log', '--format=%H', cwd=out_dir).splitlines())
+
+
+class PipFetcherTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Creating a virtualenv takes a few seconds, so the tests share one
+        cls._tmp = tempfile.TemporaryDirectory()
+        cls.virtualenv_root = os.path.join(cls._tmp.name, 'venv')
+        cls.python_settings = PythonSettings(
+            False, True, None, None, [sys.executable, '-m', 'venv'],
+            cls.virtualenv_root)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._tmp.cleanup()
+
+    def setUp(self):
+        self._test_tmp = tempfile.TemporaryDirectory()
+        self.tmp = self._test_tmp.name
+        self.wheel_dir = os.path.join(self.tmp, 'wheels')
+        os.mkdir(self.wheel_dir)
+
+    def tearDown(self):
+        self._test_tmp.cleanup()
+
+    def _fetcher(self, package, version):
+        return PipFetcher(
+            package, 'package.json', '', '', package, version,
+            package.replace('-', '_'), [], self.python_settings)
+
+    def _build_wheel(self, name, version, files):
+        """
+        Writes a wheel of `files`, a dict of paths to contents, to
+        self.wheel_dir
+        """
+        dist = '{}-{}'.format(name.replace('-', '_'), version)
+        dist_info = dist + '.dist-info'
+        files = dict(files)
+        files[dist_info + '/METADATA'] = (
+            'Metadata-Version: 2.1\nName: {}\nVersion: {}\n'.format(
+                name, version))
+        files[dist_info + '/WHEEL'] = (
+            'Wheel-Version: 1.0\nGenerator: buckit-tests\n'
+            'Root-Is-Purelib: true\nTag: py3-none-any\n')
+        record = io.StringIO()
+        writer = csv.writer(record, lineterminator='\n')
+        for path, contents in sorted(files.items()):
+            digest = base64.urlsafe_b64encode(
+                hashlib.sha256(contents.encode('utf-8')).digest()
+            ).rstrip(b'=').decode('ascii')
+            writer.writerow(
+                [path, 'sha256=' + digest, len(contents.encode('utf-8'))])
+        writer.writerow([dist_info + '/RECORD', '', ''])
+        files[dist_info + '/RECORD'] = record.getvalue()
+        wheel = os.path.join(self.wheel_dir, dist + '-py3-none-any.whl')
+        with zipfile.ZipFile(wheel, 'w') as zf:
+            for path, contents in sorted(files.items()):
+                zf.writestr(path, contents)
+
+    def _site_packages(self, path):
+        site_packages = PipFetcher.get_site_packages(
+            fetchers.PipPythonSettings(
+                None, self.virtualenv_root, None, None, 'py3'))
+        return os.path.join(
+            os.path.relpath(site_packages, self.virtualenv_root), path)
+
+    def test_batch_install_from_wheel_dir(self):
+        self._build_wheel('buckit-demo', '1.0', {
+            'buckit_demo/__init__.py': '',
+            'buckit_demo/util.py': 'VALUE = 1\n',
+            'buckit_demo/data.txt': 'data\n',
+            'buckit_demo-1.0.data/scripts/demo-tool':
+                '#!python\nimport buckit_demo\n',
+        })
+        fetcher = self._fetcher('buckit-demo', '==1.0')
+        # The wheel dir has every wheel, so the index must not be used
+        with mock.patch.dict(os.environ, {
+            'PIP_INDEX_URL': 'http://127.0.0.1:9/',
+            'PIP_DISABLE_PIP_VERSION_CHECK': '1',
+        }):
+            PipFetcher.batch_install([fetcher], False, self.wheel_dir)
+
+        self.assertEqual({'py3'}, fetcher.installed)
+        self.assertEqual({
+            'srcs': {
+                self._site_packages('buckit_demo/__init__.py'):
+                    'buckit_demo/__init__.py',
+                self._site_packages('buckit_demo/util.py'):
+                    'buckit_demo/util.py',
+            },
+            'bins': {'demo-tool': 'bin/demo-tool'},
+        }, fetcher.python3_files)
+        for path in (
+            list(fetcher.python3_files['srcs']) +
+            list(fetcher.python3_files['bins'].values())
+        ):
+            self.assertTrue(
+                os.path.isfile(os.path.join(self.virtualenv_root, path)))
+
+    def _batch_install(self, fetcher):
+        with mock.patch.dict(os.environ, {
+            'PIP_INDEX_URL': 'http://127.0.0.1:9/',
+            'PIP_DISABLE_PIP_VERSION_CHECK': '1',
+        }):
+            PipFetcher.batch_install([fetcher], False, self.wheel_dir)
+
+    def test_buckfile_is_only_regenerated_when_inputs_change(self):
+        destination = os.path.join(self.tmp, 'buckit-regen')
+        buckfile = os.path.join(destination, BUCKFILE)
+        self._build_wheel('buckit-regen', '1.0', {
+            'buckit_regen/__init__.py': '',
+        })
+        fetcher = self._fetcher('buckit-regen', '==1.0')
+        self._batch_install(fetcher)
+        self.assertTrue(fetcher.should_fetch(destination, False))
+        fetcher.fetch(self.tmp, destination, False, update_buckconfig=False)
+        self.assertTrue(os.path.exists(buckfile))
+
+        self.assertFalse(
+            self._fetcher('buckit-regen', '==1.0').should_fetch(
+                destination, False))
+        self.assertTrue(
+            self._fetcher('buckit-regen', '==1.0').should_fetch(
+                destination, True))
+        changed_deps = self._fetcher('buckit-regen', '==1.0')
+        changed_deps.buck_deps = ['//other:dep']
+        self.assertTrue(changed_deps.should_fetch(destination, False))
+
+        # Fetching the same install again does not touch the BUCK file
+        os.utime(buckfile, ns=(0, 0))
+        fetcher.fetch(self.tmp, destination, False, update_buckconfig=False)
+        self.assertEqual(0, os.stat(buckfile).st_mtime_ns)
+
+        # Installing other files changes the RECORD, even though the spec
+        # in package.json stays the same
+        self._build_wheel('buckit-regen', '1.1', {
+            'buckit_regen/__init__.py': '',
+            'buckit_regen/added.py': '',
+        })
+        upgraded = self._fetcher('buckit-regen', '==1.1')
+        self._batch_install(upgraded)
+        self.assertTrue(
+            self._fetcher('buckit-regen', '==1.0').should_fetch(
+                destination, False))
+        upgraded.fetch(self.tmp, destination, False, update_buckconfig=False)
+        self.assertNotEqual(0, os.stat(buckfile).st_mtime_ns)
+        self.assertIn('buckit_regen/added.py', pathlib.Path(buckfile).read_text())
+        self.assertFalse(
+            self._fetcher('buckit-regen', '==1.1').should_fetch(
+                destination, False))
+
+        os.remove(os.path.join(destination, PipFetcher.MANIFEST))
+        self.assertTrue(
+            self._fetcher('buckit-regen', '==1.1').should_fetch(
+                destination, False))
+
+    def test_parse_record(self):
+        site_packages = os.path.join(
+            self.tmp, 'venv', 'lib', 'python3', 'site-packages')
+        record = os.path.join(site_packages, 'odd-1.0.dist-info', 'RECORD')
+        os.makedirs(os.path.dirname(record))
+        with open(record, 'w') as f:
+            f.write(
+                'odd/__init__.py,sha256=abc,1\n'
+                '"odd/comma,name.py",sha256=abc,1\n'
+                'odd/./sub/../mod.py,,\n'
+                'odd/data.txt,sha256=abc,1\n'
+                'odd-1.0.dist-info/RECORD,,\n'
+                '\n'
+                '../../../bin/odd,sha256=abc,1\n')
+        python_settings = fetchers.PipPythonSettings(
+            None, os.path.join(self.tmp, 'venv'), 'odd', '', 'py3')
+
+        files = self._fetcher('odd', '').parse_record(python_settings, record)
+        prefix = 'lib/python3/site-packages/'
+        self.assertEqual({
+            'srcs': {
+                prefix + 'odd/__init__.py': 'odd/__init__.py',
+                prefix + 'odd/comma,name.py': 'odd/comma,name.py',
+                prefix + 'odd/mod.py': 'odd/mod.py',
+            },
+            'bins': {'odd': 'bin/odd'},
+        }, files)
+
+
+class MaterializeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = os.path.join(self.tmp, 'store')
+        self.cache = self._make_cache('cache')
+
+    def tearDown(self):
+        # The store is read-only
+        fetchers._rmtree(self.tmp)
+
+    def _make_cache(self, name):
+        cache = os.path.join(self.tmp, name)
+        os.makedirs(os.path.join(cache, 'lib'))
+        for path, mode in (('writable', 0o644), ('lib/read_only', 0o444)):
+            with open(os.path.join(cache, path), 'w') as f:
+                f.write(path)
+            os.chmod(os.path.join(cache, path), mode)
+        os.symlink('lib/read_only', os.path.join(cache, 'link'))
+        return cache
+
+    def _mode(self, *path):
+        return stat.S_IMODE(os.lstat(os.path.join(*path)).st_mode)
+
+    def _materialize(self, name, strategy):
+        destination = os.path.join(self.tmp, name)
+        self.assertEqual(strategy, materialize(
+            self.cache, destination, [strategy], self.store))
+        return destination
+
+    def test_hardlink_shares_every_file_of_the_store(self):
+        linked = self._materialize('linked', 'hardlink')
+        entry = get_store_entry(self.cache, self.store)
+
+        for path in ('writable', 'lib/read_only'):
+            self.assertTrue(os.path.samefile(
+                os.path.join(entry, path), os.path.join(linked, path)))
+            self.assertFalse(os.path.samefile(
+                os.path.join(self.cache, path), os.path.join(linked, path)))
+            self.assertEqual(0o444, self._mode(entry, path))
+        self.assertEqual('lib/read_only', os.readlink(
+            os.path.join(linked, 'link')))
+
+        # The store is read-only, but the project's directories are not,
+        # and the cache is left alone
+        self.assertFalse(self._mode(entry, 'lib') & stat.S_IWUSR)
+        open(os.path.join(linked, 'lib', 'new'), 'w').close()
+        self.assertEqual(0o644, self._mode(self.cache, 'writable'))
+
+    def test_symlink_points_at_the_store(self):
+        linked = self._materialize('linked', 'symlink')
+        self.assertEqual(
+            get_store_entry(self.cache, self.store), os.readlink(linked))
+
+    def test_copy_uses_the_cache(self):
+        self._materialize('linked', 'hardlink')
+        copied = self._materialize('copied', 'copy')
+        self.assertEqual(0o644, self._mode(copied, 'writable'))
+        self.assertFalse(os.path.samefile(
+            os.path.join(get_store_entry(self.cache, self.store), 'writable'),
+            os.path.join(copied, 'writable')))
+
+    def test_store_is_content_addressed(self):
+        entry = get_store_entry(self.cache, self.store)
+        self.assertEqual(
+            entry, get_store_entry(self._make_cache('same'), self.store))
+
+        # The entry is only hashed once per cache directory, so changing the
+        # cache afterwards doesn't change the store
+        with open(os.path.join(self.cache, 'writable'), 'w') as f:
+            f.write('changed')
+        self.assertEqual(entry, get_store_entry(self.cache, self.store))
+        with open(os.path.join(entry, 'writable')) as f:
+            self.assertEqual('writable', f.read())
+
+        other = self._make_cache('other')
+        with open(os.path.join(other, 'writable'), 'w') as f:
+            f.write('other')
+        self.assertNotEqual(entry, get_store_entry(other, self.store))
+
+    def test_materialize_benchmark(self):
+        # Time taken and bytes written by each strategy for a package of
+        # 1000 files of 16KiB
+        package = os.path.join(self.tmp, 'package')
+        for i in range(1000):
+            path = os.path.join(package, 'dir{}'.format(i % 20), str(i))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(os.urandom(16 * 1024))
+
+        start = time.time()
+        entry = get_store_entry(package, self.store)
+        print('\nadding to the store: {:.3f}s'.format(time.time() - start),
+              file=sys.stderr)
+        for strategy in fetchers.MATERIALIZE_STRATEGIES:
+            materializer = fetchers._Materializer()
+            destination = os.path.join(self.tmp, strategy)
+            source = entry if strategy in fetchers.STORE_STRATEGIES \
+                else package
+            start = time.time()
+            try:
+                materializer.materialize(strategy, source, destination)
+            except fetchers._StrategyFailed as e:
+                print('{}: unsupported ({})'.format(strategy, e),
+                      file=sys.stderr)
+                continue
+            print(
+                '{}: {:.3f}s, wrote {} of {} bytes'.format(
+                    strategy, time.time() - start,
+                    materializer.bytes_written, materializer.bytes_total),
+                file=sys.stderr)
+            if strategy == 'copy':
+                self.assertEqual(16 * 1024 * 1000, materializer.bytes_written)
+            else:
+                self.assertEqual(0, materializer.bytes_written)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -125,7 +125,9 @@ def get_system_packages(project_root, node_modules, only_required):
     paths, root_pkgs, jsons = find_package_paths(project_root, node_modules)
     system_packages = set()
     for js in jsons.values():
-        all_pkgs = js.get('buckit', {}).get('required_system_packages', {})
+        # The jsons are shared with other callers, so do not update them
+        all_pkgs = dict(
+            js.get('buckit', {}).get('required_system_packages', {}))
         pkgs = get_for_current_system(all_pkgs, [])
         if not only_required:
             all_pkgs.update(js.get('buckit', {}).get('system_packages', {}))
@@ -182,6 +182,40 @@ def is_collection(obj):
 
     return False
 
+# Process-wide caches of parsed TP2 `build.dat` files, and of the project
+# builds derived from them.  Both map a `build.dat` path to the
+# `(mtime, size)` it was read at, and the cached value(s).
+_TP2_BUILD_DAT_CACHE = {}
+_TP2_PROJECT_BUILDS_CACHE = {}
+
+# Hit and miss counts of the caches above, for parse profiling.
+_TP2_CACHE_STATS = collections.Counter()
+
+
+def get_tp2_cache_stats():
+    """
+    Return the hit and miss counts of the TP2 `build.dat` and project build
+    caches.
+    """
+
+    return dict(_TP2_CACHE_STATS)
+
+
+def convert_build_target(base_path, raw_target, platform=None):
+    """
+    Convert the given raw target string (one given in deps) to a buck label,
+    memoized for the whole parse.
+    """
+
+    return target.memoized(
+        'build_target_label',
+        (raw_target, base_path, platform),
+        src_and_dep_helpers.convert_build_target,
+        base_path,
+        raw_target,
+        platform=platform)
+
+
 _THIN_LTO_FLAG = ["-flto=thin"]
 _LTO_FLAG = ["-flto"]
 
@@ -196,7 +230,6 @@ class Converter(object):
 
     def __init__(self, context):
         self._context = context
-        self._tp2_build_dat_cache = {}
 
     def get_third_party_root(self, platform):
         if self._context.config.get_third_party_use_platform_subdir():
@@ -385,7 +418,7 @@ class Converter(object):
         def convert_target_expander(name, target):
             return '$({} {})'.format(
                 name,
-                src_and_dep_helpers.convert_build_target(base_path, target, platform=platform))
+                convert_build_target(base_path, target, platform=platform))
 
         def as_is_converter(name, *args):
             return '$({})'.format(' '.join([name] + list(args)))
@@ -1235,23 +1268,39 @@ class Converter(object):
         attrs['cmd'] = ' && '.join(cmds)
         return Rule('genrule', attrs)
 
-    def get_tp2_build_dat(self, base_path):
+    def _load_tp2_build_dat(self, base_path):
         """
-        Load the TP2 metadata for the TP2 project at the given base path.
+        Return the path to the `build.dat` of the TP2 project at the given
+        base path, the `(mtime, size)` it was read at, and its contents.
         """
 
-        build_dat = self._tp2_build_dat_cache.get(base_path)
-        if build_dat is not None:
-            return build_dat
-
         fbsource_root = read_config('fbsource', 'repo_relative_path', '..');
         build_dat_name = os.path.join(fbsource_root, "fbcode", base_path, 'build.dat')
+        # Register the dep even when the contents are cached, since each build
+        # file that uses the project must be reparsed when it changes.
         self._context.buck_ops.add_build_file_dep('fbcode//' + build_dat_name)
+
+        stat = os.stat(build_dat_name)
+        path = os.path.abspath(build_dat_name)
+        stamp = (stat.st_mtime, stat.st_size)
+        cached = _TP2_BUILD_DAT_CACHE.get(path)
+        if cached is not None and cached[0] == stamp:
+            _TP2_CACHE_STATS['build_dat_hits'] += 1
+            return path, stamp, cached[1]
+
+        _TP2_CACHE_STATS['build_dat_misses'] += 1
         with open(build_dat_name) as f:
             build_dat = json.load(f)
 
-        self._tp2_build_dat_cache[base_path] = build_dat
-        return build_dat
+        _TP2_BUILD_DAT_CACHE[path] = (stamp, build_dat)
+        return path, stamp, build_dat
+
+    def get_tp2_build_dat(self, base_path):
+        """
+        Load the TP2 metadata for the TP2 project at the given base path.
+        """
+
+        return self._load_tp2_build_dat(base_path)[2]
 
     def get_tp2_platform(self, base_path):
         """
@@ -1266,7 +1315,28 @@ class Converter(object):
         each build of the TP2 project at the given base path.
         """
 
-        build_dat = self.get_tp2_build_dat(base_path)
+        path, stamp, build_dat = self._load_tp2_build_dat(base_path)
+        cache_key = (
+            None if relevant_deps is None else frozenset(relevant_deps))
+        cached = _TP2_PROJECT_BUILDS_CACHE.get(path)
+        if cached is None or cached[0] != stamp:
+            cached = (stamp, {})
+            _TP2_PROJECT_BUILDS_CACHE[path] = cached
+        project_builds = cached[1].get(cache_key)
+        if project_builds is not None:
+            _TP2_CACHE_STATS['project_builds_hits'] += 1
+            return project_builds
+
+        _TP2_CACHE_STATS['project_builds_misses'] += 1
+        project_builds = self._get_tp2_project_builds(build_dat, relevant_deps)
+        cached[1][cache_key] = project_builds
+        return project_builds
+
+    def _get_tp2_project_builds(self, build_dat, relevant_deps):
+        """
+        Build the result of `get_tp2_project_builds()` from a `build.dat`.
+        """
+
         default_versions = (
             {p: v[0] for p, v in build_dat['dependencies'].items()})
 
@@ -20,6 +20,7 @@ from subvol_utils import Subvol
 from .dep_graph import DependencyGraph
 from .items import gen_parent_layer_items
 from .items_for_features import gen_items_for_features
+from .snapshot_cache import build_incrementally, SnapshotCache
 from .subvolume_on_disk import SubvolumeOnDisk
 
 
@@ -78,6 +79,18 @@ def parse_args(args):
         help='The path of the JSON output of the `image_feature` that was '
             'auto-generated for the layer being built',
     )
+    parser.add_argument(
+        '--incremental-cache-dir',
+        help='Opt-in: keep snapshots of the partially built subvolume in '
+            'this directory, and resume later builds of this layer from the '
+            'longest matching prefix. Read the `snapshot_cache.py` docblock. '
+            'Must be on the same device as --refcounts-dir.',
+    )
+    parser.add_argument(
+        '--refcounts-dir',
+        help='Required with --incremental-cache-dir. The refcounts directory '
+            'used by `subvolume_garbage_collector.py`.',
+    )
     parser.add_argument(
         '--child-dependencies',
         nargs=argparse.REMAINDER, metavar=['TARGET', 'PATH'], default=(),
@@ -87,7 +100,10 @@ def parse_args(args):
             'The argument immediately following each target name must be a '
             'path to the output of that target on disk.',
     )
-    return parser.parse_args(args)
+    args = parser.parse_args(args)
+    if args.incremental_cache_dir and not args.refcounts_dir:
+        parser.error('--incremental-cache-dir requires --refcounts-dir')
+    return args
 
 
 def build_image(args):
@@ -105,12 +121,29 @@ def build_image(args):
             yum_from_repo_snapshot=args.yum_from_repo_snapshot,
         ),
     ))
-    for phase in dep_graph.ordered_phases():
-        phase.build(subvol)
-    # We cannot validate or sort `ImageItem`s until the phases are
-    # materialized since the items may depend on the output of the phases.
-    for item in dep_graph.gen_dependency_order_items(subvol.path().decode()):
-        item.build(subvol)
+    if args.incremental_cache_dir:
+        build_incrementally(
+            subvol,
+            dep_graph,
+            SnapshotCache(
+                cache_dir=args.incremental_cache_dir,
+                refcounts_dir=args.refcounts_dir,
+                subvolumes_dir=args.subvolumes_dir,
+                layer_target=args.child_layer_target,
+            ),
+            layer_target=args.child_layer_target,
+            parent_layer_json=args.parent_layer_json,
+        )
+    else:
+        for phase in dep_graph.ordered_phases():
+            phase.build(subvol)
+        # We cannot validate or sort `ImageItem`s until the phases are
+        # materialized since the items may depend on the output of the
+        # phases.
+        for item in dep_graph.gen_dependency_order_items(
+            subvol.path().decode(),
+        ):
+            item.build(subvol)
     # Build artifacts should never change.
     subvol.set_readonly(True)
 
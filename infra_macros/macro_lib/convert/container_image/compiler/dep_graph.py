@@ -8,7 +8,7 @@ already been installed.  This is known as dependency order or topological
 sort.
 '''
 from collections import namedtuple
-from typing import Iterable, Iterator
+from typing import Iterable, Iterator, List
 
 from .items import ImageItem, MultiRpmAction, ParentLayerItem, PhaseOrder
 
@@ -228,3 +228,38 @@ class DependencyGraph:
         # we must have a cycle. Future: print a cycle to simplify debugging.
         assert not ns.predecessor_to_items, \
             'Cycle in {}'.format(ns.predecessor_to_items)
+
+    def gen_dependency_order_item_groups(
+        self, sv_path: str,
+    ) -> Iterator[List[ImageItem]]:
+        '''
+        Like `gen_dependency_order_items`, but yields the items one
+        "generation" at a time: every item in a group only depends on items
+        from earlier groups.  The groups, and the items within each group,
+        come out in a deterministic order, which lets the incremental
+        compiler key snapshots of partially built subvolumes on them.
+        '''
+        ns = self._prep_item_predecessors(sv_path)
+        group = ns.items_without_predecessors
+        while group:
+            next_group = set()
+            for item in group:
+                for requiring_item in ns.predecessor_to_items[item]:
+                    predecessors = ns.item_to_predecessors[requiring_item]
+                    predecessors.remove(item)
+                    if not predecessors:
+                        next_group.add(requiring_item)
+                        del ns.item_to_predecessors[requiring_item]
+                del ns.predecessor_to_items[item]
+            # The parent layer is built as part of `ordered_phases()`.  It
+            # has no predecessors, so it can only be in the first group.
+            items = sorted((
+                i for i in group
+                    if i.phase_order is not PhaseOrder.PARENT_LAYER
+            ), key=repr)
+            if items:
+                yield items
+            group = next_group
+
+        assert not ns.predecessor_to_items, \
+            'Cycle in {}'.format(ns.predecessor_to_items)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+'''
+Writes the `btrfs send` stream of a built `image_layer` to `--output`,
+given the layer's JSON output.
+
+The stream is written as it is produced, and optionally compressed on the
+fly, so exporting a large image does not need a lot of RAM.
+
+With `--parent-layer-json`, the send is incremental (`btrfs send -p`)
+whenever the layer is a snapshot of its parent's subvolume, and that
+subvolume is still on disk.  Otherwise, we fall back to a full send, since
+an incremental stream is only useful to a receiver that has the parent.
+'''
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from subvol_utils import SENDSTREAM_COMPRESSORS, Subvol
+
+from . import subvolume_on_disk as svod
+
+log = logging.Logger(__name__)
+
+
+def _load_subvol(json_path: str, subvolumes_dir: str) -> Subvol:
+    with open(json_path) as infile:
+        return Subvol(svod.SubvolumeOnDisk.from_json_file(
+            infile, subvolumes_dir,
+        ).subvolume_path(), already_exists=True)
+
+
+def find_send_parent(
+    subvol: Subvol, parent_layer_json: str, subvolumes_dir: str,
+):
+    'Returns the parent layer `Subvol` if `btrfs send -p` can use it.'
+    try:
+        parent = _load_subvol(parent_layer_json, subvolumes_dir)
+    except Exception:
+        # Most likely, the parent layer was garbage-collected.
+        log.exception(f'Parent {parent_layer_json} is gone, doing full send')
+        return None
+    parent_uuid = svod._btrfs_get_volume_props(parent.path())['UUID']
+    subvol_parent_uuid = \
+        svod._btrfs_get_volume_props(subvol.path())['Parent UUID']
+    if parent_uuid != subvol_parent_uuid:
+        # E.g. the layer was received from a sendstream, or was restored
+        # from an incremental build snapshot.
+        log.warning(
+            f'{subvol.path()} is not a snapshot of {parent.path()} '
+            f'({subvol_parent_uuid} != {parent_uuid}), doing full send'
+        )
+        return None
+    return parent
+
+
+def write_sendstream(
+    subvol: Subvol, outfile, *, parent: Subvol=None, compression: str=None,
+):
+    'Returns the number of bytes written to `outfile`.'
+    start_pos = outfile.tell() if outfile.seekable() else None
+    start_time = time.monotonic()
+    subvol.mark_readonly_and_write_sendstream_to_file(
+        outfile, parent=parent, compression=compression,
+    )
+    elapsed = time.monotonic() - start_time
+    size = os.fstat(outfile.fileno()).st_size - start_pos \
+        if start_pos is not None else None
+    log.info(
+        f'Wrote {"incremental" if parent else "full"} '
+        f'{compression or "uncompressed"} sendstream of {subvol.path()}: '
+        f'{"?" if size is None else size} bytes in {elapsed:.2f} sec'
+    )
+    return size
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        '--subvolumes-dir', required=True,
+        help='The directory on a btrfs volume where the layers are stored',
+    )
+    parser.add_argument(
+        '--layer-json', required=True,
+        help='Path to the JSON output of the `image_layer` to export',
+    )
+    parser.add_argument(
+        '--parent-layer-json',
+        help='Path to the JSON output of the parent `image_layer`. If '
+            'possible, the sendstream will only contain changes against it.',
+    )
+    parser.add_argument(
+        '--compression', choices=sorted(SENDSTREAM_COMPRESSORS.keys()),
+        help='Compress the sendstream on the fly',
+    )
+    parser.add_argument(
+        '--output', required=True,
+        help='Where to write the sendstream, `-` for stdout',
+    )
+    parser.add_argument(
+        '--compare-to-full-send', action='store_true',
+        help='After an incremental send, also do a full send into a '
+            'temporary file next to `--output`, and log how the two compare',
+    )
+    return parser.parse_args(args)
+
+
+def export_sendstream(args, stdout):
+    subvol = _load_subvol(args.layer_json, args.subvolumes_dir)
+    parent = find_send_parent(
+        subvol, args.parent_layer_json, args.subvolumes_dir,
+    ) if args.parent_layer_json else None
+
+    if args.output == '-':
+        write_sendstream(
+            subvol, stdout, parent=parent, compression=args.compression,
+        )
+        return
+    with open(args.output, 'wb') as outfile:
+        size = write_sendstream(
+            subvol, outfile, parent=parent, compression=args.compression,
+        )
+    if parent and args.compare_to_full_send:
+        with tempfile.TemporaryFile(
+            dir=os.path.dirname(os.path.abspath(args.output)),
+        ) as full_file:
+            full_size = write_sendstream(
+                subvol, full_file, compression=args.compression,
+            )
+        log.info(
+            f'The incremental sendstream is {size} bytes, '
+            f'{100 * size / max(full_size, 1):.1f}% of the full one'
+        )
+
+
+if __name__ == '__main__':  # pragma: no cover
+    log.addHandler(logging.StreamHandler())
+    export_sendstream(parse_args(sys.argv[1:]), sys.stdout.buffer)
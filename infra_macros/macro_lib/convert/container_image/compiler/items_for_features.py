@@ -9,6 +9,15 @@ from .items import (
 )
 
 
+def _target_to_path(x, target_to_path: Mapping[str, str]) -> str:
+    assert len(x) == 1, x
+    (_, target), = x.items()
+    path = target_to_path.get(target)
+    if not path:
+        raise RuntimeError(f'{target} not in {target_to_path}')
+    return path
+
+
 def replace_targets_by_paths(x, target_to_path: Mapping[str, str]):
     '''
     JSON-serialized image features store single-item dicts of the form
@@ -18,21 +27,20 @@ def replace_targets_by_paths(x, target_to_path: Mapping[str, str]):
     compiler receives a dictionary of target-to-path mappings as
     `--child-dependencies`, and performs the substitution in any image
     feature JSON it consumes.
+
+    To avoid copying large features, this MUTATES the dicts & lists in `x`,
+    and returns `x` unless `x` itself is a target reference.
     '''
     if type(x) is dict:
         if '__BUCK_TARGET' in x:
-            assert len(x) == 1, x
-            (_, target), = x.items()
-            path = target_to_path.get(target)
-            if not path:
-                raise RuntimeError(f'{target} not in {target_to_path}')
-            return path
-        return {
-            k: replace_targets_by_paths(v, target_to_path)
-                for k, v in x.items()
-        }
+            return _target_to_path(x, target_to_path)
+        for k, v in x.items():
+            x[k] = replace_targets_by_paths(v, target_to_path)
+        return x
     elif type(x) is list:
-        return [replace_targets_by_paths(v, target_to_path) for v in x]
+        for i, v in enumerate(x):
+            x[i] = replace_targets_by_paths(v, target_to_path)
+        return x
     elif type(x) in [int, float, str]:
         return x
     assert False, 'Unknown {type(x)} for {x}'  # pragma: no cover
@@ -43,39 +51,51 @@ def gen_items_for_features(
     target_to_path: Mapping[str, str],
     yum_from_repo_snapshot: Optional[str],
 ):
+    '''
+    Lazily yields the items of the given features, and of all the features
+    that they transitively include.  Each feature JSON is loaded once, even
+    if several features include it (dependency diamonds), and its target
+    references are substituted one item at a time, as the items are made.
+    '''
     key_to_item_class = {
         'make_dirs': MakeDirsItem,
         'tarballs': TarballItem,
         'copy_files': CopyFileItem,
     }
     action_to_rpms = {action: set() for action in RpmActionType}
-    for feature_path in feature_paths:
-        with open(feature_path) as f:
-            items = replace_targets_by_paths(json.load(f), target_to_path)
+    # We visit the features depth-first, like the JSON nesting would suggest.
+    to_visit = list(reversed(feature_paths))
+    visited = set()
+    while to_visit:
+        feature_path = to_visit.pop()
+        if feature_path in visited:
+            continue
+        visited.add(feature_path)
 
-            yield from gen_items_for_features(
-                feature_paths=items.pop('features', []),
-                target_to_path=target_to_path,
-                yum_from_repo_snapshot=yum_from_repo_snapshot,
-            )
+        with open(feature_path) as f:
+            items = json.load(f)
 
-            target = items.pop('target')
-            for key, item_class in key_to_item_class.items():
-                for dct in items.pop(key, []):
-                    try:
-                        yield item_class(from_target=target, **dct)
-                    except Exception as ex:  # pragma: no cover
-                        raise RuntimeError(
-                            f'Failed to process {key}: {dct} from target '
-                            f'{target}, please read the exception above.'
-                        ) from ex
+        target = items.pop('target')
+        to_visit.extend(reversed(replace_targets_by_paths(
+            items.pop('features', []), target_to_path,
+        )))
+        for key, item_class in key_to_item_class.items():
+            for dct in items.pop(key, []):
+                dct = replace_targets_by_paths(dct, target_to_path)
+                try:
+                    yield item_class(from_target=target, **dct)
+                except Exception as ex:  # pragma: no cover
+                    raise RuntimeError(
+                        f'Failed to process {key}: {dct} from target '
+                        f'{target}, please read the exception above.'
+                    ) from ex
 
-            # Note that at present, we don't attempt to attribute RPMs to
-            # the build target(s) that requested them.
-            for dct in items.pop('rpms', []):
-                action_to_rpms[RpmActionType(dct['action'])].add(dct['name'])
+        # Note that at present, we don't attempt to attribute RPMs to
+        # the build target(s) that requested them.
+        for dct in items.pop('rpms', []):
+            action_to_rpms[RpmActionType(dct['action'])].add(dct['name'])
 
-            assert not items, f'Unsupported items: {items}'
+        assert not items, f'Unsupported items: {items}'
     for action, rpms in action_to_rpms.items():
         if rpms:
             yield MultiRpmAction.new(
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+'''
+Opt-in incremental builds for `image_layer`.
+
+Without this, any change to an `image_feature` makes the compiler rebuild
+the layer from its parent, re-running the RPM phases and every item.  With
+`--incremental-cache-dir`, the compiler instead keeps a chain of read-only
+snapshots of the partially built subvolume:
+
+  - one snapshot after all the phases (parent layer, RPMs, ...) ran,
+  - one snapshot after each group of `ImageItem`s, as yielded by
+    `DependencyGraph.gen_dependency_order_item_groups`.
+
+Each snapshot is keyed by a hash of everything that went into it -- the key
+of the previous snapshot, the fields of the items, and the contents of the
+files that the items read.  On a rebuild, we resume from the longest
+matching prefix of the chain, and only build the rest.
+
+## Cooperating with the garbage collector
+
+Cached snapshots are ordinary subvolumes in `--subvolumes-dir`, living in
+wrapper directories of the form `<layer name>:incremental-<key>-<id>`, so
+`subvolume_garbage_collector.py` understands them.  Each one has a refcount
+file in `--refcounts-dir`, which is hardlinked into the per-layer index
+`<--incremental-cache-dir>/<quoted layer target>/<key>.json`.  The index
+link keeps the snapshot live.  After every build, we unlink the index
+entries that are not part of the chain we just used, so their link count
+drops to 1, and the next GC pass deletes them.  Therefore, each layer holds
+on to at most one chain of snapshots.
+
+The index entries contain the `SubvolumeOnDisk` JSON of the snapshot, so
+stale or half-written entries fail validation and are treated as misses.
+'''
+import enum
+import hashlib
+import json
+import logging
+import os
+import urllib.parse
+import uuid
+
+from typing import Iterable, List, Optional
+
+from subvol_utils import Subvol
+
+from .dep_graph import DependencyGraph
+from .subvolume_on_disk import SubvolumeOnDisk
+
+log = logging.Logger(__name__)
+
+_HASH_BUFFER_SIZE = 64 * 1024
+# Items whose fields name files that the item reads at build time.  The key
+# of a snapshot must change whenever those files change.
+_FILE_FIELDS = ('source', 'tarball', 'yum_from_snapshot')
+# Only used to attribute items to targets, they do not affect the result.
+_IGNORED_FIELDS = ('DO_NOT_USE_type', 'from_target')
+
+
+def _hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_BUFFER_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _item_key_material(item):
+    'A JSON-serializable, deterministic description of an item or phase'
+    d = {'__type__': type(item).__name__}
+    for k, v in item._asdict().items():
+        if k in _IGNORED_FIELDS:
+            continue
+        if isinstance(v, (set, frozenset)):
+            v = sorted(v)
+        elif isinstance(v, enum.Enum):
+            v = v.name
+        d[k] = v
+        if k in _FILE_FIELDS and v is not None:
+            d[k + '__sha256'] = _hash_file(v)
+    return d
+
+
+def _chain_key(prev_key: str, items) -> str:
+    return hashlib.sha256(json.dumps(
+        [prev_key, [_item_key_material(i) for i in items]], sort_keys=True,
+    ).encode()).hexdigest()
+
+
+def phases_key(layer_target: str, parent_layer_json: Optional[str], phases):
+    'Keys the snapshot taken after `DependencyGraph.ordered_phases()` ran.'
+    # The parent layer JSON is a serialized `SubvolumeOnDisk`, so this
+    # changes whenever the parent layer is rebuilt.
+    parent_hash = _hash_file(parent_layer_json) if parent_layer_json else ''
+    return _chain_key(f'{layer_target} {parent_hash}', phases)
+
+
+def item_group_keys(
+    prev_key: str, item_groups: Iterable[List['ImageItem']],
+) -> List[str]:
+    'Keys the snapshots taken after building each group of items.'
+    keys = []
+    for group in item_groups:
+        prev_key = _chain_key(prev_key, group)
+        keys.append(prev_key)
+    return keys
+
+
+class SnapshotCache:
+    'Read the module docblock.'
+
+    def __init__(
+        self, *, cache_dir: str, refcounts_dir: str, subvolumes_dir: str,
+        layer_target: str,
+    ):
+        self._index_dir = os.path.join(
+            cache_dir, urllib.parse.quote(layer_target, safe=''),
+        )
+        self._refcounts_dir = refcounts_dir
+        self._subvolumes_dir = subvolumes_dir
+        self._layer_name = layer_target.rsplit(':', 1)[-1]
+        os.makedirs(self._index_dir, exist_ok=True)
+
+    def _index_path(self, key: str) -> str:
+        return os.path.join(self._index_dir, f'{key}.json')
+
+    def get(self, key: str) -> Optional[str]:
+        'Returns the path of the cached snapshot, or None on a miss.'
+        index_path = self._index_path(key)
+        if not os.path.exists(index_path):
+            return None
+        try:
+            with open(index_path) as infile:
+                return SubvolumeOnDisk.from_json_file(
+                    infile, self._subvolumes_dir,
+                ).subvolume_path()
+        except Exception:
+            # Most likely, a prior build died while saving this snapshot.
+            # Dropping the index link makes it eligible for GC.
+            log.exception(f'Ignoring bad snapshot cache entry {index_path}')
+            os.unlink(index_path)
+            return None
+
+    def save(self, subvol: Subvol, key: str) -> str:
+        'Snapshots `subvol` as the cache entry `key`, returns its path.'
+        index_path = self._index_path(key)
+        try:
+            os.unlink(index_path)
+        except FileNotFoundError:
+            pass
+        # The key alone is not unique, since a stale wrapper for the same
+        # key may be awaiting garbage collection.
+        wrapper = '{}:incremental-{}-{}'.format(
+            self._layer_name, key[:16], uuid.uuid4().hex[:8],
+        )
+        refcount_path = os.path.join(self._refcounts_dir, f'{wrapper}.json')
+        # Same order as in `subvolume_garbage_collector`: the refcount must
+        # exist before the wrapper, since GC lists wrappers before refcounts.
+        os.close(os.open(
+            refcount_path,
+            flags=os.O_CREAT | os.O_EXCL | os.O_CLOEXEC | os.O_NOCTTY,
+            mode=0o600,
+        ))
+        os.link(refcount_path, index_path)
+        os.mkdir(os.path.join(self._subvolumes_dir, wrapper), mode=0o700)
+
+        snapshot = Subvol(os.path.join(self._subvolumes_dir, wrapper, 'cache'))
+        snapshot.snapshot(subvol)
+        snapshot.set_readonly(True)
+        # Opening with 'w' keeps the inode, and thus the refcount link.
+        with open(index_path, 'w') as outfile:
+            SubvolumeOnDisk.from_subvolume_path(
+                snapshot.path().decode(), self._subvolumes_dir,
+            ).to_json_file(outfile)
+        return snapshot.path().decode()
+
+    def retain_only(self, keys: Iterable[str]):
+        'Makes every cache entry not in `keys` eligible for GC.'
+        keep = {f'{k}.json' for k in keys}
+        for filename in os.listdir(self._index_dir):
+            if filename not in keep:
+                os.unlink(os.path.join(self._index_dir, filename))
+
+
+def build_incrementally(
+    subvol: Subvol,
+    dep_graph: DependencyGraph,
+    cache: SnapshotCache,
+    layer_target: str,
+    parent_layer_json: Optional[str],
+):
+    '''
+    Does the work of `build_image` for a not-yet-created `subvol`, but
+    resumes from the longest cached prefix of the build.
+    '''
+    phases = dep_graph.ordered_phases()
+    first_key = phases_key(layer_target, parent_layer_json, phases)
+    phases_snapshot = cache.get(first_key)
+    if phases_snapshot is None:
+        for phase in phases:
+            phase.build(subvol)
+        cache.save(subvol, first_key)
+        # The dependency sort must look at the post-phase subvolume.
+        phases_snapshot = subvol.path().decode()
+        next_group = 0
+    else:
+        next_group = None
+
+    item_groups = list(
+        dep_graph.gen_dependency_order_item_groups(phases_snapshot)
+    )
+    keys = [first_key, *item_group_keys(first_key, item_groups)]
+
+    if next_group is None:
+        # `keys[i]` describes the state after building `item_groups[:i]`.
+        for next_group in range(len(item_groups), -1, -1):
+            snapshot_path = cache.get(keys[next_group])
+            if snapshot_path is not None:
+                break
+        else:  # pragma: no cover
+            raise AssertionError('The phases snapshot just vanished')
+        log.info(
+            f'Resuming {layer_target} from a snapshot after item group '
+            f'{next_group} of {len(item_groups)}'
+        )
+        subvol.snapshot(Subvol(snapshot_path, already_exists=True))
+
+    for idx in range(next_group, len(item_groups)):
+        for item in item_groups[idx]:
+            item.build(subvol)
+        cache.save(subvol, keys[idx + 1])
+
+    cache.retain_only(keys)
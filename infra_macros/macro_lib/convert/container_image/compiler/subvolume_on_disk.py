@@ -7,11 +7,14 @@
 # LICENSE file in the root directory of this source tree. An additional grant
 # of patent rights can be found in the PATENTS file in the same directory.
 'See the SubvolumeOnDisk docblock.'
+import fcntl
 import json
 import logging
 import os
 import socket
+import struct
 import subprocess
+import uuid
 
 from collections import namedtuple
 
@@ -29,7 +32,47 @@ _SUBVOLUME_REL_PATH = 'subvolume_rel_path'  # (1-3)
 _DANGER = 'DANGER'  # (2)
 
 
-def _btrfs_get_volume_props(subvolume_path):
+# `BTRFS_IOC_GET_SUBVOL_INFO` (Linux 4.18+) fills in the 504-byte
+# `struct btrfs_ioctl_get_subvol_info_args`.  We only unpack its prefix:
+#   u64 treeid, char name[256], u64 parent_id, u64 dirid, u64 generation,
+#   u64 flags, u8 uuid[16], u8 parent_uuid[16]
+_BTRFS_IOC_GET_SUBVOL_INFO = 0x81f8943c  # _IOR(0x94, 60, 504 bytes)
+_SUBVOL_INFO_SIZE = 504
+_SUBVOL_INFO_PREFIX = struct.Struct('=Q256sQQQQ16s16s')
+_BTRFS_ROOT_SUBVOL_RDONLY = 1 << 0
+_NULL_UUID = bytes(16)
+# The inode number of the root directory of every btrfs subvolume.
+_BTRFS_FIRST_FREE_OBJECTID = 256
+
+
+def _btrfs_ioctl_get_volume_props(subvolume_path):
+    '''
+    Unlike `btrfs subvolume show`, this ioctl needs no privileges, and does
+    not enumerate the snapshots of the subvolume, so it stays cheap on hosts
+    that have built many layers.  Returns the same keys & value formats as
+    the CLI, but only the ones that we use.
+    '''
+    buf = bytearray(_SUBVOL_INFO_SIZE)
+    fd = os.open(subvolume_path, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+    try:
+        fcntl.ioctl(fd, _BTRFS_IOC_GET_SUBVOL_INFO, buf)
+        # For any other directory, the ioctl describes the subvolume that
+        # contains it, while `btrfs subvolume show` would fail.
+        if os.fstat(fd).st_ino != _BTRFS_FIRST_FREE_OBJECTID:
+            raise RuntimeError(f'{subvolume_path} is not a btrfs subvolume')
+    finally:
+        os.close(fd)
+    flags, btrfs_uuid, parent_uuid = \
+        _SUBVOL_INFO_PREFIX.unpack_from(buf)[-3:]
+    return {
+        'UUID': str(uuid.UUID(bytes=btrfs_uuid)),
+        'Parent UUID': '-' if parent_uuid == _NULL_UUID
+            else str(uuid.UUID(bytes=parent_uuid)),
+        'Flags': 'readonly' if flags & _BTRFS_ROOT_SUBVOL_RDONLY else '-',
+    }
+
+
+def _btrfs_cli_get_volume_props(subvolume_path):
     SNAPSHOTS = 'Snapshot(s)'
     props = {}
     # It's unfair to assume that the OS encoding is UTF-8, but our JSON
@@ -42,24 +85,33 @@ def _btrfs_get_volume_props(subvolume_path):
     for l in subprocess.check_output([
         'sudo', 'btrfs', 'subvolume', 'show', subvolume_path,
     ]).decode('utf-8').split('\n')[1:]:  # Skip the header line
-        if SNAPSHOTS in props:
-            if l:  # Ignore the trailing empty line
-                TABS = 4
-                assert l[:TABS] == '\t' * TABS, 'Not a snapshot line' + repr(l)
-                props[SNAPSHOTS].append(l[TABS:])
-        else:
-            k, v = l.strip().split(':', 1)
-            k = k.rstrip(':')
-            v = v.strip()
-            if k == SNAPSHOTS:
-                assert v == '', f'Should have nothing after ":" in: {l}'
-                props[SNAPSHOTS] = []
-            else:
-                assert k not in props, f'{l} already had a value {props[k]}'
-                props[k] = v
+        k, v = l.strip().split(':', 1)
+        k = k.rstrip(':')
+        v = v.strip()
+        # The snapshot list comes last, and grows with every layer built
+        # from this one.  Nobody needs it, so don't parse it.
+        if k == SNAPSHOTS:
+            assert v == '', f'Should have nothing after ":" in: {l}'
+            break
+        assert k not in props, f'{l} already had a value {props[k]}'
+        props[k] = v
     return props
 
 
+def _btrfs_get_volume_props(subvolume_path):
+    '''
+    Returns a dict with at least the keys 'UUID', 'Parent UUID', and
+    'Flags', formatted as by `btrfs subvolume show`.
+    '''
+    try:
+        return _btrfs_ioctl_get_volume_props(subvolume_path)
+    except OSError as ex:
+        # Older kernels lack the ioctl, and directories that our user
+        # cannot open need `sudo`.  Neither is worth failing the build.
+        log.debug(f'Falling back to `btrfs subvolume show`: {ex}')
+        return _btrfs_cli_get_volume_props(subvolume_path)
+
+
 class SubvolumeOnDisk(namedtuple('SubvolumeOnDisk', [
     _BTRFS_UUID,
     _HOSTNAME,
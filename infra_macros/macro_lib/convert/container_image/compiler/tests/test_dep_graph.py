@@ -161,6 +161,21 @@ class DependencyOrderItemsTestCase(unittest.TestCase):
             },
         )
 
+    def test_gen_dependency_order_item_groups(self):
+        dg = DependencyGraph(PATH_TO_ITEM.values())
+        self.assertEqual([PATH_TO_ITEM['/']], dg.ordered_phases())
+        self.assertEqual(
+            [
+                [PATH_TO_ITEM['/a/b/c']],
+                sorted(
+                    [PATH_TO_ITEM['/a/b/c/F'], PATH_TO_ITEM['/a/d/e']],
+                    key=repr,
+                ),
+                [PATH_TO_ITEM['/a/d/e/G']],
+            ],
+            list(dg.gen_dependency_order_item_groups('fake_subvol_path')),
+        )
+
     def test_cycle_detection(self):
 
         def requires_provides_directory_class(requires_dir, provides_dir):
@@ -194,6 +209,13 @@ class DependencyOrderItemsTestCase(unittest.TestCase):
         with self.assertRaisesRegex(AssertionError, '^Cycle in '):
             list(dg.gen_dependency_order_items('fake_subvol_path'))
 
+        dg = DependencyGraph([
+            requires_provides_directory_class('a/b', 'a')(from_target=''),
+            first, third,
+        ])
+        with self.assertRaisesRegex(AssertionError, '^Cycle in '):
+            list(dg.gen_dependency_order_item_groups('fake_subvol_path'))
+
     def test_phase_order(self):
 
         class FakeFileRemove:
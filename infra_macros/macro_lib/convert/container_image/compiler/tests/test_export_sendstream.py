@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+import subvol_utils
+
+from .. import subvolume_on_disk as svod
+from ..export_sendstream import export_sendstream, log, parse_args
+
+
+class ExportSendstreamTestCase(unittest.TestCase):
+
+    def setUp(self):
+        td = tempfile.TemporaryDirectory()
+        self.addCleanup(td.cleanup)
+        self.tmp = td.name
+        self.subvols_dir = os.path.join(self.tmp, 'subvols')
+        self.uuids = {}
+        self.layer_json = self._make_layer('child:1/child', 'parent-uuid')
+        self.parent_json = self._make_layer('parent:1/parent', None)
+
+        # We cannot make real subvolumes, so fake the sends: a full send
+        # emits more bytes than an incremental one.
+        def write_sendstream(subvol, outfile, *, parent, compression):
+            self.sends.append((subvol.path(), parent, compression))
+            outfile.write(b'delta' if parent else b'full stream')
+            outfile.flush()
+
+        self.sends = []
+        for p in [
+            unittest.mock.patch.object(
+                subvol_utils.Subvol,
+                'mark_readonly_and_write_sendstream_to_file',
+                autospec=True, side_effect=write_sendstream,
+            ),
+            unittest.mock.patch.object(
+                subvol_utils, '_path_is_btrfs_subvol', return_value=True,
+            ),
+            unittest.mock.patch.object(
+                svod, '_btrfs_get_volume_props',
+                side_effect=lambda path: self.uuids[os.fsdecode(path)],
+            ),
+        ]:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _make_layer(self, rel_path, parent_uuid):
+        path = os.path.join(self.subvols_dir, rel_path)
+        os.makedirs(path)
+        self.uuids[path] = {
+            'UUID': rel_path.split(':')[0] + '-uuid',
+            'Parent UUID': parent_uuid or '-',
+        }
+        json_path = os.path.join(self.tmp, rel_path.split(':')[0] + '.json')
+        with unittest.mock.patch.object(
+            svod, '_btrfs_get_volume_props',
+            return_value=self.uuids[path],
+        ), open(json_path, 'w') as outfile:
+            svod.SubvolumeOnDisk.from_subvolume_path(
+                path, self.subvols_dir,
+            ).to_json_file(outfile)
+        return json_path
+
+    def _export(self, *args, stdout=None):
+        export_sendstream(parse_args([
+            '--subvolumes-dir', self.subvols_dir,
+            '--layer-json', self.layer_json,
+            *args,
+        ]), stdout)
+
+    def _sent_parents(self):
+        return [parent and parent.path() for _, parent, _ in self.sends]
+
+    def test_full_send_to_stdout_pipe(self):
+        r_fd, w_fd = os.pipe()
+        with open(r_fd, 'rb') as r, open(w_fd, 'wb') as stdout:
+            self._export(
+                '--output', '-', '--compression', 'zst', stdout=stdout,
+            )
+            stdout.close()
+            self.assertEqual(b'full stream', r.read())
+        self.assertEqual([(
+            os.path.join(self.subvols_dir, 'child:1/child').encode(),
+            None,
+            'zst',
+        )], self.sends)
+
+    def test_incremental_send(self):
+        out = os.path.join(self.tmp, 'out')
+        with self.assertLogs(log, level='INFO') as logs:
+            self._export(
+                '--parent-layer-json', self.parent_json,
+                '--output', out, '--compare-to-full-send',
+            )
+        with open(out, 'rb') as f:
+            self.assertEqual(b'delta', f.read())
+        self.assertEqual([
+            os.path.join(self.subvols_dir, 'parent:1/parent').encode(), None,
+        ], self._sent_parents())
+        self.assertIn('5 bytes, 45.5% of the full one', logs.output[-1])
+
+    def test_full_send_fallbacks(self):
+        out = os.path.join(self.tmp, 'out')
+        # The child is not a snapshot of this parent.
+        self.uuids[
+            os.path.join(self.subvols_dir, 'child:1/child')
+        ]['Parent UUID'] = 'other-uuid'
+        self._export(
+            '--parent-layer-json', self.parent_json, '--output', out,
+            '--compare-to-full-send',  # No-op without a parent
+        )
+        # The parent layer was garbage-collected.
+        os.rmdir(os.path.join(self.subvols_dir, 'parent:1/parent'))
+        self._export('--parent-layer-json', self.parent_json, '--output', out)
+        self.assertEqual([None, None], self._sent_parents())
+        with open(out, 'rb') as f:
+            self.assertEqual(b'full stream', f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
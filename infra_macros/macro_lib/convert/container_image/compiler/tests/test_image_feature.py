@@ -1,9 +1,14 @@
 #!/usr/bin/env python3
+import json
+import os
 import tempfile
 import unittest
 
 from ..dep_graph import DependencyGraph
-from ..items_for_features import gen_items_for_features
+from ..items import CopyFileItem, MakeDirsItem
+from ..items_for_features import (
+    gen_items_for_features, replace_targets_by_paths,
+)
 
 from . import sample_items as si
 
@@ -33,6 +38,50 @@ class ImageFeatureTestCase(unittest.TestCase):
                 yum_from_repo_snapshot='/fake/yum',
             ))
 
+    def test_feature_diamond(self):
+        with tempfile.TemporaryDirectory() as td:
+
+            def write_feature(name, **kwargs):
+                path = os.path.join(td, name)
+                with open(path, 'w') as f:
+                    json.dump({'target': '//t:' + name, **kwargs}, f)
+                return path
+
+            target_to_path = {'//t:src': '/src/path'}
+            for name in ('left', 'right'):
+                target_to_path['//t:' + name] = write_feature(
+                    name, features=[{'__BUCK_TARGET': '//t:bottom'}],
+                )
+            target_to_path['//t:bottom'] = write_feature(
+                'bottom',
+                make_dirs=[{'into_dir': '/', 'path_to_make': 'a'}],
+                copy_files=[{'source': {'__BUCK_TARGET': '//t:src'},
+                             'dest': '/a/'}],
+            )
+            top = write_feature('top', features=[
+                {'__BUCK_TARGET': '//t:left'}, {'__BUCK_TARGET': '//t:right'},
+            ])
+            # The shared `bottom` feature is only expanded once.
+            self.assertEqual([
+                MakeDirsItem(
+                    from_target='//t:bottom', into_dir='/', path_to_make='a',
+                ),
+                CopyFileItem(
+                    from_target='//t:bottom', source='/src/path', dest='/a/',
+                ),
+            ], list(gen_items_for_features(
+                [top], target_to_path, yum_from_repo_snapshot=None,
+            )))
+
+    def test_replace_targets_by_paths_in_place(self):
+        inner = [{'__BUCK_TARGET': '//a:b'}, 5]
+        outer = {'k': inner}
+        self.assertIs(
+            outer, replace_targets_by_paths(outer, {'//a:b': '/a/b'}),
+        )
+        self.assertEqual({'k': ['/a/b', 5]}, outer)
+        self.assertIs(inner, outer['k'])
+
     def test_install_order(self):
         dg = DependencyGraph(si.ID_TO_ITEM.values())
         phases = dg.ordered_phases()
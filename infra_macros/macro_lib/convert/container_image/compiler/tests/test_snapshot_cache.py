@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+import subvol_utils
+
+from .. import subvolume_on_disk as svod
+from ..dep_graph import DependencyGraph
+from ..items import CopyFileItem, FilesystemRootItem, MakeDirsItem
+from ..snapshot_cache import (
+    build_incrementally, item_group_keys, phases_key, SnapshotCache,
+)
+
+LAYER = '//fake/layer:name'
+INDEX_SUBDIR = '%2F%2Ffake%2Flayer%3Aname'
+
+
+class SnapshotCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        td = tempfile.TemporaryDirectory()
+        self.addCleanup(td.cleanup)
+        self.tmp = td.name
+        self.subvols_dir = os.path.join(self.tmp, 'subvols')
+        self.refcounts_dir = os.path.join(self.tmp, 'refcounts')
+        self.cache_dir = os.path.join(self.tmp, 'cache')
+        for d in (self.subvols_dir, self.refcounts_dir):
+            os.mkdir(d)
+        self.source = os.path.join(self.tmp, 'source')
+        with open(self.source, 'w') as f:
+            f.write('contents')
+
+        # We cannot make real subvolumes, so record the commands that would
+        # have been run, and fake just enough of the filesystem state for
+        # `SubvolumeOnDisk` validation to pass.
+        def run_as_root(args, **kwargs):
+            if args[:3] == ['btrfs', 'subvolume', 'snapshot']:
+                os.mkdir(args[4])
+            self.commands.append(args)
+
+        self.commands = []
+        for p in [
+            unittest.mock.patch.object(
+                subvol_utils.Subvol, 'run_as_root', side_effect=run_as_root,
+            ),
+            unittest.mock.patch.object(
+                subvol_utils, '_path_is_btrfs_subvol', return_value=True,
+            ),
+            unittest.mock.patch.object(
+                svod, '_btrfs_get_volume_props',
+                return_value={'UUID': 'fake uuid'},
+            ),
+        ]:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _cache(self):
+        return SnapshotCache(
+            cache_dir=self.cache_dir,
+            refcounts_dir=self.refcounts_dir,
+            subvolumes_dir=self.subvols_dir,
+            layer_target=LAYER,
+        )
+
+    def _items(self, dest='d/e/f'):
+        return [
+            FilesystemRootItem(from_target=LAYER),
+            MakeDirsItem(from_target=LAYER, into_dir='/', path_to_make='d/e'),
+            CopyFileItem(from_target=LAYER, source=self.source, dest=dest),
+        ]
+
+    def _index(self):
+        return sorted(os.listdir(os.path.join(self.cache_dir, INDEX_SUBDIR)))
+
+    def _refcount_nlinks(self):
+        return sorted(
+            os.stat(os.path.join(self.refcounts_dir, p)).st_nlink
+                for p in os.listdir(self.refcounts_dir)
+        )
+
+    def _build(self, items, name):
+        self.commands = []
+        subvol = subvol_utils.Subvol(os.path.join(self.subvols_dir, name))
+        build_incrementally(
+            subvol, DependencyGraph(items), self._cache(),
+            layer_target=LAYER, parent_layer_json=None,
+        )
+        return subvol
+
+    def test_keys(self):
+        root = FilesystemRootItem(from_target=LAYER)
+        key = phases_key(LAYER, None, [root])
+        self.assertEqual(key, phases_key(LAYER, None, [root]))
+        self.assertNotEqual(key, phases_key('//other:layer', None, [root]))
+
+        parent_json = os.path.join(self.tmp, 'parent.json')
+        with open(parent_json, 'w') as f:
+            f.write('{}')
+        self.assertNotEqual(key, phases_key(LAYER, parent_json, [root]))
+
+        groups = [self._items()[1:2], self._items()[2:]]
+        keys = item_group_keys(key, groups)
+        self.assertEqual(2, len(keys))
+        self.assertEqual(keys, item_group_keys(key, groups))
+        # Attribution to a target does not affect the build output.
+        self.assertEqual(keys, item_group_keys(key, [
+            [i._replace(from_target='//other:target') for i in g]
+                for g in groups
+        ]))
+        # But the contents of source files do.
+        with open(self.source, 'w') as f:
+            f.write('new contents')
+        new_keys = item_group_keys(key, groups)
+        self.assertEqual(keys[0], new_keys[0])
+        self.assertNotEqual(keys[1], new_keys[1])
+
+    def test_save_get_retain(self):
+        cache = self._cache()
+        self.assertIsNone(cache.get('k1'))
+        path = cache.save(
+            subvol_utils.Subvol(os.path.join(self.subvols_dir, 'x')), 'k1',
+        )
+        self.assertEqual(path, cache.get('k1'))
+        wrapper = os.path.basename(os.path.dirname(path))
+        self.assertTrue(wrapper.startswith('name:incremental-k1-'), wrapper)
+        # The index entry keeps the refcount alive for the GC.
+        self.assertEqual(2, os.stat(
+            os.path.join(self.refcounts_dir, wrapper + '.json')
+        ).st_nlink)
+        self.assertEqual(['k1.json'], self._index())
+
+        cache.retain_only([])
+        self.assertEqual([], self._index())
+        self.assertEqual([1], self._refcount_nlinks())
+
+        # A half-written entry is a miss, and is dropped from the index.
+        with open(os.path.join(self.cache_dir, INDEX_SUBDIR, 'k2.json'), 'w'):
+            pass
+        self.assertIsNone(cache.get('k2'))
+        self.assertEqual([], self._index())
+
+    def test_build_incrementally(self):
+        # Cold: builds everything, and snapshots after the phases, and after
+        # each of the 2 item groups.
+        self._build(self._items(), 'first')
+        self.assertIn(['chmod', '0755', os.path.join(
+            self.subvols_dir, 'first',
+        ).encode()], self.commands)
+        self.assertEqual(3, len(self._index()))
+
+        # Nothing changed: just snapshot the final state of the cold build.
+        self._build(self._items(), 'second')
+        self.assertEqual(1, sum(
+            c[:3] == ['btrfs', 'subvolume', 'snapshot'] for c in self.commands
+        ), self.commands)
+        self.assertFalse(any(c[0] in ('mkdir', 'cp') for c in self.commands))
+        self.assertEqual(3, len(self._index()))
+
+        # Changing the last item only rebuilds the last group.
+        self._build(self._items(dest='d/e/g'), 'third')
+        self.assertFalse(any(c[0] == 'mkdir' for c in self.commands))
+        self.assertEqual(1, sum(c[0] == 'cp' for c in self.commands))
+        # The old final snapshot is no longer referenced by the index, so
+        # the next GC pass will delete it.
+        self.assertEqual(3, len(self._index()))
+        self.assertEqual([1, 2, 2, 2], self._refcount_nlinks())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
+import errno
 import io
 import json
 import os
 import tempfile
 import unittest
 import unittest.mock
+import uuid
 
 from .. import subvolume_on_disk
 
@@ -182,9 +184,65 @@ class SubvolumeOnDiskTestCase(unittest.TestCase):
 class BtrfsVolumePropsTestCase(unittest.TestCase):
     'Separate from SubvolumeOnDiskTestCase because to avoid its mocks.'
 
+    def _mock_ioctl(self, flags, btrfs_uuid, parent_uuid):
+        def ioctl(fd, request, buf):
+            self.assertEqual(
+                subvolume_on_disk._BTRFS_IOC_GET_SUBVOL_INFO, request,
+            )
+            self.assertEqual(subvolume_on_disk._SUBVOL_INFO_SIZE, len(buf))
+            subvolume_on_disk._SUBVOL_INFO_PREFIX.pack_into(
+                buf, 0, 277, b'parent', 5, 256, 123, flags,
+                uuid.UUID(btrfs_uuid).bytes,
+                uuid.UUID(parent_uuid).bytes if parent_uuid else bytes(16),
+            )
+            return 0
+        return unittest.mock.patch('fcntl.ioctl', side_effect=ioctl)
+
+    @unittest.mock.patch('subprocess.check_output')
+    def test_ioctl_get_volume_props(self, check_output):
+        with tempfile.TemporaryDirectory() as td, unittest.mock.patch.object(
+            # Make `td` look like the root of a subvolume.
+            subvolume_on_disk, '_BTRFS_FIRST_FREE_OBJECTID',
+            os.stat(td).st_ino,
+        ):
+            with self._mock_ioctl(
+                1, 'f96b940f-10d3-fc4e-8b2d-9362af0ee8df', None,
+            ):
+                self.assertEqual({
+                    'UUID': 'f96b940f-10d3-fc4e-8b2d-9362af0ee8df',
+                    'Parent UUID': '-',
+                    'Flags': 'readonly',
+                }, subvolume_on_disk._btrfs_get_volume_props(td))
+            with self._mock_ioctl(
+                0, 'a1a3eb3e-eb89-7743-8335-9cd5219248e7',
+                'f96b940f-10d3-fc4e-8b2d-9362af0ee8df',
+            ):
+                self.assertEqual({
+                    'UUID': 'a1a3eb3e-eb89-7743-8335-9cd5219248e7',
+                    'Parent UUID': 'f96b940f-10d3-fc4e-8b2d-9362af0ee8df',
+                    'Flags': '-',
+                }, subvolume_on_disk._btrfs_get_volume_props(td))
+        check_output.assert_not_called()
+
+    @unittest.mock.patch('subprocess.check_output')
+    def test_ioctl_get_volume_props_not_subvolume(self, check_output):
+        with tempfile.TemporaryDirectory() as td, self._mock_ioctl(
+            0, 'f96b940f-10d3-fc4e-8b2d-9362af0ee8df', None,
+        ):
+            # A plain directory gets the UUID of its enclosing subvolume
+            # from the ioctl, which must not be trusted.
+            self.assertNotEqual(
+                subvolume_on_disk._BTRFS_FIRST_FREE_OBJECTID,
+                os.stat(td).st_ino,
+            )
+            with self.assertRaisesRegex(RuntimeError, 'not a btrfs subvol'):
+                subvolume_on_disk._btrfs_get_volume_props(td)
+        check_output.assert_not_called()
+
     @unittest.mock.patch('subprocess.check_output')
     def test_btrfs_get_volume_props(self, check_output):
         parent = '/subvols/dir/parent'
+        # Thousands of snapshots must not make the parse any slower.
         check_output.return_value = b'''\
 dir/parent
 \tName: \t\t\tparent
@@ -199,31 +257,35 @@ dir/parent
 \tTop level ID: \t\t5
 \tFlags: \t\t\treadonly
 \tSnapshot(s):
-\t\t\t\tdir/foo
-\t\t\t\tdir/bar
-'''
-        self.assertEquals(
-            subvolume_on_disk._btrfs_get_volume_props(parent),
-            {
-                'Name': 'parent',
-                'UUID': 'f96b940f-10d3-fc4e-8b2d-9362af0ee8df',
-                'Parent UUID': '-',
-                'Received UUID': '-',
-                'Creation time': '2017-12-29 21:55:54 -0800',
-                'Subvolume ID': '277',
-                'Generation': '123',
-                'Gen at creation': '103',
-                'Parent ID': '5',
-                'Top level ID': '5',
-                'Flags': 'readonly',
-                'Snapshot(s)': ['dir/foo', 'dir/bar'],
-            }
-        )
+''' + b''.join(b'\t\t\t\tdir/foo%d\n' % i for i in range(5000))
+        # The ioctl is unavailable, e.g. on old kernels.
+        with unittest.mock.patch(
+            'fcntl.ioctl', side_effect=OSError(errno.ENOTTY, 'ENOTTY'),
+        ), tempfile.TemporaryDirectory() as td:
+            parent = os.path.join(td, 'parent')
+            os.mkdir(parent)
+            self.assertEquals(
+                subvolume_on_disk._btrfs_get_volume_props(parent),
+                {
+                    'Name': 'parent',
+                    'UUID': 'f96b940f-10d3-fc4e-8b2d-9362af0ee8df',
+                    'Parent UUID': '-',
+                    'Received UUID': '-',
+                    'Creation time': '2017-12-29 21:55:54 -0800',
+                    'Subvolume ID': '277',
+                    'Generation': '123',
+                    'Gen at creation': '103',
+                    'Parent ID': '5',
+                    'Top level ID': '5',
+                    'Flags': 'readonly',
+                }
+            )
         check_output.assert_called_once_with(
             ['sudo', 'btrfs', 'subvolume', 'show', parent]
         )
 
         # Unlike the parent, this has no snapshots, so the format differs.
+        # Since our user cannot open a missing directory, we need `sudo`.
         child = '/subvols/dir/child'
         check_output.reset_mock()
         check_output.return_value = b'''\
@@ -255,7 +317,6 @@ dir/child
                 'Parent ID': '5',
                 'Top level ID': '5',
                 'Flags': '-',
-                'Snapshot(s)': [],
             }
         )
         check_output.assert_called_once_with(
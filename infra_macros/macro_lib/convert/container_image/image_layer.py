@@ -136,6 +136,10 @@ class ImageLayerConverter(base.Converter):
         # Path to a target outputting a btrfs send-stream of a subvolume;
         # mutually exclusive with using any of the image_feature fields.
         from_sendstream=None,
+        # Opt-in: cache snapshots of the partially built layer, so that
+        # rebuilds can resume from the longest unchanged prefix of the
+        # build.  See `compiler/snapshot_cache.py`.
+        incremental_build=False,
         **image_feature_kwargs
     ):
         # There are two independent ways to actually populate the resulting
@@ -148,6 +152,10 @@ class ImageLayerConverter(base.Converter):
                 'cannot use `from_sendstream` with `image_feature` args or '
                 'with `yum_from_repo_snapshot`'
             )
+        elif from_sendstream is not None and incremental_build:
+            raise ValueError(
+                'cannot use `incremental_build` with `from_sendstream`'
+            )
         elif image_feature_kwargs:
             rules, make_subvol_cmd = self._compile_image_features(
                 base_path=base_path,
@@ -155,6 +163,7 @@ class ImageLayerConverter(base.Converter):
                 parent_layer=parent_layer,
                 image_feature_kwargs=image_feature_kwargs,
                 yum_from_repo_snapshot=yum_from_repo_snapshot,
+                incremental_build=incremental_build,
             )
         else:
             if parent_layer is not None:
@@ -187,6 +196,12 @@ class ImageLayerConverter(base.Converter):
                     helper_base=image_utils.HELPER_BASE,
                 )
 
+        # Off by default: the detached process outlives the build, so its
+        # deletions still compete for disk I/O with whatever runs next.
+        delete_in_background = self.read_bool(
+            'container_image', 'delete_subvolumes_in_background', False,
+        )
+
         rules.append(Rule('genrule', collections.OrderedDict(
             name=name,
             out=name + '.json',
@@ -224,10 +239,15 @@ class ImageLayerConverter(base.Converter):
                 # refcount file before starting the build to guarantee that we
                 # have refcount files for partially built images -- this makes
                 # debugging failed builds a bit more predictable.
+                #
+                # With `container_image.delete_subvolumes_in_background`,
+                # dead subvolumes are deleted by a detached process, so this
+                # build only waits for the GC to list them.
                 refcounts_dir=\\$( readlink -f {refcounts_dir_quoted} )
                 $(location {helper_base}:subvolume-garbage-collector) \
                   --refcounts-dir "$refcounts_dir" \
                   --subvolumes-dir "$subvolumes_dir" \
+                  {delete_in_background} \
                   --new-subvolume-wrapper-dir "$subvolume_wrapper_dir" \
                   --new-subvolume-json "$OUT"
 
@@ -241,6 +261,10 @@ class ImageLayerConverter(base.Converter):
                         'buck-out/.volume-refcount-hardlinks/',
                     ),
                     make_subvol_cmd=make_subvol_cmd,
+                    delete_in_background=(
+                        '--delete-in-background' if delete_in_background
+                        else ''
+                    ),
                 ),
                 volume_min_free_bytes=int(layer_size_bytes),
                 log_description="{}(name={})".format(
@@ -259,6 +283,7 @@ class ImageLayerConverter(base.Converter):
         parent_layer,
         image_feature_kwargs,
         yum_from_repo_snapshot,
+        incremental_build,
     ):
         # For ease of use, a layer takes all the arguments of a feature, so
         # just make an implicit feature target to implement this.
@@ -297,6 +322,7 @@ class ImageLayerConverter(base.Converter):
                 "$subvolume_wrapper_dir/"{rule_name_quoted} \
               --parent-layer-json {parent_layer_json_quoted} \
               {maybe_quoted_yum_from_repo_snapshot_args} \
+              {maybe_incremental_build_args} \
               --child-layer-target {current_target_quoted} \
               --child-feature-json $(location {my_feature_target}) \
               --child-dependencies \
@@ -319,4 +345,13 @@ class ImageLayerConverter(base.Converter):
                         '--yum-from-repo-snapshot $(location {})'.format(
                             quote(yum_from_repo_snapshot),
                         ),
+                # The snapshot index hardlinks into `$refcounts_dir`, so it
+                # must also live in `buck-out`.
+                maybe_incremental_build_args='' if not incremental_build else
+                    '--refcounts-dir "$refcounts_dir" '
+                    '--incremental-cache-dir {}'.format(os.path.join(
+                        '$GEN_DIR',
+                        quote(self.get_fbcode_dir_from_gen_dir()),
+                        'buck-out/.image-layer-snapshot-cache/',
+                    )),
             )
@@ -8,6 +8,13 @@ from typing import Union
 # Nibble on unicode strings with the intent of treating them as bytes.
 Bytey = Union[str, bytes]
 
+# Commands that compress stdin to stdout, keyed by the conventional file
+# extension of their output.
+SENDSTREAM_COMPRESSORS = {
+    'zst': ['zstd', '--quiet', '--stdout'],
+    'xz': ['xz', '--stdout', '--threads=0'],
+}
+
 
 # Bite me, Python3
 def byteme(s: Bytey) -> bytes:
@@ -185,4 +192,31 @@ class Subvol:
             stdout=subprocess.PIPE, **kwargs,
         ).stdout
 
-    # Future: write_sendstream_to_file()
+    def mark_readonly_and_write_sendstream_to_file(
+        self, outfile, *, compression: str=None, **kwargs,
+    ):
+        '''
+        Unlike `mark_readonly_and_get_sendstream`, this streams the output
+        of `btrfs send` into `outfile` (a file or a pipe), so the memory
+        use does not depend on the size of the subvolume.  `compression`
+        is a key of `SENDSTREAM_COMPRESSORS`, the compressor runs
+        unprivileged.
+        '''
+        if compression is None:
+            self._mark_readonly_and_send(stdout=outfile, **kwargs)
+            return
+        with subprocess.Popen(
+            SENDSTREAM_COMPRESSORS[compression],
+            stdin=subprocess.PIPE, stdout=outfile,
+        ) as compressor:
+            try:
+                self._mark_readonly_and_send(
+                    stdout=compressor.stdin, **kwargs,
+                )
+            finally:
+                # Otherwise, the compressor would never see EOF.
+                compressor.stdin.close()
+        if compressor.returncode != 0:
+            raise subprocess.CalledProcessError(
+                compressor.returncode, compressor.args,
+            )
@@ -94,7 +94,73 @@ def list_refcounts(refcounts_dir):
         yield (f'{m.group(1)}:{m.group(2)}', st.st_nlink)
 
 
-def garbage_collect_subvolumes(refcounts_dir, subvolumes_dir):
+# Keeps each `btrfs subvolume delete` command line well under `ARG_MAX`.
+_DELETE_BATCH_SIZE = 100
+
+
+def delete_subvolumes(subvolumes_dir, subvol_wrapper_to_subvol):
+    '''
+    Deletes `{wrapper: subvol or None}` with as few `sudo btrfs` calls as
+    possible, then removes the now-empty wrappers.
+    '''
+    wrappers = sorted(subvol_wrapper_to_subvol.keys())
+    subvol_paths = [
+        os.path.join(
+            subvolumes_dir,
+            # Subvols are wrapped in a user-owned temporary directory,
+            # following the convention `{rule name}:{version}/{subvol}`.
+            wrapper,
+            subvol_wrapper_to_subvol[wrapper],
+        ) for wrapper in wrappers
+            if subvol_wrapper_to_subvol[wrapper] is not None
+    ]
+    # NB: We do not pass `--commit-after`, so `btrfs` does not wait for the
+    # transaction commit, and the space is reclaimed asynchronously.  If
+    # this fails part-way, some wrappers will be left empty (or, with their
+    # refcounts already unlinked), and the next GC pass will finish the job.
+    for i in range(0, len(subvol_paths), _DELETE_BATCH_SIZE):
+        subprocess.check_call([
+            'sudo', 'btrfs', 'subvolume', 'delete',
+            *subvol_paths[i:i + _DELETE_BATCH_SIZE],
+        ])
+    for wrapper in wrappers:
+        os.rmdir(os.path.join(subvolumes_dir, wrapper))
+
+
+def _run_detached(fn):
+    '''
+    Runs `fn` in a daemonized grandchild process, and returns immediately.
+    The grandchild inherits our FDs, including the `nonblocking_flock` on
+    the subvolumes directory, so no other GC pass can start until it exits.
+    '''
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover -- coverage does not follow forks
+        status = 1
+        try:
+            os.setsid()  # Survive the build's process group being killed.
+            if os.fork() == 0:
+                # Buck waits for the stdout & stderr of the build step to
+                # close, so the reaper must not keep them open.
+                devnull = os.open(os.devnull, os.O_RDWR)
+                for fd in range(3):
+                    os.dup2(devnull, fd)
+                fn()
+            status = 0
+        finally:
+            os._exit(status)
+    # Reap the intermediate child, which exits as soon as it has forked.
+    _, status = os.waitpid(pid, 0)
+    if status != 0:
+        raise RuntimeError(f'Failed to start the GC reaper: {status}')
+
+
+def garbage_collect_subvolumes(refcounts_dir, subvolumes_dir, *, detach=False):
+    '''
+    With `detach`, only the listing happens in the current process, while
+    the deletions happen in a detached reaper process -- see
+    `_run_detached`.  The caller must hold `nonblocking_flock` on
+    `subvolumes_dir`, since the reaper inherits it.
+    '''
     # IMPORTANT: We must list subvolumes BEFORE refcounts. The risk is that
     # this runs concurrently with another build, which will create a new
     # refcount & subvolume (in that order).  If we read refcounts first, we
@@ -106,6 +172,7 @@ def garbage_collect_subvolumes(refcounts_dir, subvolumes_dir):
     subvol_wrapper_to_nlink = dict(list_refcounts(refcounts_dir))
 
     # Delete subvolumes (& their wrappers) with insufficient refcounts.
+    subvol_wrapper_to_subvol = {}
     for subvol_wrapper in subvol_wrappers:
         nlink = subvol_wrapper_to_nlink.get(subvol_wrapper, 0)
         if nlink >= 2:
@@ -139,18 +206,18 @@ def garbage_collect_subvolumes(refcounts_dir, subvolumes_dir):
         wrapper_content = os.listdir(wrapper_path)
         if len(wrapper_content) > 1:
             raise RuntimeError(f'{wrapper_path} must contain only the subvol')
-        if len(wrapper_content) == 1:  # Empty wrappers are OK to GC, too.
-            subprocess.check_call([
-                'sudo', 'btrfs', 'subvolume', 'delete',
-                os.path.join(
-                    subvolumes_dir,
-                    # Subvols are wrapped in a user-owned temporary directory,
-                    # following the convention `{rule name}:{version}/{subvol}`.
-                    subvol_wrapper,
-                    wrapper_content[0],
-                ),
-            ])
-        os.rmdir(wrapper_path)
+        # Empty wrappers are OK to GC, too.
+        subvol_wrapper_to_subvol[subvol_wrapper] = \
+            wrapper_content[0] if wrapper_content else None
+
+    if not subvol_wrapper_to_subvol:
+        return
+    if detach:
+        _run_detached(
+            lambda: delete_subvolumes(subvolumes_dir, subvol_wrapper_to_subvol)
+        )
+    else:
+        delete_subvolumes(subvolumes_dir, subvol_wrapper_to_subvol)
 
 
 def parse_args(argv):
@@ -181,6 +248,12 @@ def parse_args(argv):
             'and hard-link into `--refcounts-dir` for refcounting purposes. '
             'The image compiler will then write data into this file.',
     )
+    parser.add_argument(
+        '--delete-in-background', action='store_true',
+        help='Only find the dead subvolumes, and leave their deletion to a '
+            'detached process, which holds the GC lock until it is done. '
+            'Makes the build that triggered the GC pass start sooner.',
+    )
     return parser.parse_args(argv)
 
 
@@ -234,7 +307,9 @@ def subvolume_garbage_collector(argv):
        anyhow.  (The fix is easy if it turns out to be a problem.)
 
        Failing during (b) is also fine. Presumably, `btrfs subvolume delete`
-       is atomic, so at worst we will not delete ALL the garbage.
+       is atomic, so at worst we will not delete ALL the garbage.  With
+       `--delete-in-background`, (b) happens in a detached process, whose
+       failures cannot affect the build.
 
        Failure before (c), or in the middle of (c) will abort the build, so
        the lack of a refcount link won't cause issues later.
@@ -254,11 +329,13 @@ def subvolume_garbage_collector(argv):
     # substantiate this, so this is just informed demagoguery ;)
     #
     # Future: if disk usage is a problem, we can loop this code until no
-    # deletions are made.  For bonus points, daemonize the loop so that
-    # the build that triggered the GC actually gets to make progress.
+    # deletions are made.
     with nonblocking_flock(args.subvolumes_dir) as got_lock:
         if got_lock:
-            garbage_collect_subvolumes(args.refcounts_dir, args.subvolumes_dir)
+            garbage_collect_subvolumes(
+                args.refcounts_dir, args.subvolumes_dir,
+                detach=args.delete_in_background,
+            )
         else:
             # That other build probably won't clean up the prior version of
             # the subvolume we are creating, but we don't rely on that to
@@ -14,9 +14,15 @@ die() {
   exit 1
 }
 
-[[ "$#" == "4" ]] || die "Bad arg count:" "$@"
+[[ "$#" -ge "4" ]] || die "Bad arg count:" "$@"
 [[ "$1" == "btrfs" ]] || die "Bad arg 1: $1"
 [[ "$2" == "subvolume" ]] || die "Bad arg 2: $2"
 [[ "$3" == "delete" ]] || die "Bad arg 3: $3"
 
-rmdir "$4"
+# Lets tests count how many times we were called.
+if [[ -n "${FAKE_SUDO_LOG:-}" ]] ; then
+  echo "$*" >> "$FAKE_SUDO_LOG"
+fi
+
+shift 3
+rmdir "$@"
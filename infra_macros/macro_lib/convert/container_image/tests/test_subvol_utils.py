@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
 import os
+import subprocess
 import sys
 import tempfile
 import unittest
+import unittest.mock
+
+import subvol_utils
 
 from subvol_utils import Subvol
 
@@ -57,3 +61,28 @@ class SubvolTestCase(unittest.TestCase):
         sv = self.temp_subvols.create('subvol')
         sv.run_as_root(['touch', sv.path('abracadabra')])
         self.assertIn(b'abracadabra', sv.mark_readonly_and_get_sendstream())
+
+    def test_mark_readonly_and_write_sendstream_to_file(self):
+        sv = self.temp_subvols.create('subvol')
+        sv.run_as_root(['touch', sv.path('abracadabra')])
+        sendstream = sv.mark_readonly_and_get_sendstream()
+        for compression, decompress in [
+            (None, ['cat']), ('zst', ['zstd', '-dc']), ('xz', ['xz', '-dc']),
+        ]:
+            with tempfile.TemporaryFile() as outfile:
+                sv.mark_readonly_and_write_sendstream_to_file(
+                    outfile, compression=compression,
+                )
+                outfile.seek(0)
+                self.assertEqual(sendstream, subprocess.run(
+                    decompress, stdin=outfile, stdout=subprocess.PIPE,
+                    check=True,
+                ).stdout)
+
+        with tempfile.TemporaryFile() as outfile, \
+                unittest.mock.patch.dict(subvol_utils.SENDSTREAM_COMPRESSORS, {
+                    'zst': ['false'],
+                }), self.assertRaises(subprocess.CalledProcessError):
+            sv.mark_readonly_and_write_sendstream_to_file(
+                outfile, compression='zst',
+            )
@@ -3,6 +3,7 @@ import fcntl
 import contextlib
 import os
 import unittest
+import unittest.mock
 import tempfile
 import subvolume_garbage_collector as sgc
 import subprocess
@@ -215,6 +216,68 @@ class SubvolumeGarbageCollectorTestCase(unittest.TestCase):
                 self.assertEqual(n.kept_refs, set(os.listdir(n.refs_dir)))
                 self.assertEqual(n.kept_subs, set(os.listdir(n.subs_dir)))
 
+    def test_delete_subvolumes_in_batches(self):
+        with self._gc_test_case() as n, \
+                tempfile.TemporaryDirectory() as log_dir, \
+                unittest.mock.patch.object(sgc, '_DELETE_BATCH_SIZE', 1), \
+                unittest.mock.patch.dict(os.environ, {
+                    'FAKE_SUDO_LOG': os.path.join(log_dir, 'log'),
+                }):
+            for i in range(3):
+                os.makedirs(os.path.join(n.subs_dir, f'many:{i}/many'))
+            self._gc_only(n)
+            self.assertEqual(n.kept_subs, set(os.listdir(n.subs_dir)))
+            with open(os.path.join(log_dir, 'log')) as log:
+                # The empty wrapper `no_refs:nor_subvol` needs no `btrfs`.
+                self.assertEqual(5, len(log.readlines()))
+
+        with self._gc_test_case() as n, \
+                tempfile.TemporaryDirectory() as log_dir, \
+                unittest.mock.patch.dict(os.environ, {
+                    'FAKE_SUDO_LOG': os.path.join(log_dir, 'log'),
+                }):
+            self._gc_only(n)
+            self.assertEqual(n.kept_subs, set(os.listdir(n.subs_dir)))
+            with open(os.path.join(log_dir, 'log')) as log:
+                self.assertEqual(
+                    ['btrfs subvolume delete ' + ' '.join(
+                        os.path.join(n.subs_dir, p)
+                            for p in ['1:link/1', 'no:refs/subvol_name']
+                    )],
+                    log.read().splitlines(),
+                )
+
+    def test_delete_in_background(self):
+        with self._gc_test_case() as n:
+            sgc.subvolume_garbage_collector([
+                '--refcounts-dir', n.refs_dir,
+                '--subvolumes-dir', n.subs_dir,
+                '--delete-in-background',
+            ])
+            # The refcounts are unlinked before the reaper starts.
+            self.assertEqual(n.kept_refs, set(os.listdir(n.refs_dir)))
+            # The reaper holds the lock until it is done.
+            fd = os.open(n.subs_dir, os.O_RDONLY)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            finally:
+                os.close(fd)
+            self.assertEqual(n.kept_subs, set(os.listdir(n.subs_dir)))
+
+        # Nothing to delete, so no reaper is started.
+        with tempfile.TemporaryDirectory() as td, \
+                unittest.mock.patch('os.fork') as fork:
+            sgc.garbage_collect_subvolumes(td, td, detach=True)
+            fork.assert_not_called()
+
+        with unittest.mock.patch('os.fork') as fork, \
+                unittest.mock.patch('os.waitpid') as waitpid:
+            fork.return_value = 123
+            waitpid.return_value = (123, 256)
+            with self.assertRaisesRegex(RuntimeError, 'start the GC reaper'):
+                sgc._run_detached(lambda: None)
+            waitpid.assert_called_once_with(123, 0)
+
     def test_no_gc_due_to_lock(self):
         with self._gc_test_case() as n:
             fd = os.open(n.subs_dir, os.O_RDONLY)
@@ -69,6 +69,44 @@ YACC_FLAGS = ['-y', '-d']
 # from third-party.
 SYS_INC = re.compile('^(?:-I|-isystem)?/usr(?:/local)?/include')
 
+# CUDA is not supported on platform008, so these flags are dropped from its
+# rules.
+PLATFORM008_BANNED_FLAGS = frozenset([
+    "-DUSE_CUDNN=1",
+    "-DUSE_CUDNN",
+    "-DCAFFE2_USE_CUDNN",
+    "-DUSE_CUDA",
+    "-DUSE_CUDA_FUSER_FBCODE=1",
+])
+
+# Targets that we keep on platform008 (for headers, flags etc), but whose
+# sources are dropped wholesale.
+PLATFORM008_BANNED_CUDA_TARGETS = frozenset([
+    "caffe2/aten:ATen-cu",
+    "caffe2/caffe2:caffe2_cu",
+    "caffe2/caffe2:caffe2_gpu",
+    "caffe2/torch/lib/c10d:c10d",
+    "caffe2/torch/lib/THD:THD",
+    "gloo:gloo-cuda",
+])
+
+# A more granular blacklist of the sources dropped on platform008, matched
+# against `<base_path>/<src>`.
+PLATFORM008_BANNED_CUDA_SRCS = re.compile('|'.join(
+    '(?:{})'.format(pattern) for pattern in [
+        "caffe2/caffe2/.*cudnn.cc",
+        "caffe2/caffe2/.*gpu.cc",
+        "caffe2/caffe2/contrib/nervana/.*gpu.cc",
+        "caffe2/caffe2/operators/.*cudnn.cc",
+        "caffe2/caffe2/fb/operators/scale_gradient_op_gpu.cc",
+        "caffe2/caffe2/fb/predictor/PooledPredictor.cpp",
+        "caffe2/caffe2/fb/predictor/PredictorGPU.cpp",
+        "caffe2/:generate-code=THCUNN.cpp",
+        "caffe2/torch/csrc/jit/fusers/cuda/.*.cpp",
+        "caffe2/torch/csrc/cuda/.*.cpp",
+        "caffe2/torch/csrc/distributed/c10d/ddp.cpp",
+    ]))
+
 def _cuda_compiler_specific_flags_partial(compiler_specific_flags, cuda, _, compiler):
     return compiler_specific_flags.get("gcc" if cuda else compiler)
 
@@ -325,6 +363,57 @@ class AbsentParameter(object):
 ABSENT = AbsentParameter()
 
 
+# The extensions of all `cxx_sources.HEADER_SUFFIXES`, which the header index
+# globs for.
+HEADER_INDEX_EXTS = tuple(sorted(set(
+    os.path.splitext(suffix)[1] for suffix in cxx_sources.HEADER_SUFFIXES)))
+
+
+class HeaderIndex(object):
+    """
+    The headers in each directory of the build file being parsed, globbed
+    once per directory, so that each rule's auto-headers lookup is answered
+    from memory rather than with its own glob.
+
+    Globbing whole directories registers a superset of the per-rule globs
+    with Buck, so adding or removing a matching header still invalidates
+    the build file.  The index is emptied whenever a build file starts being
+    evaluated, even one that was parsed before, so that every evaluation
+    globs again, sees the current headers and registers its globs.
+    """
+
+    def __init__(self):
+        self._build_file = None
+        self._dirs = {}
+
+    def start_build_file(self, build_file):
+        """
+        Forget the headers of any other build file evaluation.  The
+        `build_file` token, e.g. the globals of the build file, must be a new
+        object for every evaluation.
+        """
+
+        if build_file is not self._build_file:
+            self._build_file = build_file
+            self._dirs = {}
+
+    def get_headers(self, glob, dirname):
+        """
+        Return the set of headers, relative to the build file, in `dirname`.
+        """
+
+        headers = self._dirs.get(dirname)
+        if headers is None:
+            prefix = dirname + '/' if dirname else ''
+            headers = frozenset(
+                glob([prefix + '*' + ext for ext in HEADER_INDEX_EXTS]))
+            self._dirs[dirname] = headers
+        return headers
+
+
+HEADER_INDEX = HeaderIndex()
+
+
 class CppConverter(base.Converter):
 
     C_SOURCE_EXTS = (
@@ -446,17 +535,20 @@ class CppConverter(base.Converter):
 
         glob = self._context.buck_ops.glob
         source_exts = self.SOURCE_EXTS  # use a local for faster lookups in a loop
-        # Check for // in case this src is a rule
-        split_srcs = (
-            os.path.splitext(src)
-            for src in srcs
-            if '//' not in src and not src.startswith(':'))
-
-        headers = glob([
-            base + hext
-            for base, ext in split_srcs if ext in source_exts
-            for hext in cxx_sources.HEADER_SUFFIXES])
-        return headers
+        headers = set()
+        for src in srcs:
+            # Check for // in case this src is a rule
+            if '//' in src or src.startswith(':'):
+                continue
+            base, ext = os.path.splitext(src)
+            if ext not in source_exts:
+                continue
+            dir_headers = HEADER_INDEX.get_headers(
+                glob, os.path.dirname(base))
+            for hext in cxx_sources.HEADER_SUFFIXES:
+                if base + hext in dir_headers:
+                    headers.add(base + hext)
+        return sorted(headers)
 
     def get_dlopen_info(self, dlopen_enabled):
         """
@@ -942,14 +1034,7 @@ class CppConverter(base.Converter):
             cuda = False
 
             def filter_flags(flags):
-                banned_flags = [
-                    "-DUSE_CUDNN=1",
-                    "-DUSE_CUDNN",
-                    "-DCAFFE2_USE_CUDNN",
-                    "-DUSE_CUDA",
-                    "-DUSE_CUDA_FUSER_FBCODE=1",
-                ]
-                return [f for f in flags if f not in banned_flags]
+                return [f for f in flags if f not in PLATFORM008_BANNED_FLAGS]
 
             def filter_flags_dict(flags_dict):
                 if flags_dict is None:
@@ -966,37 +1051,13 @@ class CppConverter(base.Converter):
             arch_compiler_flags = filter_flags_dict(arch_compiler_flags)
             arch_preprocessor_flags = filter_flags_dict(arch_preprocessor_flags)
 
-            # These targets we keep (for headers, flags etc), but drop all their cpp files wholesale.
-            banned_cuda_targets = {
-                "caffe2/aten:ATen-cu",
-                "caffe2/caffe2:caffe2_cu",
-                "caffe2/caffe2:caffe2_gpu",
-                "caffe2/torch/lib/c10d:c10d",
-                "caffe2/torch/lib/THD:THD",
-                "gloo:gloo-cuda",
-            }
-            if "{}:{}".format(base_path, name) in banned_cuda_targets:
+            if "{}:{}".format(base_path, name) in PLATFORM008_BANNED_CUDA_TARGETS:
                 print('Warning: no CUDA on platform007: rule {}:{} ignoring all srcs: {}'
                       .format(base_path, name, srcs))
                 srcs = []
 
-            # More granular cpp blacklist.
-            banned_cuda_srcs_re = [re.compile(pattern) for pattern in [
-                "caffe2/caffe2/.*cudnn.cc",
-                "caffe2/caffe2/.*gpu.cc",
-                "caffe2/caffe2/contrib/nervana/.*gpu.cc",
-                "caffe2/caffe2/operators/.*cudnn.cc",
-                "caffe2/caffe2/fb/operators/scale_gradient_op_gpu.cc",
-                "caffe2/caffe2/fb/predictor/PooledPredictor.cpp",
-                "caffe2/caffe2/fb/predictor/PredictorGPU.cpp",
-                "caffe2/:generate-code=THCUNN.cpp",
-                "caffe2/torch/csrc/jit/fusers/cuda/.*.cpp",
-                "caffe2/torch/csrc/cuda/.*.cpp",
-                "caffe2/torch/csrc/distributed/c10d/ddp.cpp"
-            ]]
-
             def is_banned_src(src):
-                return any(r.match(src) for r in banned_cuda_srcs_re)
+                return PLATFORM008_BANNED_CUDA_SRCS.match(src) is not None
 
             cuda_srcs = [s for s in srcs if self.is_cuda_src(s) or is_banned_src(base_path + '/' + s)]
             srcs = [s for s in srcs if s not in cuda_srcs]
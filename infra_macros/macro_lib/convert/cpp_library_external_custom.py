@@ -22,6 +22,14 @@ include_defs("{}/rule.py".format(macro_root))
 load("@fbcode_macros//build_defs:src_and_dep_helpers.bzl", "src_and_dep_helpers")
 load("@fbcode_macros//build_defs:target_utils.bzl", "target_utils")
 
+
+# Match name-only library references.
+LIB_RE = re.compile('^\\{LIB_(.*)\\}$')
+
+# Match full path library references.
+REL_LIB_RE = re.compile('^-l\\{lib_(.*)\\}$')
+
+
 def first(*args):
     for arg in args:
         if arg is not None:
@@ -50,18 +58,12 @@ class CppLibraryExternalCustomConverter(base.Converter):
 
         out = []
 
-        # Match name-only library references.
-        lib_re = re.compile('^\\{LIB_(.*)\\}$')
-
-        # Match full path library references.
-        rel_lib_re = re.compile('^-l\\{lib_(.*)\\}$')
-
         # Iterate over args, translating them to their buck equivalents.
         i = 0
         while i < len(args):
 
             # Translate `{LIB_<name>}` references to buck-style macros.
-            m = lib_re.search(args[i])
+            m = LIB_RE.search(args[i])
             if m is not None:
                 out.append(
                     '$(lib {})'.format(
@@ -72,7 +74,7 @@ class CppLibraryExternalCustomConverter(base.Converter):
             # Translate `-L{dir} -l{lib_<name>}` references to buck-style
             # macros.
             if shared and args[i] == '-L{dir}' and i < len(args) - 1:
-                m = rel_lib_re.match(args[i + 1])
+                m = REL_LIB_RE.match(args[i + 1])
                 if m is not None:
                     out.append(
                         '$(rel-lib {})'.format(
@@ -425,11 +425,11 @@ class Converter(base.Converter):
         pxd_headers, headers = split_matching_extensions(
             headers, self.HEADER_EXTS)
 
-        deps = [src_and_dep_helpers.convert_build_target(base_path, d) for d in deps]
+        deps = [base.convert_build_target(base_path, d) for d in deps]
         external_deps = [src_and_dep_helpers.convert_external_build_target(e)
                          for e in external_deps]
 
-        python_deps = [src_and_dep_helpers.convert_build_target(base_path, d) for d in python_deps]
+        python_deps = [base.convert_build_target(base_path, d) for d in python_deps]
 
         # This is normally base_path if package is not set
         if package is None:
@@ -82,7 +82,7 @@ class DConverter(base.Converter):
         dependencies = []
         for target in deps:
             dependencies.append(
-                src_and_dep_helpers.convert_build_target(
+                base.convert_build_target(
                     base_path,
                     target,
                     platform=platform))
@@ -214,7 +214,7 @@ class LuaConverter(base.Converter):
         attrs['srcs'] = [':' + source_name]
         attrs['base_module'] = ''
         attrs['deps'] = [
-            src_and_dep_helpers.convert_build_target(base_path, '//fblualib/trepl:base'),
+            base.convert_build_target(base_path, '//fblualib/trepl:base'),
         ]
         rules.append(Rule('lua_library', attrs))
 
@@ -64,12 +64,15 @@ import sys
 class Manifest(object):
 
     def __init__(self):
-        self._modules = None
+        # The modules of the binary's own sources, listed when it was built,
+        # or None if their names are only known once the package is built.
+        self._modules = {modules}
         self.__file__ = __file__
         self.__name__ = __name__
 
     @property
     def modules(self):
+        # Fall back to finding the modules in the package at runtime.
         if self._modules is None:
             import os, sys
             modules = set()
@@ -428,9 +431,9 @@ class PythonConverter(base.Converter):
         if '=' not in target:
             return (
                 ratio,
-                src_and_dep_helpers.convert_build_target(base_path, target))
+                base.convert_build_target(base_path, target))
         target, path = target.rsplit('=', 1)
-        return (ratio, src_and_dep_helpers.convert_build_target(base_path, target), path)
+        return (ratio, base.convert_build_target(base_path, target), path)
 
     def get_python_build_info(
             self,
@@ -471,6 +474,27 @@ class PythonConverter(base.Converter):
 
         return py_build_info
 
+    def get_build_modules(self, base_path, library):
+        """
+        Return the sorted names of the modules in the given library's
+        sources, which `__manifest__.modules` lists, or `None` if they can't
+        be known before the build.
+        """
+
+        if library is None or library.attributes.get('versioned_srcs'):
+            return None
+
+        base_module = library.attributes.get('base_module') or base_path
+        srcs = set(library.attributes.get('srcs') or ())
+        # Third-party sources have the same names on every platform.
+        for _, platform_srcs in library.attributes.get('platform_srcs') or ():
+            srcs.update(platform_srcs)
+        return sorted(
+            set(
+                self.file_to_python_module(src, base_module)
+                for src in srcs
+                if os.path.splitext(src)[1] in ('.py', '.so')))
+
     def generate_manifest(
             self,
             base_path,
@@ -478,7 +502,8 @@ class PythonConverter(base.Converter):
             main_module,
             platform,
             python_platform,
-            visibility):
+            visibility,
+            library=None):
         """
         Build the rules that create the `__manifest__` module.
         """
@@ -493,6 +518,7 @@ class PythonConverter(base.Converter):
                 platform,
                 python_platform))
         manifest = MANIFEST_TEMPLATE.format(
+            modules=repr(self.get_build_modules(base_path, library)),
             fbmake='\n        '.join(
                 '{!r}: {!r},'.format(k, v) for k, v in build_info.iteritems()))
 
@@ -928,7 +954,7 @@ class PythonConverter(base.Converter):
             dependencies.append(self.get_tp2_project_dep(base_path))
         for target in deps:
             dependencies.append(
-                src_and_dep_helpers.convert_build_target(base_path, target))
+                base.convert_build_target(base_path, target))
         if cpp_deps:
             dependencies.extend(cpp_deps)
         if dependencies:
@@ -1084,7 +1110,7 @@ class PythonConverter(base.Converter):
 
         # Add user-provided preloaded deps.
         for dep in preload_deps:
-            out_preload_deps.append(src_and_dep_helpers.convert_build_target(base_path, dep))
+            out_preload_deps.append(base.convert_build_target(base_path, dep))
 
         # Add the C/C++ build info lib to preload deps.
         cxx_build_info, cxx_build_info_rules = (
@@ -1126,7 +1152,8 @@ class PythonConverter(base.Converter):
                 main_module,
                 platform,
                 python_platform,
-                visibility))
+                visibility,
+                library=library))
         rules.extend(manifest_rules)
         if self.get_package_style() == 'inplace':
             dependencies.append(':' + manifest_name)
@@ -1312,7 +1339,7 @@ class PythonConverter(base.Converter):
                 library_name,
                 base_module if base_module is not None else base_path,
                 srcs,
-                [src_and_dep_helpers.convert_build_target(base_path, dep) for dep in deps],
+                [base.convert_build_target(base_path, dep) for dep in deps],
                 typing or (check_types and not self.is_library()),
                 typing_options,
                 visibility,
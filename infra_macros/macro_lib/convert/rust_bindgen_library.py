@@ -282,7 +282,7 @@ class RustBindgenLibraryConverter(rust.RustConverter):
             base_path,
             name,
             header,
-            [src_and_dep_helpers.convert_build_target(base_path, d) for d in cpp_deps],
+            [base.convert_build_target(base_path, d) for d in cpp_deps],
             src_includes=src_includes,
             **kwargs)
 
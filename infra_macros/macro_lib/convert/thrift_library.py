@@ -142,6 +142,18 @@ class ThriftLangConverter(base.Converter):
 
         return []
 
+    def supports_multi_output_compile(self):
+        """
+        Whether the generated sources of this language can be consumed as
+        named outputs of a compile rule shared with other languages, rather
+        than via per-file extraction rules.  This requires the compiler to
+        only write under the top-level directories of its generated sources
+        (e.g. `gen-cpp2`), and `get_language_rule` not to rely on the names
+        of the extraction rules.
+        """
+
+        return False
+
     def get_postprocess_command(
             self,
             base_path,
@@ -309,6 +321,9 @@ class CppThriftConverter(ThriftLangConverter):
     def get_lang(self):
         return 'cpp2'
 
+    def supports_multi_output_compile(self):
+        return True
+
     def get_compiler_lang(self):
         return 'mstch_cpp2'
 
@@ -1393,6 +1408,9 @@ class LegacyPythonThriftConverter(ThriftLangConverter):
     def get_lang(self, prefix='py'):
         return self.get_name('py', '-')
 
+    def supports_multi_output_compile(self):
+        return True
+
     def get_compiler_lang(self):
         if self._flavor in (self.PYI, self.PYI_ASYNCIO):
             return 'mstch_pyi'
@@ -1750,6 +1768,9 @@ class Python3ThriftConverter(ThriftLangConverter):
     def get_lang(self):
         return 'py3'
 
+    def supports_multi_output_compile(self):
+        return True
+
     def get_compiler_lang(self):
         return 'mstch_py3'
 
@@ -2590,13 +2611,17 @@ class ThriftLibraryConverter(base.Converter):
         Generate a rule which runs the thrift compiler for the given inputs.
         """
 
-        attrs = collections.OrderedDict()
-        attrs['name'] = (
-            '{}-{}-{}'.format(name, lang, self.get_source_name(source)))
+        # There is one of these rules per language and source, so use plain
+        # dicts, which are much smaller than `OrderedDict`s in Python 2.  The
+        # order of attributes is lost anyway once they are passed to Buck as
+        # keyword arguments.
+        attrs = {
+            'name': '{}-{}-{}'.format(name, lang, self.get_source_name(source)),
+            'out': os.curdir,
+            'srcs': [source],
+        }
         if visibility is not None:
             attrs['visibility'] = visibility
-        attrs['out'] = os.curdir
-        attrs['srcs'] = [source]
 
         cmds = []
 
@@ -2613,6 +2638,50 @@ class ThriftLibraryConverter(base.Converter):
 
         return Rule('genrule', attrs)
 
+    @staticmethod
+    def join_commands(cmds):
+        """
+        Chain shell commands with `&&`, grouping each one and ending it with a
+        newline, so that a trailing `# $(exe ...)` comment from
+        `get_compiler_command` doesn't comment out the commands after it.
+        """
+
+        return ' && '.join('({}\n)'.format(cmd) for cmd in cmds)
+
+    def get_multi_output_compile_name(self, name, source):
+        return '{}-{}'.format(name, self.get_source_name(source))
+
+    def generate_multi_output_compile_rule(
+            self,
+            name,
+            source,
+            compiles,
+            visibility=None):
+        """
+        Generate a rule which runs the thrift compiler for several languages on
+        the given source, exposing each generated source as a named output.
+
+        `compiles` is a list of `(cmd, gen_srcs)`, where `cmd` writes the
+        `gen_srcs` of one language into `$OUT`.  The outputs keep the same
+        paths as with per-language compile rules, so that e.g. the names of
+        exported headers don't change.
+        """
+
+        attrs = {
+            'name': self.get_multi_output_compile_name(name, source),
+            'srcs': [source],
+            'outs': {
+                src: [src]
+                for _, gen_srcs in compiles
+                for src in gen_srcs.itervalues()
+            },
+            'cmd': self.join_commands(cmd for cmd, _ in compiles),
+        }
+        if visibility is not None:
+            attrs['visibility'] = visibility
+
+        return Rule('genrule', attrs)
+
     def generate_generated_source_rules(self, compile_name, srcs, visibility):
         """
         Create rules to extra individual sources out of the directory of thrift
@@ -2623,15 +2692,17 @@ class ThriftLibraryConverter(base.Converter):
         rules = []
 
         for name, src in srcs.iteritems():
-            attrs = collections.OrderedDict()
-            attrs['name'] = '{}={}'.format(compile_name, src)
+            # As for the compile rules, use plain dicts for these per-source
+            # rules.
+            attrs = {
+                'name': '{}={}'.format(compile_name, src),
+                'out': src,
+                'cmd': (
+                    'mkdir -p `dirname $OUT` && '
+                    'cp -R $(location :{})/{} $OUT'.format(compile_name, src)),
+            }
             if visibility is not None:
                 attrs['visibility'] = visibility
-            attrs['out'] = src
-            attrs['cmd'] = ' && '.join([
-                'mkdir -p `dirname $OUT`',
-                'cp -R $(location :{})/{} $OUT'.format(compile_name, src),
-            ])
             rules.append(Rule('genrule', attrs))
             out[name] = ':' + attrs['name']
 
@@ -2660,7 +2731,7 @@ class ThriftLibraryConverter(base.Converter):
         thrift_srcs = self.fixup_thrift_srcs(thrift_srcs)
         thrift_args = self.parse_thrift_args(thrift_args)
         languages = self.get_languages(languages)
-        deps = [src_and_dep_helpers.convert_build_target(base_path, d) for d in deps]
+        deps = [base.convert_build_target(base_path, d) for d in deps]
 
         # Setup the exported include tree to dependents.
         includes = set()
@@ -2701,6 +2772,15 @@ class ThriftLibraryConverter(base.Converter):
                 kwargs.get('thrift_py_asyncio_options', ())
             ))
 
+        # With `thrift.multi_output_compile_rules`, each source is compiled
+        # for all languages by a single rule, whose named outputs replace the
+        # per-language compile rules and per-file extraction rules.
+        multi_output = (
+            self.read_bool('thrift', 'multi_output_compile_rules', False))
+        multi_output_compiles = collections.OrderedDict(
+            (thrift_src, []) for thrift_src in thrift_srcs)
+        multi_output_dirs = {thrift_src: set() for thrift_src in thrift_srcs}
+
         # Generate rules for all supported languages.
         for lang in languages:
             converter = self._converters[lang]
@@ -2725,6 +2805,50 @@ class ThriftLibraryConverter(base.Converter):
             for thrift_src, services in thrift_srcs.iteritems():
                 thrift_name = self.get_source_name(thrift_src)
 
+                gen_srcs = None
+                if multi_output and converter.supports_multi_output_compile():
+                    gen_srcs = (
+                        converter.get_generated_sources(
+                            base_path,
+                            name,
+                            thrift_name,
+                            services,
+                            options,
+                            visibility=visibility,
+                            **kwargs))
+                    gen_dirs = set(
+                        src.split('/', 1)[0] for src in gen_srcs.itervalues())
+                    claimed_dirs = multi_output_dirs[thrift_src]
+                    if gen_dirs & claimed_dirs:
+                        # Another language (e.g. `py` for `pyi`) already
+                        # writes there, so compile this one on its own.
+                        gen_srcs = None
+                    else:
+                        claimed_dirs.update(gen_dirs)
+
+                if gen_srcs is not None:
+                    cmds = [
+                        converter.get_compiler_command(
+                            compiler,
+                            compiler_args,
+                            self.get_exported_include_tree(':' + name))]
+                    postprocess_cmd = (
+                        converter.get_postprocess_command(
+                            base_path,
+                            thrift_name,
+                            '$OUT',
+                            **kwargs))
+                    if postprocess_cmd is not None:
+                        cmds.append(postprocess_cmd)
+                    multi_output_compiles[thrift_src].append(
+                        (self.join_commands(cmds), gen_srcs))
+                    compile_name = (
+                        self.get_multi_output_compile_name(name, thrift_src))
+                    all_gen_srcs[thrift_name] = collections.OrderedDict(
+                        (gen_name, ':{}[{}]'.format(compile_name, src))
+                        for gen_name, src in gen_srcs.iteritems())
+                    continue
+
                 # Generate the thrift compile rules.
                 compile_rule = (
                     self.generate_compile_rule(
@@ -2785,6 +2909,16 @@ class ThriftLibraryConverter(base.Converter):
                     [dep + '-' + lang for dep in deps],
                     visibility=visibility,
                     **kwargs))
+
+        for thrift_src, compiles in multi_output_compiles.iteritems():
+            if compiles:
+                rules.append(
+                    self.generate_multi_output_compile_rule(
+                        name,
+                        thrift_src,
+                        compiles,
+                        visibility=visibility))
+
         return rules
 
     def get_allowed_args(self):
@@ -132,113 +132,205 @@ def handle_errors(errors, skip_errors=False):
         raise Exception(os.linesep.join(msg))
 
 
+# Rule type -> function that creates the converter for that rule type from a
+# `Context`.
+CONVERTER_FACTORIES = {
+    'cpp_binary_external':
+        lambda c: discard.DiscardingConverter(c, 'cpp_binary_external'),
+    'haskell_genscript':
+        lambda c: discard.DiscardingConverter(c, 'haskell_genscript'),
+    'cpp_library_external_custom':
+        cpp_library_external_custom.CppLibraryExternalCustomConverter,
+    'cpp_library': lambda c: cpp.CppConverter(c, 'cpp_library'),
+    'cpp_binary': lambda c: cpp.CppConverter(c, 'cpp_binary'),
+    'cpp_unittest': lambda c: cpp.CppConverter(c, 'cpp_unittest'),
+    'cpp_benchmark': lambda c: cpp.CppConverter(c, 'cpp_benchmark'),
+    'cpp_precompiled_header':
+        lambda c: cpp.CppConverter(c, 'cpp_precompiled_header'),
+    'cpp_python_extension':
+        lambda c: cpp.CppConverter(c, 'cpp_python_extension'),
+    'cpp_java_extension': lambda c: cpp.CppConverter(c, 'cpp_java_extension'),
+    'cpp_lua_extension': lambda c: cpp.CppConverter(c, 'cpp_lua_extension'),
+    'cpp_lua_main_module':
+        lambda c: cpp.CppConverter(c, 'cpp_lua_main_module'),
+    'cpp_node_extension': lambda c: cpp.CppConverter(c, 'cpp_node_extension'),
+    'cpp_jvm_library': cpp_jvm_library.CppJvmLibrary,
+    'cpp_module_external': cpp_module_external.CppModuleExternalConverter,
+    'cython_library': cython.Converter,
+    'd_binary': lambda c: d.DConverter(c, 'd_binary'),
+    'd_library': lambda c: d.DConverter(c, 'd_library'),
+    'd_unittest': lambda c: d.DConverter(c, 'd_unittest', 'd_test'),
+    'go_binary': lambda c: go.GoConverter(c, 'go_binary'),
+    'go_library': lambda c: go.GoConverter(c, 'go_library'),
+    'cgo_library': lambda c: go.GoConverter(c, 'cgo_library'),
+    'go_unittest': lambda c: go.GoConverter(c, 'go_unittest', 'go_test'),
+    'go_bindgen_library': go_bindgen_library.GoBindgenLibraryConverter,
+    'haskell_binary': lambda c: haskell.HaskellConverter(c, 'haskell_binary'),
+    'haskell_library':
+        lambda c: haskell.HaskellConverter(c, 'haskell_library'),
+    'haskell_unittest': lambda c: haskell.HaskellConverter(
+        c, 'haskell_unittest', 'haskell_binary'),
+    'haskell_ghci': lambda c: haskell.HaskellConverter(c, 'haskell_ghci'),
+    'haskell_haddock':
+        lambda c: haskell.HaskellConverter(c, 'haskell_haddock'),
+    'image_feature': image_feature.ImageFeatureConverter,
+    'image_layer': image_layer.ImageLayerConverter,
+    'lua_library': lambda c: lua.LuaConverter(c, 'lua_library'),
+    'lua_binary': lambda c: lua.LuaConverter(c, 'lua_binary'),
+    'lua_unittest': lambda c: lua.LuaConverter(c, 'lua_unittest'),
+    'python_library': lambda c: python.PythonConverter(c, 'python_library'),
+    'python_binary': lambda c: python.PythonConverter(c, 'python_binary'),
+    'python_unittest': lambda c: python.PythonConverter(c, 'python_unittest'),
+    'custom_unittest': custom_unittest.CustomUnittestConverter,
+    'thrift_library': thrift_library.ThriftLibraryConverter,
+    'swig_library': swig_library.SwigLibraryConverter,
+    'ocaml_library': lambda c: ocaml.OCamlConverter(c, 'ocaml_library'),
+    'ocaml_binary': lambda c: ocaml.OCamlConverter(c, 'ocaml_binary'),
+    'rust_library': lambda c: rust.RustConverter(c, 'rust_library'),
+    'rust_binary': lambda c: rust.RustConverter(c, 'rust_binary'),
+    'rust_unittest': lambda c: rust.RustConverter(c, 'rust_unittest'),
+    'rust_bindgen_library':
+        rust_bindgen_library.RustBindgenLibraryConverter,
+    'sphinx_wiki': sphinx.SphinxWikiConverter,
+    'sphinx_manpage': sphinx.SphinxManpageConverter,
+    'python_wheel': wheel.PyWheel,
+    'python_wheel_default': wheel.PyWheelDefault,
+}
+
+
+NEW_CONVERTER_MAP = {
+    'antlr3_srcs': antlr3_srcs,
+    'buck_cxx_binary': buck_cxx_binary,  # noqa F821
+    'cxx_genrule': cxx_genrule,  # noqa F821
+    'buck_cxx_library': buck_cxx_library,  # noqa F821
+    'buck_cxx_test': buck_cxx_test,  # noqa F821
+    'buck_export_file': buck_export_file,  # noqa F821
+    'buck_filegroup': buck_filegroup,  # noqa F821
+    'buck_genrule': buck_genrule,  # noqa F821
+    'buck_python_binary': buck_python_binary,  # noqa F821
+    'buck_python_library': buck_python_library,  # noqa F821
+    'buck_sh_binary': buck_sh_binary,  # noqa F821
+    'buck_sh_test': buck_sh_test,  # noqa F821
+    'buck_zip_file': buck_zip_file,  # noqa F821
+    'dewey_artifact': dewey_artifact,  # noqa F821
+    'export_file': export_file,  # noqa F821
+    'export_files': export_files,  # noqa F821
+    'versioned_alias': versioned_alias,  # noqa F821
+    'remote_file': remote_file,  # noqa F821
+    'test_suite': test_suite,  # noqa F821
+    'buck_command_alias': buck_command_alias,  # noqa F821
+    'custom_rule': custom_rule,  # noqa F821
+    'go_external_library': go_external_library,  # noqa F821
+    'haskell_external_library': haskell_external_library,  # noqa F821
+    'java_binary': java_binary,  # noqa F821
+    'java_library': java_library,  # noqa F821
+    'java_protoc_library': java_protoc_library,  # noqa F821
+    'java_shaded_jar': java_shaded_jar,  # noqa F821
+    'java_test': java_test,  # noqa F821
+    'js_executable': js_executable,  # noqa F821
+    'js_node_module_external': js_node_module_external,  # noqa F821
+    'js_npm_module': js_npm_module,  # noqa F821
+    'ocaml_external_library': ocaml_external_library,  # noqa F821
+    'prebuilt_jar': prebuilt_jar,  # noqa F821
+    'rust_external_library': rust_external_library,  # noqa F821
+    'scala_library': scala_library,  # noqa F821
+    'scala_test': scala_test,  # noqa F821
+    'cpp_library_external': cpp_library_external,
+    'd_library_external': d_library_external,
+}
+
+
+class ConverterRegistry(object):
+    """
+    The converters for one `Context`. Each converter is only created the
+    first time that a rule of its type is converted, and is then reused, so
+    that its caches last for the whole parse.
+    """
+
+    def __init__(self, context):
+        self._context = context
+        self._converters = {}
+        self._fbonly_converters = None
+
+    def get(self, rule_type):
+        """
+        Return the converter for `rule_type`, or `None` if it is not an old
+        style rule type.
+        """
+
+        converter = self._converters.get(rule_type)
+        if converter is not None:
+            return converter
+
+        if self._fbonly_converters is None:
+            self._fbonly_converters = {
+                c.get_fbconfig_rule_type(): c
+                for c in get_fbonly_converters(self._context)
+            }
+        converter = self._fbonly_converters.get(rule_type)
+        if converter is None:
+            factory = CONVERTER_FACTORIES.get(rule_type)
+            if factory is None:
+                return None
+            converter = factory(self._context)
+        self._converters[rule_type] = converter
+        return converter
+
+
+# Registries of the parser process, keyed by `_get_context_key()`.
+_REGISTRIES = {}
+
+# Bounds the registries kept alive when contexts keep changing.
+_MAX_REGISTRIES = 32
+
+
+def _get_context_key(context):
+    """
+    Return a key that is equal for contexts that converters handle the same.
+
+    A new `Context` is made for every rule, with new build mode objects, so
+    these are compared by value. The Buck functions and the configs are
+    shared by all rules, and are compared by identity.
+    """
+
+    return (
+        tuple(id(op) for op in context.buck_ops),
+        repr(context.build_mode),
+        context.default_compiler,
+        context.global_compiler,
+        context.coverage,
+        context.link_style,
+        context.mode,
+        context.lto_type,
+        id(context.third_party_config),
+        id(context.config),
+    )
+
+
+def get_converter_registry(context):
+    """
+    Return the `ConverterRegistry` for `context`, creating it if needed.
+    """
+
+    key = _get_context_key(context)
+    registry = _REGISTRIES.get(key)
+    if registry is None:
+        if len(_REGISTRIES) >= _MAX_REGISTRIES:
+            _REGISTRIES.clear()
+        registry = ConverterRegistry(context)
+        _REGISTRIES[key] = registry
+    return registry
+
+
 def convert(context, base_path, rule):
     """
     Convert the python representation of a targets file into a python
     representation of a buck file.
     """
 
-    converters = [
-        discard.DiscardingConverter(context, 'cpp_binary_external'),
-        discard.DiscardingConverter(context, 'haskell_genscript'),
-        cpp_library_external_custom.CppLibraryExternalCustomConverter(context),
-        cpp.CppConverter(context, 'cpp_library'),
-        cpp.CppConverter(context, 'cpp_binary'),
-        cpp.CppConverter(context, 'cpp_unittest'),
-        cpp.CppConverter(context, 'cpp_benchmark'),
-        cpp.CppConverter(context, 'cpp_precompiled_header'),
-        cpp.CppConverter(context, 'cpp_python_extension'),
-        cpp.CppConverter(context, 'cpp_java_extension'),
-        cpp.CppConverter(context, 'cpp_lua_extension'),
-        cpp.CppConverter(context, 'cpp_lua_main_module'),
-        cpp.CppConverter(context, 'cpp_node_extension'),
-        cpp_jvm_library.CppJvmLibrary(context),
-        cpp_module_external.CppModuleExternalConverter(context),
-        cython.Converter(context),
-        d.DConverter(context, 'd_binary'),
-        d.DConverter(context, 'd_library'),
-        d.DConverter(context, 'd_unittest', 'd_test'),
-        go.GoConverter(context, 'go_binary'),
-        go.GoConverter(context, 'go_library'),
-        go.GoConverter(context, 'cgo_library'),
-        go.GoConverter(context, 'go_unittest', 'go_test'),
-        go_bindgen_library.GoBindgenLibraryConverter(context),
-        haskell.HaskellConverter(context, 'haskell_binary'),
-        haskell.HaskellConverter(context, 'haskell_library'),
-        haskell.HaskellConverter(context, 'haskell_unittest', 'haskell_binary'),
-        haskell.HaskellConverter(context, 'haskell_ghci'),
-        haskell.HaskellConverter(context, 'haskell_haddock'),
-        image_feature.ImageFeatureConverter(context),
-        image_layer.ImageLayerConverter(context),
-        lua.LuaConverter(context, 'lua_library'),
-        lua.LuaConverter(context, 'lua_binary'),
-        lua.LuaConverter(context, 'lua_unittest'),
-        python.PythonConverter(context, 'python_library'),
-        python.PythonConverter(context, 'python_binary'),
-        python.PythonConverter(context, 'python_unittest'),
-        custom_unittest.CustomUnittestConverter(context),
-        thrift_library.ThriftLibraryConverter(context),
-        swig_library.SwigLibraryConverter(context),
-        ocaml.OCamlConverter(context, 'ocaml_library'),
-        ocaml.OCamlConverter(context, 'ocaml_binary'),
-        rust.RustConverter(context, 'rust_library'),
-        rust.RustConverter(context, 'rust_binary'),
-        rust.RustConverter(context, 'rust_unittest'),
-        rust_bindgen_library.RustBindgenLibraryConverter(context),
-        sphinx.SphinxWikiConverter(context),
-        sphinx.SphinxManpageConverter(context),
-        wheel.PyWheel(context),
-        wheel.PyWheelDefault(context),
-    ]
-
-    converters += get_fbonly_converters(context)
-
-    converter_map = {}
-    new_converter_map = {
-        'antlr3_srcs': antlr3_srcs,
-        'buck_cxx_binary': buck_cxx_binary,  # noqa F821
-        'cxx_genrule': cxx_genrule,  # noqa F821
-        'buck_cxx_library': buck_cxx_library,  # noqa F821
-        'buck_cxx_test': buck_cxx_test,  # noqa F821
-        'buck_export_file': buck_export_file,  # noqa F821
-        'buck_filegroup': buck_filegroup,  # noqa F821
-        'buck_genrule': buck_genrule,  # noqa F821
-        'buck_python_binary': buck_python_binary,  # noqa F821
-        'buck_python_library': buck_python_library,  # noqa F821
-        'buck_sh_binary': buck_sh_binary,  # noqa F821
-        'buck_sh_test': buck_sh_test,  # noqa F821
-        'buck_zip_file': buck_zip_file,  # noqa F821
-        'dewey_artifact': dewey_artifact,  # noqa F821
-        'export_file': export_file,  # noqa F821
-        'export_files': export_files,  # noqa F821
-        'versioned_alias': versioned_alias,  # noqa F821
-        'remote_file': remote_file,  # noqa F821
-        'test_suite': test_suite,  # noqa F821
-        'buck_command_alias': buck_command_alias,  # noqa F821
-        'custom_rule': custom_rule,  # noqa F821
-        'go_external_library': go_external_library,  # noqa F821
-        'haskell_external_library': haskell_external_library,  # noqa F821
-        'java_binary': java_binary,  # noqa F821
-        'java_library': java_library,  # noqa F821
-        'java_protoc_library': java_protoc_library,  # noqa F821
-        'java_shaded_jar': java_shaded_jar,  # noqa F821
-        'java_test': java_test,  # noqa F821
-        'js_executable': js_executable,  # noqa F821
-        'js_node_module_external': js_node_module_external,  # noqa F821
-        'js_npm_module': js_npm_module,  # noqa F821
-        'ocaml_external_library': ocaml_external_library,  # noqa F821
-        'prebuilt_jar': prebuilt_jar,  # noqa F821
-        'rust_external_library': rust_external_library,  # noqa F821
-        'scala_library': scala_library,  # noqa F821
-        'scala_test': scala_test,  # noqa F821
-        'cpp_library_external': cpp_library_external,
-        'd_library_external': d_library_external,
-    }
-
-    for converter in converters:
-        converter_map[converter.get_fbconfig_rule_type()] = converter
-
-    converter = converter_map.get(rule.type, new_converter_map.get(rule.type))
+    converter = get_converter_registry(context).get(rule.type)
+    if converter is None:
+        converter = NEW_CONVERTER_MAP.get(rule.type)
 
     if converter is None:
         name = '{0}:{1}'.format(base_path, rule.attributes['name'])
@@ -248,13 +340,13 @@ def convert(context, base_path, rule):
     # directly. Just return an empty list here so that callers, like
     # macros.py, will not break for now. Eventually most of this code will
     # disappear
-    if rule.type in new_converter_map:
+    if rule.type in NEW_CONVERTER_MAP:
         converter(**rule.attributes)
         return []
 
     # Verify arguments for old style rules. Newer rules should blow up
     # with a more readable message.
-    allowed_args = converter_map[rule.type].get_allowed_args()
+    allowed_args = converter.get_allowed_args()
     if allowed_args is not None:
         for attribute in rule.attributes:
             if (attribute not in allowed_args and
@@ -264,7 +356,7 @@ def convert(context, base_path, rule):
                     .format(rule.type, attribute))
 
     # Potentially convert from a generator
-    return list(converter_map[rule.type].convert(
+    return list(converter.convert(
         base_path,
         **rule.attributes
     ))
@@ -39,6 +39,16 @@ def parse_target(raw_target, base_path=None):
     Convert the given build target into a RuleTarget
     """
 
+    return target.memoized(
+        'fbcode_parse_target',
+        (raw_target, base_path),
+        _parse_target,
+        raw_target,
+        base_path)
+
+
+def _parse_target(raw_target, base_path=None):
+
     # A 'repo' is used as the cell name when generating a target except
     # when:
     #  - repo is None. This means that the rule is in the root cell
@@ -0,0 +1,242 @@
+#!/usr/bin/env python2
+
+# Copyright 2016-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree. An additional grant
+# of patent rights can be found in the PATENTS file in the same directory.
+
+"""
+Opt-in profiling of how long the macro layer takes to convert TARGETS rules
+and to instantiate the resulting Buck rules.
+
+Enable it with `fbcode.parse_profile=<path>`.  At the end of each parser
+process, a report of the time spent per rule type and per base path is
+written next to that path, with the process id added to its name (e.g.
+`profile.1234.txt` for `profile.txt`), as Buck runs several parser processes.
+With `fbcode.parse_profile_format=trace`, a Chrome trace (viewable in
+chrome://tracing) of every rule is written instead.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# TODO(T20914511): Until the macro lib has been completely ported to
+# `include_defs()`, we need to support being loaded via both `import` and
+# `include_defs()`.  These ugly preamble is thus here to consistently provide
+# `allow_unsafe_import()` regardless of how we're loaded.
+import contextlib
+try:
+    allow_unsafe_import
+except NameError:
+    @contextlib.contextmanager
+    def allow_unsafe_import(*args, **kwargs):
+        yield
+
+import collections
+import json
+
+with allow_unsafe_import():
+    import atexit
+    import os
+    import time
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+
+
+__all__ = ['ParseProfiler', 'NullParseProfiler']
+
+
+# Number of rule types and base paths listed in each section of the report.
+REPORT_TOP_ENTRIES = 50
+
+
+# Aggregated cost of a rule type or base path in one phase.
+ProfileStats = (
+    collections.namedtuple(
+        'ProfileStats', ['count', 'seconds', 'allocated_bytes']))
+
+
+class _NullRecord(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class NullParseProfiler(object):
+    """
+    The profiler used when profiling is disabled, which records nothing.
+    """
+
+    _RECORD = _NullRecord()
+
+    def record(self, phase, rule_type, base_path, name=None):
+        return self._RECORD
+
+
+class _Record(object):
+
+    def __init__(self, profiler, phase, rule_type, base_path, name):
+        self._profiler = profiler
+        self._phase = phase
+        self._rule_type = rule_type
+        self._base_path = base_path
+        self._name = name
+
+    def __enter__(self):
+        self._allocated = self._profiler.get_allocated_bytes()
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        end = time.time()
+        allocated = self._profiler.get_allocated_bytes()
+        self._profiler.add(
+            self._phase,
+            self._rule_type,
+            self._base_path,
+            self._name,
+            self._start,
+            end - self._start,
+            (None if allocated is None
+             else max(allocated - self._allocated, 0)))
+        return False
+
+
+class ParseProfiler(object):
+    """
+    Aggregates the wall time, and the memory allocated if `tracemalloc` is
+    available, of each phase of each rule, by rule type and by base path.
+    """
+
+    def __init__(self, output, output_format='report'):
+        if output_format not in ('report', 'trace'):
+            raise ValueError(
+                'fbcode.parse_profile_format must be "report" or "trace", '
+                'not {!r}'.format(output_format))
+        self._output = output
+        self._format = output_format
+        self._by_rule_type = collections.defaultdict(
+            lambda: ProfileStats(0, 0.0, 0))
+        self._by_base_path = collections.defaultdict(
+            lambda: ProfileStats(0, 0.0, 0))
+        self._events = []
+        self._trace_memory = tracemalloc is not None
+        if self._trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def get_allocated_bytes(self):
+        if not self._trace_memory:
+            return None
+        return tracemalloc.get_traced_memory()[0]
+
+    def record(self, phase, rule_type, base_path, name=None):
+        """
+        Return a context manager that records the time spent in its body as
+        `phase` (e.g. 'convert') of a rule.
+        """
+
+        return _Record(self, phase, rule_type, base_path, name)
+
+    def add(self, phase, rule_type, base_path, name, start, seconds,
+            allocated_bytes):
+        for stats, key in (
+                (self._by_rule_type, (phase, rule_type)),
+                (self._by_base_path, (phase, base_path))):
+            old = stats[key]
+            stats[key] = ProfileStats(
+                old.count + 1,
+                old.seconds + seconds,
+                old.allocated_bytes + (allocated_bytes or 0))
+        if self._format == 'trace':
+            self._events.append({
+                'name': rule_type,
+                'cat': phase,
+                'ph': 'X',
+                'ts': int(start * 1e6),
+                'dur': int(seconds * 1e6),
+                'pid': os.getpid(),
+                'tid': 0,
+                'args': {
+                    'base_path': base_path,
+                    'name': name,
+                    'allocated_bytes': allocated_bytes,
+                },
+            })
+
+    def _format_section(self, title, stats):
+        lines = [
+            title,
+            '  {:>9} {:>7} {:>9} {:>12}  {}'.format(
+                'seconds', 'count', 'ms/rule', 'alloc bytes', 'phase:key'),
+        ]
+        entries = sorted(
+            stats.items(), key=lambda kv: kv[1].seconds, reverse=True)
+        for (phase, key), entry in entries[:REPORT_TOP_ENTRIES]:
+            lines.append(
+                '  {:9.3f} {:7d} {:9.3f} {:>12}  {}:{}'.format(
+                    entry.seconds,
+                    entry.count,
+                    1000 * entry.seconds / entry.count,
+                    entry.allocated_bytes if self._trace_memory else '-',
+                    phase,
+                    key))
+        return lines
+
+    def format_report(self, extra_stats=None):
+        """
+        Return the text report, with the most expensive rule types and base
+        paths first.  `extra_stats` is a dict of other counters to list.
+        """
+
+        lines = (
+            self._format_section('By rule type:', self._by_rule_type) +
+            [''] +
+            self._format_section('By base path:', self._by_base_path))
+        if extra_stats:
+            lines.append('')
+            lines.append('Counters:')
+            for key, value in sorted(extra_stats.items()):
+                lines.append('  {}: {}'.format(key, value))
+        return '\n'.join(lines) + '\n'
+
+    def get_output_path(self):
+        """
+        Return the path this process writes to, which is the configured output
+        path with the process id added before its extension.
+        """
+
+        root, ext = os.path.splitext(self._output)
+        return '{}.{}{}'.format(root, os.getpid(), ext)
+
+    def write(self, extra_stats=None):
+        """
+        Write the report or trace to this process' output path.
+        """
+
+        with open(self.get_output_path(), 'w') as f:
+            if self._format == 'trace':
+                json.dump(
+                    {
+                        'traceEvents': self._events,
+                        'otherData': extra_stats or {},
+                    },
+                    f)
+            else:
+                f.write(self.format_report(extra_stats))
+
+    def write_at_exit(self, get_extra_stats=None):
+        """
+        Write the report or trace when the parser process exits.
+        """
+
+        atexit.register(
+            lambda: self.write(get_extra_stats() if get_extra_stats else None))
@@ -42,6 +42,58 @@ RuleTarget = (
     ))
 
 
+# The same dep strings are parsed and formatted for thousands of rules in a
+# parse, so the results are memoized for the whole parser process.  Each
+# cache is cleared when it reaches this size, to bound its memory.
+#
+# Results also depend on the config (e.g. `fbcode.fbcode_style_deps`, the
+# current repo name and the third-party settings), which isn't part of the
+# keys: Buck starts new parser processes when its config changes, so it is
+# fixed for the life of these caches.
+MEMO_CACHE_MAX_ENTRIES = 65536
+
+_MEMO_CACHES = collections.defaultdict(dict)
+_MEMO_CACHE_STATS = collections.Counter()
+
+
+def memoized(cache_name, key, func, *args, **kwargs):
+    """
+    Return `func(*args, **kwargs)`, memoized under `key` in the cache named
+    `cache_name`.  The result must be immutable, as it is shared by callers.
+    """
+
+    cache = _MEMO_CACHES[cache_name]
+    try:
+        value = cache[key]
+    except KeyError:
+        _MEMO_CACHE_STATS[cache_name + '_misses'] += 1
+        value = func(*args, **kwargs)
+        if len(cache) >= MEMO_CACHE_MAX_ENTRIES:
+            cache.clear()
+        cache[key] = value
+        return value
+    _MEMO_CACHE_STATS[cache_name + '_hits'] += 1
+    return value
+
+
+def get_memo_cache_stats():
+    """
+    Return the hit and miss counts of the target parsing and label caches.
+    """
+
+    return dict(_MEMO_CACHE_STATS)
+
+
+def clear_memo_caches():
+    """
+    Empty the memo caches and their stats, e.g. after changing the config in
+    tests.
+    """
+
+    _MEMO_CACHES.clear()
+    _MEMO_CACHE_STATS.clear()
+
+
 def parse_target(
     target, default_repo=None, default_base_path=None
 ):  # type: (str, Optional[str], Optional[str]) -> RuleTarget
@@ -49,6 +101,19 @@ def parse_target(
     Convert the given build target into a RuleTarget
     """
 
+    return memoized(
+        'parse_target',
+        (target, default_repo, default_base_path),
+        _parse_target,
+        target,
+        default_repo,
+        default_base_path)
+
+
+def _parse_target(
+    target, default_repo=None, default_base_path=None
+):  # type: (str, Optional[str], Optional[str]) -> RuleTarget
+
     # Normalize the target by removing the leading `@/`.
     normalized = None
     if target.startswith('@/'):
@@ -55,6 +55,27 @@ class BaseConverterTest(utils.ConverterTestCase):
         actual_build_dat = self._converter.get_tp2_build_dat(base_path)
         self.assertEqual(actual_build_dat, build_dat)
 
+    def test_get_tp2_build_dat_registers_dep_on_every_lookup(self):
+        # Converters are shared between build files, so a cached build.dat
+        # must still be registered as a dep of each build file.
+        base_path = 'base/path'
+        self.write_build_dat(base_path, {
+            'builds': {},
+            'dependencies': {},
+            'platform': 'platform007',
+        })
+        deps = []
+        context = self._state.context
+        converter = self._base.Converter(
+            context._replace(
+                buck_ops=context.buck_ops._replace(
+                    add_build_file_dep=deps.append)))
+        first = converter.get_tp2_build_dat(base_path)
+        self.assertIs(first, converter.get_tp2_build_dat(base_path))
+        self.assertEqual(2, len(deps))
+        self.assertEqual(deps[0], deps[1])
+        self.assertTrue(deps[0].endswith('base/path/build.dat'))
+
     def test_get_tp2_project_builds_with_single_build(self):
         base_path = 'base/path'
         build_dat = {
@@ -0,0 +1,148 @@
+#!/usr/bin/env python2
+
+# Copyright 2016-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree. An additional grant
+# of patent rights can be found in the PATENTS file in the same directory.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from . import utils
+from tools.build.buck.parser import BuildFileContext
+
+import sys
+import time
+
+
+class ConverterTest(utils.ConverterTestCase):
+
+    def setUp(self):
+        super(ConverterTest, self).setUp()
+        try:
+            self.setup_with_config({}, set())
+        except:
+            super(ConverterTest, self).tearDown()
+            raise
+
+    def setup_with_config(self, additional_configs, removed_configs):
+        self._state = self._create_converter_state(
+            additional_configs,
+            removed_configs)
+        self._converter = (
+            self._state.parser.load_include(
+                'tools/build/buck/infra_macros/macro_lib/converter.py'))
+        self._create_build_mode = (
+            self._state.parser.load_include(
+                'tools/build/buck/infra_macros/fbcode_macros/build_defs/'
+                'create_build_mode.bzl'))
+        self._rule = (
+            self._state.parser.load_include(
+                'tools/build/buck/infra_macros/macro_lib/rule.py'))
+        self._converter._REGISTRIES.clear()
+
+    def test_registry_is_reused_for_equal_contexts(self):
+        context = self._state.context
+        # Every rule gets a new `Context` with new build mode objects.
+        equal_context = context._replace(
+            build_mode=self._create_build_mode.create_build_mode())
+        self.assertIsNot(context.build_mode, equal_context.build_mode)
+
+        registry = self._converter.get_converter_registry(context)
+        self.assertIs(
+            registry, self._converter.get_converter_registry(equal_context))
+        converter = registry.get('cpp_library')
+        self.assertIsNotNone(converter)
+        self.assertIs(converter, registry.get('cpp_library'))
+        self.assertIsNot(converter, registry.get('cpp_binary'))
+        self.assertIsNone(registry.get('not_a_rule_type'))
+
+    def test_registry_is_not_reused_across_contexts(self):
+        context = self._state.context
+        registry = self._converter.get_converter_registry(context)
+        other_config = self._create_converter_state(
+            {('fbcode', 'fbcode_style_deps'): 'false'}).context.config
+
+        for other_context in (
+                context._replace(mode='dev'),
+                context._replace(
+                    build_mode=self._create_build_mode.create_build_mode(
+                        c_flags=['-DFOO'])),
+                context._replace(coverage=True),
+                context._replace(link_style='static'),
+                context._replace(config=other_config)):
+            other_registry = (
+                self._converter.get_converter_registry(other_context))
+            self.assertIsNot(registry, other_registry)
+            self.assertIsNot(
+                registry.get('cpp_library'),
+                other_registry.get('cpp_library'))
+
+    def test_registries_are_bounded(self):
+        context = self._state.context
+        for i in range(self._converter._MAX_REGISTRIES + 1):
+            self._converter.get_converter_registry(
+                context._replace(mode='mode{}'.format(i)))
+        self.assertLessEqual(
+            len(self._converter._REGISTRIES),
+            self._converter._MAX_REGISTRIES)
+
+    def test_convert_mixed_rules_benchmark(self):
+        # Conversion time of a parse with many rules of mixed types, with a
+        # new `Context` per rule as in `macros.py`, so that converters are
+        # reused through the registry rather than built for each rule.
+        rules = []
+        for i in range(100):
+            rules.extend([
+                self._rule.Rule('cpp_library', {
+                    'name': 'lib{}'.format(i),
+                    'srcs': ['Lib{}.cpp'.format(i)],
+                    'headers': ['Lib{}.h'.format(i)],
+                    'deps': [':lib{}'.format(i - 1)] if i else [],
+                    'external_deps': ['glog'],
+                }),
+                self._rule.Rule('cpp_binary', {
+                    'name': 'bin{}'.format(i),
+                    'srcs': ['Main{}.cpp'.format(i)],
+                    'deps': [':lib{}'.format(i)],
+                }),
+                self._rule.Rule('python_library', {
+                    'name': 'py{}'.format(i),
+                    'srcs': ['py{}.py'.format(i)],
+                    'deps': [':py{}'.format(i - 1)] if i else [],
+                }),
+                self._rule.Rule('python_unittest', {
+                    'name': 'py{}_test'.format(i),
+                    'srcs': ['test_py{}.py'.format(i)],
+                    'deps': [':py{}'.format(i)],
+                }),
+            ])
+
+        def convert_all():
+            with self._state.parser._with_stacked_build_env(
+                    BuildFileContext('base')):
+                for rule in rules:
+                    context = self._state.context._replace(
+                        build_mode=self._create_build_mode.create_build_mode())
+                    self._converter.convert(context, 'base', rule)
+
+        convert_all()
+        start = time.time()
+        convert_all()
+        per_rule_ms = 1000 * (time.time() - start) / len(rules)
+        print(
+            'conversion of {} mixed rules: {:.3f} ms/rule'.format(
+                len(rules), per_rule_ms),
+            file=sys.stderr)
+
+        # One registry, with one converter per rule type.
+        self.assertEqual(1, len(self._converter._REGISTRIES))
+        registry, = self._converter._REGISTRIES.values()
+        self.assertEqual(
+            {'cpp_library', 'cpp_binary', 'python_library', 'python_unittest'},
+            set(registry._converters))
+        self.assertLess(per_rule_ms, 50)
@@ -14,7 +14,11 @@ from __future__ import unicode_literals
 
 from . import utils
 
+import glob
 import mock
+import os
+import sys
+import timeit
 
 
 class CppLibraryConverterTest(utils.ConverterTestCase):
@@ -38,6 +42,8 @@ class CppLibraryConverterTest(utils.ConverterTestCase):
             self._cpp.CppConverter(
                 self._state.context,
                 'cpp_library'))
+        # Start a new build file evaluation, as `rule_handler()` does.
+        self._cpp.HEADER_INDEX.start_build_file(object())
 
     def test_exclude_from_auto_pch(self):
         self.assertFalse(
@@ -200,3 +206,111 @@ class CppLibraryConverterTest(utils.ConverterTestCase):
         labels = attrs.get('labels')
         self.assertIsNotNone(labels)
         self.assertTrue("test_tag" in labels)
+
+    def test_convert_benchmark(self):
+        # A microbenchmark of converting a typical `cpp_library`, as this is
+        # the most used converter.  The bound is loose, so that this only
+        # catches gross regressions (e.g. per-rule regex compilation or
+        # filesystem access) rather than flaking on slow machines.
+        def convert():
+            return self._converter.convert(
+                'base',
+                'name',
+                srcs=['Lib.cpp', 'Other.cpp', 'Third.cpp'],
+                headers=['Lib.h', 'Other.h'],
+                deps=['//test:target1', ':target2'],
+                external_deps=[('glog', None, 'glog'), 'gflags'],
+                auto_headers=None,
+                compiler_flags=['-Wno-unused', '-DFOO=1'],
+                preprocessor_flags=['-DBAR'],
+                linker_flags=['-rpath,/tmp'],
+                tags=['test_tag'],
+            )
+
+        convert()
+        iterations = 200
+        seconds = min(timeit.repeat(convert, number=iterations, repeat=3))
+        per_rule_ms = 1000 * seconds / iterations
+        print(
+            'cpp_library conversion: {:.3f} ms/rule'.format(per_rule_ms),
+            file=sys.stderr)
+        self.assertLess(per_rule_ms, 50)
+
+    def _use_real_glob(self, base_path):
+        # Glob for real under `base_path`, and count the globs.
+        globs = []
+
+        def real_glob(patterns):
+            globs.append(patterns)
+            return sorted(set(
+                os.path.relpath(path, base_path)
+                for pattern in patterns
+                for path in glob.glob(os.path.join(base_path, pattern))))
+
+        context = self._state.context
+        self._converter = self._cpp.CppConverter(
+            context._replace(
+                buck_ops=context.buck_ops._replace(glob=real_glob)),
+            'cpp_library')
+        return globs
+
+    def test_headers_from_sources_use_header_index(self):
+        for path in ['Lib.cpp', 'Lib.h', 'Lib-inl.h', 'LibImpl.h', 'Other.h',
+                     'sub/Sub.cpp', 'sub/Sub.tcc', 'sub/Sub.hpp']:
+            self.write_file(os.path.join('index', path))
+        globs = self._use_real_glob('index')
+
+        self.assertEqual(
+            ['Lib-inl.h', 'Lib.h', 'LibImpl.h', 'sub/Sub.hpp', 'sub/Sub.tcc'],
+            self._converter.get_headers_from_sources(
+                'index', ['Lib.cpp', 'sub/Sub.cpp', ':gen.cpp', 'Lib.py']))
+        self.assertEqual(
+            ['Lib-inl.h', 'Lib.h', 'LibImpl.h'],
+            self._converter.get_headers_from_sources('index', ['Lib.cpp']))
+        # One glob per directory, no matter how many rules ask.
+        self.assertEqual(2, len(globs))
+
+    def test_header_index_is_reset_per_build_file_evaluation(self):
+        self.write_file(os.path.join('index', 'Lib.cpp'))
+        globs = self._use_real_glob('index')
+        self.assertEqual(
+            [], self._converter.get_headers_from_sources('index', ['Lib.cpp']))
+
+        # Within an evaluation, the index answers.
+        self.write_file(os.path.join('index', 'Lib.h'))
+        self.assertEqual(
+            [], self._converter.get_headers_from_sources('index', ['Lib.cpp']))
+        self.assertEqual(1, len(globs))
+
+        # Evaluating the same build file again globs again, so that it sees
+        # the new header and registers its glob with Buck.
+        self._cpp.HEADER_INDEX.start_build_file(object())
+        self.assertEqual(
+            ['Lib.h'],
+            self._converter.get_headers_from_sources('index', ['Lib.cpp']))
+        self.assertEqual(2, len(globs))
+
+    def test_header_index_benchmark(self):
+        # A package with hundreds of `cpp_library` rules, each with its own
+        # source and headers, as in large auto-generated TARGETS files.
+        rules = 300
+        for i in range(rules):
+            for ext in ['.cpp', '.h', '-inl.h']:
+                self.write_file(os.path.join('many', 'Lib{}{}'.format(i, ext)))
+        globs = self._use_real_glob('many')
+
+        def convert():
+            for i in range(rules):
+                self._converter.convert(
+                    'many',
+                    'lib{}'.format(i),
+                    srcs=['Lib{}.cpp'.format(i)],
+                    deps=[],
+                )
+
+        seconds = timeit.timeit(convert, number=1)
+        print(
+            'cpp_library conversion with {} rules in a package: {:.3f} '
+            'ms/rule'.format(rules, 1000 * seconds / rules),
+            file=sys.stderr)
+        self.assertEqual(1, len(globs))
@@ -63,6 +63,16 @@ class FbcodeTargetConverterTest(utils.ConverterTestCase):
         with self.assertRaises(ValueError):
             self._fbcode_target.parse_target('repo:invalid:target')
 
+    def test_parse_target_uses_current_config(self):
+        self.assertEquals(
+            self._fbcode_target.parse_target('@/third-party:full:target'),
+            self._fbcode_target.RuleTarget('third-party', 'full', 'target'))
+
+        # The memoized result isn't reused with another config.
+        self.setup_with_config({}, {('fbcode', 'fbcode_style_deps')})
+        with self.assertRaises(ValueError):
+            self._fbcode_target.parse_target('@/third-party:full:target')
+
     def test_parse_target_in_oss(self):
         self.setup_with_config({}, {('fbcode', 'fbcode_style_deps')})
 
@@ -0,0 +1,162 @@
+#!/usr/bin/env python2
+
+# Copyright 2016-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree. An additional grant
+# of patent rights can be found in the PATENTS file in the same directory.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from . import utils
+
+import json
+import mock
+import os
+import shutil
+import tempfile
+
+
+class ParseProfilerTest(utils.ConverterTestCase):
+
+    def setUp(self):
+        super(ParseProfilerTest, self).setUp()
+        self._state = self._create_converter_state({}, set())
+        self._parse_profiler = (
+            self._state.parser.load_include(
+                'tools/build/buck/infra_macros/macro_lib/parse_profiler.py'))
+        self._tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+        super(ParseProfilerTest, self).tearDown()
+
+    def _profiler(self, output_format='report'):
+        return self._parse_profiler.ParseProfiler(
+            os.path.join(self._tmp, 'profile.txt'), output_format)
+
+    def _add_rules(self, profiler):
+        profiler.add('convert', 'cpp_library', 'foo', 'a', 1.0, 0.25, 100)
+        profiler.add('convert', 'cpp_library', 'bar', 'b', 2.0, 0.5, 200)
+        profiler.add('convert', 'python_library', 'foo', 'c', 3.0, 2.0, 50)
+        profiler.add('instantiate', 'cpp_library', 'foo', 'a', 4.0, 0.1, 0)
+
+    def _report_entries(self, report, title):
+        lines = report.split('\n')
+        start = lines.index(title) + 2
+        end = lines.index('', start)
+        return [line.split() for line in lines[start:end]]
+
+    def test_report_aggregates_by_rule_type_and_base_path(self):
+        profiler = self._profiler()
+        self._add_rules(profiler)
+        report = profiler.format_report()
+
+        by_rule_type = {
+            entry[-1]: (float(entry[0]), int(entry[1]))
+            for entry in self._report_entries(report, 'By rule type:')}
+        self.assertEqual(
+            {
+                'convert:python_library': (2.0, 1),
+                'convert:cpp_library': (0.75, 2),
+                'instantiate:cpp_library': (0.1, 1),
+            },
+            by_rule_type)
+
+        by_base_path = {
+            entry[-1]: (float(entry[0]), int(entry[1]))
+            for entry in self._report_entries(report, 'By base path:')}
+        self.assertEqual(
+            {
+                'convert:foo': (2.25, 2),
+                'convert:bar': (0.5, 1),
+                'instantiate:foo': (0.1, 1),
+            },
+            by_base_path)
+
+    def test_report_lists_most_expensive_first(self):
+        profiler = self._profiler()
+        self._add_rules(profiler)
+        report = profiler.format_report({'tp2_cache_hits': 3})
+
+        self.assertEqual(
+            [
+                'convert:python_library',
+                'convert:cpp_library',
+                'instantiate:cpp_library',
+            ],
+            [entry[-1]
+             for entry in self._report_entries(report, 'By rule type:')])
+        self.assertEqual(
+            ['convert:foo', 'convert:bar', 'instantiate:foo'],
+            [entry[-1]
+             for entry in self._report_entries(report, 'By base path:')])
+        self.assertTrue(report.endswith('Counters:\n  tp2_cache_hits: 3\n'))
+
+    def test_report_is_truncated(self):
+        profiler = self._profiler()
+        for i in range(self._parse_profiler.REPORT_TOP_ENTRIES + 10):
+            profiler.add(
+                'convert', 'rule{}'.format(i), 'base', None, 0.0, i, None)
+        entries = self._report_entries(
+            profiler.format_report(), 'By rule type:')
+        self.assertEqual(
+            self._parse_profiler.REPORT_TOP_ENTRIES, len(entries))
+        self.assertEqual(
+            'convert:rule{}'.format(
+                self._parse_profiler.REPORT_TOP_ENTRIES + 9),
+            entries[0][-1])
+
+    def test_record(self):
+        profiler = self._profiler()
+        with mock.patch.object(
+                self._parse_profiler.time, 'time', side_effect=[10.0, 10.5]):
+            with profiler.record('convert', 'cpp_library', 'foo', 'a'):
+                pass
+        self.assertEqual(
+            [['0.500', '1', '500.000']],
+            [entry[:3] for entry in self._report_entries(
+                profiler.format_report(), 'By rule type:')])
+
+    def test_write_trace(self):
+        profiler = self._profiler('trace')
+        self._add_rules(profiler)
+        profiler.write({'tp2_cache_hits': 3})
+
+        # Each parser process writes its own file
+        path = profiler.get_output_path()
+        self.assertEqual(
+            os.path.join(self._tmp, 'profile.{}.txt'.format(os.getpid())),
+            path)
+        self.assertFalse(
+            os.path.exists(os.path.join(self._tmp, 'profile.txt')))
+
+        with open(path) as f:
+            trace = json.load(f)
+        self.assertEqual({'tp2_cache_hits': 3}, trace['otherData'])
+        events = trace['traceEvents']
+        self.assertEqual(4, len(events))
+        self.assertEqual(
+            {
+                'name': 'cpp_library',
+                'cat': 'convert',
+                'ph': 'X',
+                'ts': 2000000,
+                'dur': 500000,
+                'pid': os.getpid(),
+                'tid': 0,
+                'args': {
+                    'base_path': 'bar',
+                    'name': 'b',
+                    'allocated_bytes': 200,
+                },
+            },
+            events[1])
+
+    def test_invalid_format(self):
+        with self.assertRaises(ValueError):
+            self._profiler('flamegraph')
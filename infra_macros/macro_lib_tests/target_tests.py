@@ -0,0 +1,87 @@
+#!/usr/bin/env python2
+
+# Copyright 2016-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree. An additional grant
+# of patent rights can be found in the PATENTS file in the same directory.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from . import utils
+
+
+class TargetTest(utils.ConverterTestCase):
+
+    def setUp(self):
+        super(TargetTest, self).setUp()
+        self._state = self._create_converter_state({}, set())
+        self._target = (
+            self._state.parser.load_include(
+                'tools/build/buck/infra_macros/macro_lib/target.py'))
+        self._target.clear_memo_caches()
+        self._calls = []
+
+    def _func(self, value):
+        self._calls.append(value)
+        if value is None:
+            raise ValueError('no value')
+        return value.upper()
+
+    def _memoized(self, value):
+        return self._target.memoized('test', value, self._func, value)
+
+    def test_memoized_hits_and_misses(self):
+        self.assertEqual('A', self._memoized('a'))
+        self.assertEqual('A', self._memoized('a'))
+        self.assertEqual('B', self._memoized('b'))
+        self.assertEqual(['a', 'b'], self._calls)
+        self.assertEqual(
+            {'test_hits': 1, 'test_misses': 2},
+            self._target.get_memo_cache_stats())
+
+    def test_memoized_caches_are_separate(self):
+        self._memoized('a')
+        self.assertEqual(
+            'other',
+            self._target.memoized('other', 'a', lambda: 'other'))
+        self.assertEqual('A', self._memoized('a'))
+        self.assertEqual(['a'], self._calls)
+
+    def test_memoized_does_not_cache_errors(self):
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                self._memoized(None)
+        self.assertEqual([None, None], self._calls)
+
+    def test_memoized_cache_is_bounded(self):
+        max_entries = self._target.MEMO_CACHE_MAX_ENTRIES
+        for i in range(max_entries):
+            self._target.memoized('test', i, lambda: None)
+        self.assertEqual(max_entries, len(self._target._MEMO_CACHES['test']))
+
+        # The cache is emptied once full, rather than growing.
+        self._memoized('a')
+        self.assertEqual(1, len(self._target._MEMO_CACHES['test']))
+        self._memoized('a')
+        self.assertEqual(['a'], self._calls)
+
+    def test_clear_memo_caches(self):
+        self._memoized('a')
+        self._target.clear_memo_caches()
+        self.assertEqual({}, self._target.get_memo_cache_stats())
+        self._memoized('a')
+        self.assertEqual(['a', 'a'], self._calls)
+
+    def test_parse_target_is_memoized(self):
+        first = self._target.parse_target('//foo:bar')
+        self.assertIs(first, self._target.parse_target('//foo:bar'))
+        self.assertEqual(
+            self._target.RuleTarget(None, 'foo', 'bar'), first)
+        self.assertEqual(
+            {'parse_target_hits': 1, 'parse_target_misses': 1},
+            self._target.get_memo_cache_stats())
@@ -40,3 +40,13 @@ class ManifestTestCase(unittest.TestCase):
                 break
         else:
             self.fail("test_manifest not found in __manifest__.modules")
+
+    def test_modules_listed_at_build_time(self):
+        import __manifest__
+
+        # The modules are listed when the binary is built, rather than found
+        # by walking the package, so they don't include the test main module,
+        # which comes from a dependency.
+        self.assertEqual(sorted(__manifest__.modules), __manifest__.modules)
+        self.assertNotIn(
+            __manifest__.fbmake["main_module"], __manifest__.modules)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python2
+
+# Copyright 2016-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree. An additional grant
+# of patent rights can be found in the PATENTS file in the same directory.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from . import utils
+from tools.build.buck.parser import BuildFileContext
+
+import gc
+import sys
+import time
+
+
+class ThriftLibraryConverterTest(utils.ConverterTestCase):
+
+    def setUp(self):
+        super(ThriftLibraryConverterTest, self).setUp()
+        try:
+            self.setup_with_config({}, {})
+        except:
+            super(ThriftLibraryConverterTest, self).tearDown()
+            raise
+
+    def setup_with_config(self, additional_configs, removed_configs):
+        self._state = self._create_converter_state(
+            additional_configs,
+            removed_configs)
+        self._thrift = (
+            self._state.parser.load_include(
+                'tools/build/buck/infra_macros/macro_lib/convert/'
+                'thrift_library.py'))
+        self._converter = (
+            self._thrift.ThriftLibraryConverter(self._state.context))
+
+    def _convert(self, thrift_srcs, languages):
+        with self._state.parser._with_stacked_build_env(
+                BuildFileContext('base')):
+            return self._converter.convert(
+                'base',
+                'name',
+                thrift_srcs=thrift_srcs,
+                languages=languages,
+            )
+
+    def test_large_thrift_library_allocation_benchmark(self):
+        # An allocation benchmark of a large `thrift_library`, which emits
+        # rules per language, per source and per generated file.
+        thrift_srcs = {
+            'service{}.thrift'.format(i): ['Service{}'.format(i)]
+            for i in range(50)
+        }
+
+        gc.collect()
+        gc.disable()
+        try:
+            objects_before = len(gc.get_objects())
+            rules = self._convert(thrift_srcs, ['cpp2', 'py', 'py3'])
+            objects = len(gc.get_objects()) - objects_before
+        finally:
+            gc.enable()
+
+        attributes_bytes = sum(
+            sys.getsizeof(rule.attributes) for rule in rules)
+        print(
+            'thrift_library with {} sources: {} rules, {} live objects, '
+            '{} bytes of attribute maps'.format(
+                len(thrift_srcs), len(rules), objects, attributes_bytes),
+            file=sys.stderr)
+
+        # The per-source rules are plain dicts rather than `OrderedDict`s.
+        # (`name-cpp2-services` is the per-library cpp2 services rule.)
+        per_source = [
+            rule for rule in rules
+            if rule.attributes['name'].startswith('name-cpp2-service') and
+            '.thrift' in rule.attributes['name']]
+        self.assertTrue(per_source)
+        for rule in per_source:
+            self.assertIs(dict, type(rule.attributes))
+
+    def test_multi_output_compile_rules(self):
+        self.setup_with_config(
+            {('thrift', 'multi_output_compile_rules'): 'true'}, {})
+        rules = self._convert(
+            {'service.thrift': ['Service']}, ['cpp2', 'py3'])
+        by_name = {rule.attributes['name']: rule for rule in rules}
+
+        # One compile rule for both languages, and no extraction rules.
+        compile_rule = by_name['name-service.thrift']
+        self.assertEqual('genrule', compile_rule.type)
+        self.assertEqual(['service.thrift'], compile_rule.attributes['srcs'])
+        # The cpp2 command ends with a `# $(exe ...)` comment, which must not
+        # swallow the py3 command after it.
+        cmd = compile_rule.attributes['cmd']
+        self.assertIn('# $(exe ', cmd)
+        commands = [line.split('#', 1)[0] for line in cmd.splitlines()]
+        self.assertEqual(
+            1, len([c for c in commands if 'mstch_cpp2' in c]))
+        self.assertEqual(
+            1, len([c for c in commands if 'mstch_py3' in c]))
+        for line in cmd.splitlines():
+            if '#' in line:
+                self.assertRegexpMatches(
+                    line.split('#', 1)[1], r'^ \$\(exe [^)]+\)$')
+        # Extraction rules are named `<compile rule>=<path>`.  (py3's Cython
+        # rules also contain `=`, but they extract their own sources.)
+        self.assertFalse([n for n in by_name if 'service.thrift=' in n])
+        self.assertNotIn('name-cpp2-service.thrift', by_name)
+        self.assertNotIn('name-py3-service.thrift', by_name)
+
+        # The outputs keep their paths, and the language rules consume them
+        # as named outputs.
+        outs = compile_rule.attributes['outs']
+        self.assertEqual(
+            ['gen-cpp2/service_types.h'], outs['gen-cpp2/service_types.h'])
+        self.assertIn(
+            ':name-service.thrift[gen-cpp2/service_types.h]',
+            str(by_name['name-cpp2-types'].attributes))
+
+    def test_multi_output_compile_rules_keep_shared_dirs_apart(self):
+        self.setup_with_config(
+            {('thrift', 'multi_output_compile_rules'): 'true'}, {})
+        rules = self._convert({'service.thrift': ['Service']}, ['py'])
+        names = set(rule.attributes['name'] for rule in rules)
+
+        # `py` and the implied `pyi` both write into `gen-py`, so only one of
+        # them can share the compile rule.
+        self.assertIn('name-service.thrift', names)
+        self.assertEqual(
+            1,
+            len(names & {'name-py-service.thrift',
+                         'name-pyi-service.thrift'}))
+
+    def test_multi_output_compile_rules_benchmark(self):
+        # Rule counts and conversion time of a synthetic 500-file
+        # `thrift_library`, with and without multi-output compile rules.
+        thrift_srcs = {
+            'service{}.thrift'.format(i): ['Service{}'.format(i)]
+            for i in range(500)
+        }
+        languages = ['cpp2', 'py', 'py3', 'java-swift']
+
+        results = []
+        for multi_output in ('false', 'true'):
+            self.setup_with_config(
+                {('thrift', 'multi_output_compile_rules'): multi_output}, {})
+            start = time.time()
+            rules = self._convert(thrift_srcs, languages)
+            results.append((len(rules), time.time() - start))
+            print(
+                'thrift_library with {} sources, multi_output_compile_rules='
+                '{}: {} rules in {:.3f}s'.format(
+                    len(thrift_srcs), multi_output, *results[-1]),
+                file=sys.stderr)
+
+        # Only cpp2 and py3 share the compile rules here: `java-swift` does
+        # not support it, and `pyi` claims `gen-py` before `py` does.  The
+        # per-source py3 Cython rules remain, so expect about a 2x reduction
+        # (31517 to 14517 rules when last measured).
+        (per_file_rules, _), (multi_output_rules, _) = results
+        self.assertLess(multi_output_rules * 2, per_file_rules)
@@ -106,6 +106,12 @@ class ConverterTestCase(unittest.TestCase):
             tiered_config[section][field] = value
         parser = Parser.create_from_config(tiered_config, root=self._old_cwd)
 
+        # Unlike a parser process, tests change the config, so don't reuse
+        # targets parsed with another one.
+        parser.load_include(
+            'tools/build/buck/infra_macros/macro_lib/target.py'
+        ).clear_memo_caches()
+
         def read_config_func(s, f, d=None):
             return configs.get((s, f), d)
 
@@ -20,6 +20,9 @@ import itertools
 import pipes
 
 with allow_unsafe_import():
+    import cPickle
+    import hashlib
+    import tempfile
     import warnings
     warnings.simplefilter("ignore", ImportWarning)
     warnings.simplefilter("ignore", DeprecationWarning)
@@ -71,11 +74,11 @@ include_defs('//{}/cxx_sources.py'.format(MACRO_LIB_DIR), 'cxx_sources')
 include_defs('//{}/rule.py'.format(MACRO_LIB_DIR), 'rule_mod')
 include_defs('//{}/convert/base.py'.format(MACRO_LIB_DIR), 'base')
 include_defs('//{}/convert/cpp.py'.format(MACRO_LIB_DIR), 'cpp')
+include_defs('//{}/parse_profiler.py'.format(MACRO_LIB_DIR), 'parse_profiler')
 
 __all__ = []
 
-def get_oss_third_party_config():
-    interpreter = read_config('python#py3', 'interpreter', 'python3')
+def get_oss_third_party_config(interpreter):
     if interpreter.endswith('python3'):
         with allow_unsafe_import():
             import subprocess
@@ -128,19 +131,155 @@ def get_oss_third_party_config():
     }
 
 
-if config.get_third_party_config_path():
-    # Load the third-party config.
-    config_path = os.path.join(CELL_ROOT, config.get_third_party_config_path())
-    add_build_file_dep('//' + config.get_third_party_config_path())
-    with open(config_path) as f:
-        code = compile(f.read(), config_path, 'exec')
-    vals = {}
-    eval(code, vals)
-    third_party_config = vals['config']
-else:
-    # If we're not given a file with a third-party config (like on dev servers)
-    # don't try to load the third-party-config
-    third_party_config = get_oss_third_party_config()
+# Bump this when the format of the cached third-party config changes.
+THIRD_PARTY_CONFIG_CACHE_VERSION = 1
+
+
+def find_executable(name):
+    """
+    Returns the real path of `name`, searching `PATH` if it is not a path,
+    or `None` if it cannot be found.
+    """
+
+    if os.sep in name:
+        candidates = [name]
+    else:
+        candidates = [
+            os.path.join(path, name)
+            for path in os.environ.get('PATH', '').split(os.pathsep)]
+    for candidate in candidates:
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return os.path.realpath(candidate)
+    return None
+
+
+def get_third_party_config_cache_path(key):
+    buck_out = read_config('project', 'buck_out', 'buck-out')
+    return os.path.join(
+        CELL_ROOT,
+        buck_out,
+        'fbcode_macros',
+        'third_party_config-{}.pickle'.format(
+            hashlib.sha1(repr(key)).hexdigest()[:16]))
+
+
+def read_third_party_config_cache(path, key):
+    """
+    Returns the config cached at `path` for `key`, or `None`.
+    """
+
+    try:
+        with open(path, 'rb') as f:
+            cached_key, cached_config = cPickle.load(f)
+    except Exception:
+        # Missing, or written by an incompatible version of this file.
+        return None
+    return cached_config if cached_key == key else None
+
+
+def write_third_party_config_cache(path, key, third_party_config):
+    # Parser processes race to fill the cache, so write to a temporary file
+    # and rename it into place.  The cache is an optimization, so don't fail
+    # the parse if buck-out is not writable.
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), prefix='.third_party_config')
+        with os.fdopen(fd, 'wb') as f:
+            cPickle.dump(
+                (key, third_party_config), f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        pass
+
+
+def load_third_party_config():
+    """
+    Returns the third-party config, from the cache under buck-out if the
+    config file (or, without one, the python3 interpreter) has not changed.
+    """
+
+    if config.get_third_party_config_path():
+        # Load the third-party config.
+        config_path = os.path.join(
+            CELL_ROOT, config.get_third_party_config_path())
+        add_build_file_dep('//' + config.get_third_party_config_path())
+        with open(config_path) as f:
+            contents = f.read()
+        key = (
+            THIRD_PARTY_CONFIG_CACHE_VERSION,
+            config_path,
+            hashlib.sha1(contents).hexdigest(),
+        )
+    else:
+        # If we're not given a file with a third-party config (like on dev
+        # servers) don't try to load the third-party-config, and derive one
+        # from the local python3 instead.
+        interpreter = read_config('python#py3', 'interpreter', 'python3')
+        interpreter_stamp = None
+        if interpreter.endswith('python3'):
+            interpreter_path = find_executable(interpreter)
+            if interpreter_path is not None:
+                st = os.stat(interpreter_path)
+                interpreter_stamp = (
+                    interpreter_path, st.st_mtime, st.st_size)
+        key = (
+            THIRD_PARTY_CONFIG_CACHE_VERSION,
+            interpreter,
+            interpreter_stamp,
+            read_config('cxx', 'default_platform', 'default'),
+            read_config('buckit', 'architecture', 'x86_64'),
+            read_config('buckit', 'gcc_version', '4.9'),
+        )
+
+    cache_path = get_third_party_config_cache_path(key)
+    cached = read_third_party_config_cache(cache_path, key)
+    if cached is not None:
+        return cached
+
+    if config.get_third_party_config_path():
+        code = compile(contents, config_path, 'exec')
+        vals = {}
+        eval(code, vals)
+        third_party_config = vals['config']
+    else:
+        third_party_config = get_oss_third_party_config(interpreter)
+    write_third_party_config_cache(cache_path, key, third_party_config)
+    return third_party_config
+
+
+third_party_config = load_third_party_config()
+
+
+def get_parse_cache_stats():
+    """
+    Returns the hit and miss counts of the process-wide parse caches.
+    """
+
+    stats = base.get_tp2_cache_stats()
+    stats.update(base.target.get_memo_cache_stats())
+    return stats
+
+
+def get_parse_profiler():
+    """
+    Returns the profiler of rule conversion and instantiation, which records
+    nothing unless `fbcode.parse_profile` names an output file.  Each parser
+    process writes its own file, with its process id added to that name.
+    """
+
+    output = read_config('fbcode', 'parse_profile', None)
+    if not output:
+        return parse_profiler.NullParseProfiler()
+    profiler = parse_profiler.ParseProfiler(
+        os.path.join(CELL_ROOT, output),
+        read_config('fbcode', 'parse_profile_format', 'report'))
+    profiler.write_at_exit(get_parse_cache_stats)
+    return profiler
+
+
+PARSE_PROFILER = get_parse_profiler()
 
 
 CXX_RULES = set([
@@ -173,6 +312,31 @@ def require_default_headers_rule():
     return ':' + name
 
 
+class NativeRules(object):
+    """
+    Caches the `native.*` rule functions resolved from a build file's
+    globals, so that they aren't looked up with `eval()` for every rule.
+    """
+
+    def __init__(self):
+        self._globals = None
+        self._rules = {}
+
+    def get(self, globals, rule_type):
+        # Only keep the functions of the build file being parsed.
+        if globals is not self._globals:
+            self._globals = globals
+            self._rules = {}
+        rule = self._rules.get(rule_type)
+        if rule is None:
+            rule = eval("native." + rule_type, globals)
+            self._rules[rule_type] = rule
+        return rule
+
+
+NATIVE_RULES = NativeRules()
+
+
 def rule_handler(context, globals, rule_type, **kwargs):
     """
     Callback that fires when a TARGETS rule is evaluated, converting it into
@@ -182,6 +346,10 @@ def rule_handler(context, globals, rule_type, **kwargs):
     # Wrap the TARGETS rule into a `Rule` object.
     rule = rule_mod.Rule(type=rule_type, attributes=kwargs)
 
+    # Each evaluation of a build file has its own globals, and must glob for
+    # its own headers.
+    cpp.HEADER_INDEX.start_build_file(globals)
+
     # For full auto-headers support, add in the recursive header glob rule
     # as a dep. This is only used in fbcode for targets that don't fully
     # specify their dependencies, and it will be going away in the future
@@ -213,10 +381,14 @@ def rule_handler(context, globals, rule_type, **kwargs):
         rule.attributes.get('name'),
         base_path)
 
-    results = converter.convert(base.Context(**context), base_path, rule)
+    name = rule.attributes.get('name')
+    with PARSE_PROFILER.record('convert', rule.type, base_path, name):
+        results = converter.convert(base.Context(**context), base_path, rule)
     # Instantiate the Buck rules that got converted successfully.
     for converted in results:
-        eval("native." + converted.type, globals)(**converted.attributes)
+        with PARSE_PROFILER.record(
+                'instantiate', converted.type, base_path, name):
+            NATIVE_RULES.get(globals, converted.type)(**converted.attributes)
 
 
 # Helper rule to throw an error when accessing raw Buck rules.